@@ -0,0 +1,435 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.File;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.math.BigInteger;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.security.Permission;
+import java.security.SecureRandom;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.jar.JarFile;
+
+/**
+ * A long-lived JVM running the main classes of jars for runjar and runbcut
+ * (through jvmclient.py), so that every invocation does not pay for JVM
+ * startup and JIT warm-up again. Started and stopped with jvmserver.
+ *
+ * Every request is a localhost TCP connection of its own, sending the
+ * secret token of the server, a command (RUN, PING or STOP) and, for RUN,
+ * the working directory of the client, the classpath, the main class
+ * (empty for the Main-Class of the first jar), whether to share the class
+ * loader with other requests, and the arguments. The server answers with
+ * frames of a channel byte, a length and data: stdout ('O') and stderr
+ * ('E') output of the main method, then its exit code ('X'), or a refusal
+ * ('R') when the request can not be run here, in which case the client runs
+ * it in a JVM of its own.
+ *
+ * A request ends as a JVM of its own would: when System.exit() is called in
+ * any of its threads, with that status, or else when the main method and
+ * all non-daemon threads it started have ended. Threads still running then
+ * are interrupted, and stopped if they do not end within EXIT_GRACE_MILLIS.
+ */
+public class JarServer {
+    static final long EXIT_GRACE_MILLIS = 1000;
+    static final Map<String, ClassLoader> LOADERS = new HashMap<String, ClassLoader>();
+    static volatile boolean stopping = false;
+    static String token;
+    static String workdir;
+
+    static class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    /**
+     * The threads of a request: the thread running the main method, and
+     * every thread started from it, with the client to send their output to
+     */
+    static class Request extends ThreadGroup {
+        final DataOutputStream client;
+        // Output written after the request has ended is dropped
+        volatile boolean closed = false;
+        Integer exitStatus = null;
+        boolean mainFailed = false;
+
+        Request(DataOutputStream client) {
+            super("request");
+            this.client = client;
+            // Destroyed with its last thread
+            setDaemon(true);
+        }
+
+        /**
+         * Record a System.exit() in a thread of the request. Of several, the
+         * first non-zero status counts.
+         */
+        synchronized void exited(int status) {
+            if (exitStatus == null || exitStatus == 0) {
+                exitStatus = status;
+            }
+        }
+
+        synchronized Integer exitStatus() {
+            return exitStatus;
+        }
+
+        synchronized void mainFailed(Throwable e) {
+            if (!(e instanceof ExitException)) {
+                mainFailed = true;
+                System.err.print("Exception in thread \"main\" ");
+                e.printStackTrace();
+            }
+        }
+
+        public void uncaughtException(Thread thread, Throwable e) {
+            // The status of an exit has been recorded, and stopped threads are
+            // stopped by us
+            if (!(e instanceof ExitException) && !(e instanceof ThreadDeath)) {
+                super.uncaughtException(thread, e);
+            }
+        }
+
+        Thread[] liveThreads(boolean daemons) {
+            Thread[] threads = new Thread[activeCount() * 2 + 1];
+            int count = enumerate(threads, true);
+            int live = 0;
+            for (int i = 0; i < count; i++) {
+                if (threads[i].isAlive() && (daemons || !threads[i].isDaemon())) {
+                    threads[live++] = threads[i];
+                }
+            }
+            Thread[] result = new Thread[live];
+            System.arraycopy(threads, 0, result, 0, live);
+            return result;
+        }
+
+        /**
+         * Drop the output of the request from now on
+         */
+        void close() throws IOException {
+            synchronized (client) {
+                closed = true;
+                client.flush();
+            }
+        }
+
+        /**
+         * Wait for the request to end, and return its exit status
+         */
+        int await() throws InterruptedException, IOException {
+            while (exitStatus() == null) {
+                Thread[] threads = liveThreads(false);
+                if (threads.length == 0) {
+                    break;
+                }
+                threads[0].join(100);
+            }
+            end();
+            synchronized (this) {
+                if (exitStatus != null) {
+                    return exitStatus;
+                }
+                return mainFailed ? 1 : 0;
+            }
+        }
+
+        /**
+         * Interrupt the threads left, and stop them if they do not end in
+         * time. The output is closed first, so that no thread is stopped
+         * halfway through writing a frame to the client.
+         */
+        @SuppressWarnings("deprecation")
+        void end() throws InterruptedException, IOException {
+            interrupt();
+            long deadline = System.currentTimeMillis() + EXIT_GRACE_MILLIS;
+            for (Thread thread : liveThreads(true)) {
+                thread.join(Math.max(1, deadline - System.currentTimeMillis()));
+            }
+            close();
+            for (Thread thread : liveThreads(true)) {
+                thread.stop();
+            }
+        }
+    }
+
+    /**
+     * The request the current thread runs for, or null for the threads of
+     * the server itself
+     */
+    static Request currentRequest() {
+        for (ThreadGroup group = Thread.currentThread().getThreadGroup(); group != null; group = group.getParent()) {
+            if (group instanceof Request) {
+                return (Request) group;
+            }
+        }
+        return null;
+    }
+
+    /**
+     * Turns System.exit() in the main classes into an ExitException, after
+     * recording the status with the request, and allows everything else
+     */
+    static class ExitTrap extends SecurityManager {
+        public void checkPermission(Permission perm) {
+        }
+
+        public void checkPermission(Permission perm, Object context) {
+        }
+
+        public void checkExit(int status) {
+            if (!stopping) {
+                Request request = currentRequest();
+                if (request != null) {
+                    request.exited(status);
+                }
+                throw new ExitException(status);
+            }
+        }
+    }
+
+    /**
+     * Sends what is written by a thread running a request to the client of
+     * the request, and anything else to the original stream
+     */
+    static class RoutingStream extends OutputStream {
+        final byte channel;
+        final PrintStream original;
+
+        RoutingStream(char channel, PrintStream original) {
+            this.channel = (byte) channel;
+            this.original = original;
+        }
+
+        public void write(int b) throws IOException {
+            write(new byte[] { (byte) b }, 0, 1);
+        }
+
+        public void write(byte[] b, int off, int len) throws IOException {
+            Request request = currentRequest();
+            if (request == null) {
+                original.write(b, off, len);
+                return;
+            }
+            synchronized (request.client) {
+                if (!request.closed) {
+                    request.client.writeByte(channel);
+                    request.client.writeInt(len);
+                    request.client.write(b, off, len);
+                }
+            }
+        }
+
+        public void flush() throws IOException {
+            Request request = currentRequest();
+            if (request == null) {
+                original.flush();
+                return;
+            }
+            synchronized (request.client) {
+                if (!request.closed) {
+                    request.client.flush();
+                }
+            }
+        }
+    }
+
+    static void frame(DataOutputStream out, char channel, byte[] data) throws IOException {
+        synchronized (out) {
+            out.writeByte((byte) channel);
+            out.writeInt(data.length);
+            out.write(data);
+            out.flush();
+        }
+    }
+
+    static void exitCode(DataOutputStream out, int status) throws IOException {
+        synchronized (out) {
+            out.writeByte((byte) 'X');
+            out.writeInt(4);
+            out.writeInt(status);
+            out.flush();
+        }
+    }
+
+    /**
+     * A class loader of its own for a classpath, or if shared, the one kept
+     * for requests with the same classpath (as long as none of its files
+     * change), so that static state is only shared between requests that
+     * ask for it
+     */
+    static ClassLoader loader(String classpath, boolean shared) throws IOException {
+        String[] entries = classpath.split(File.pathSeparator);
+        URL[] urls = new URL[entries.length];
+        StringBuilder key = new StringBuilder();
+        for (int i = 0; i < entries.length; i++) {
+            File file = new File(entries[i]);
+            urls[i] = file.toURI().toURL();
+            key.append(file.getPath()).append('@').append(file.lastModified()).append(File.pathSeparator);
+        }
+        ClassLoader parent = ClassLoader.getSystemClassLoader().getParent();
+        if (!shared) {
+            return new URLClassLoader(urls, parent);
+        }
+        synchronized (LOADERS) {
+            ClassLoader loader = LOADERS.get(key.toString());
+            if (loader == null) {
+                loader = new URLClassLoader(urls, parent);
+                LOADERS.put(key.toString(), loader);
+            }
+            return loader;
+        }
+    }
+
+    static String manifestMainClass(String jarpath) throws IOException {
+        JarFile jar = new JarFile(jarpath);
+        try {
+            return jar.getManifest().getMainAttributes().getValue("Main-Class");
+        } finally {
+            jar.close();
+        }
+    }
+
+    static String stackTrace(Throwable e) {
+        StringWriter trace = new StringWriter();
+        e.printStackTrace(new PrintWriter(trace, true));
+        return trace.toString();
+    }
+
+    /**
+     * Run the main method in a thread of a new Request, and return the exit
+     * status of the request
+     */
+    static int run(DataOutputStream out, String classpath, String mainClass, boolean shared, final String[] args) throws IOException {
+        final Request request = new Request(out);
+        ClassLoader loader = null;
+        try {
+            loader = loader(classpath, shared);
+            if (mainClass.isEmpty()) {
+                mainClass = manifestMainClass(classpath.split(File.pathSeparator)[0]);
+            }
+            final Method main = loader.loadClass(mainClass).getMethod("main", String[].class);
+            Thread thread = new Thread(request, new Runnable() {
+                public void run() {
+                    try {
+                        main.invoke(null, (Object) args);
+                    } catch (InvocationTargetException e) {
+                        request.mainFailed(e.getCause());
+                    } catch (Exception e) {
+                        request.mainFailed(e);
+                    }
+                }
+            }, "main");
+            thread.setContextClassLoader(loader);
+            thread.start();
+            return request.await();
+        } catch (Exception e) {
+            frame(out, 'E', stackTrace(e).getBytes("UTF-8"));
+            return 1;
+        } finally {
+            request.close();
+            if (!shared && loader instanceof URLClassLoader) {
+                ((URLClassLoader) loader).close();
+            }
+        }
+    }
+
+    static void handle(Socket socket) throws IOException {
+        try {
+            DataInputStream in = new DataInputStream(new BufferedInputStream(socket.getInputStream()));
+            DataOutputStream out = new DataOutputStream(new BufferedOutputStream(socket.getOutputStream()));
+            if (!token.equals(in.readUTF())) {
+                frame(out, 'R', "Wrong token".getBytes("UTF-8"));
+                return;
+            }
+            String command = in.readUTF();
+            if (command.equals("PING")) {
+                frame(out, 'O', ("JVM worker running in " + workdir + "\n").getBytes("UTF-8"));
+                exitCode(out, 0);
+                return;
+            }
+            if (command.equals("STOP")) {
+                exitCode(out, 0);
+                stopping = true;
+                System.exit(0);
+            }
+            String cwd = in.readUTF();
+            String classpath = in.readUTF();
+            String mainClass = in.readUTF();
+            boolean shared = in.readBoolean();
+            String[] args = new String[in.readInt()];
+            for (int i = 0; i < args.length; i++) {
+                args[i] = in.readUTF();
+            }
+            // Relative paths in the arguments are resolved against the working
+            // directory of this JVM, which can not be changed
+            if (!new File(cwd).getCanonicalPath().equals(workdir)) {
+                frame(out, 'R', ("Working directory " + cwd + " is not " + workdir).getBytes("UTF-8"));
+                return;
+            }
+            exitCode(out, run(out, classpath, mainClass, shared, args));
+        } finally {
+            socket.close();
+        }
+    }
+
+    /**
+     * Arguments: the file to write the port, token and working directory
+     * to, and optionally the number of requests to run at once (default:
+     * the number of cores)
+     */
+    public static void main(String[] args) throws IOException {
+        File portfile = new File(args[0]);
+        int threads = args.length > 1 ? Integer.parseInt(args[1]) : Runtime.getRuntime().availableProcessors();
+        workdir = new File(".").getCanonicalPath();
+        token = new BigInteger(130, new SecureRandom()).toString(32);
+        ServerSocket server = new ServerSocket(0, 50, InetAddress.getByName("127.0.0.1"));
+
+        File tmpfile = new File(portfile.getPath() + ".tmp");
+        PrintStream portout = new PrintStream(new FileOutputStream(tmpfile));
+        tmpfile.setReadable(false, false);
+        tmpfile.setReadable(true, true);
+        portout.println(server.getLocalPort() + " " + token + " " + workdir);
+        portout.close();
+        if (!tmpfile.renameTo(portfile)) {
+            throw new IOException("Could not write " + portfile);
+        }
+
+        System.setOut(new PrintStream(new RoutingStream('O', System.out), true));
+        System.setErr(new PrintStream(new RoutingStream('E', System.err), true));
+        System.setSecurityManager(new ExitTrap());
+
+        ExecutorService pool = Executors.newFixedThreadPool(threads);
+        while (true) {
+            final Socket socket = server.accept();
+            pool.execute(new Runnable() {
+                public void run() {
+                    try {
+                        handle(socket);
+                    } catch (IOException e) {
+                        e.printStackTrace();
+                    }
+                }
+            });
+        }
+    }
+}
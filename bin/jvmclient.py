@@ -0,0 +1,147 @@
+'''
+Client of the JVM worker started by jvmserver (see JarServer.java), used by
+runjar and runbcut. Runs a main class on the worker started by the current
+Slurm job (or outside of Slurm, on the worker of this node) when there is
+one, and in a JVM of its own when there is not, or when the worker refuses
+the request (e.g. for another working directory), e.g.:
+
+    python jvmclient.py --jar bin/tool.jar -- args ...
+    python jvmclient.py --classpath lib.jar:tool.jar --main tool -- args ...
+    python jvmclient.py --ping
+
+Every request gets a class loader of its own, so that no static state is
+shared between runs. Set MMJVM_SHARED=1 to have the worker keep the loaded
+classes for later requests with the same classpath, for tools known not to
+keep state in static fields.
+'''
+import argparse
+import os
+import socket
+import struct
+import sys
+
+JAVA_HOME = os.environ.get('MMJVM_JAVA_HOME', '/sw/comp/java/x86_64/sun_jdk1.7.0_25')
+STATE_DIR = os.environ.get('MMJVM_DIR', '/tmp/mmjvm-%s' % os.environ.get('USER', 'nobody'))
+
+def portfile():
+    '''
+    The port file written by jvmserver, which is per Slurm job, so that jobs
+    sharing a node never use each other's workers
+    '''
+    name = socket.gethostname()
+    if os.environ.get('SLURM_JOB_ID'):
+        name += '.job' + os.environ['SLURM_JOB_ID']
+    return os.path.join(STATE_DIR, name + '.port')
+
+def connect():
+    '''
+    A connection to the worker of this job or node, and its token, or
+    (None, None) when there is no worker running
+    '''
+    try:
+        with open(portfile()) as infile:
+            port, token, _ = infile.read().split(None, 2)
+        return socket.create_connection(('127.0.0.1', int(port))), token
+    except (IOError, OSError, ValueError, socket.error):
+        return None, None
+
+def pack_utf(text):
+    '''
+    A string as read by DataInputStream.readUTF. Byte strings (paths and
+    arguments, in Python 2) are taken to be in the file system encoding.
+    '''
+    if isinstance(text, bytes):
+        text = text.decode(sys.getfilesystemencoding())
+    data = text.encode('utf-8')
+    return struct.pack('>H', len(data)) + data
+
+def read_exactly(infile, size):
+    data = infile.read(size)
+    if len(data) < size:
+        raise IOError('JVM worker closed the connection')
+    return data
+
+def send(sock, token, command, body=b''):
+    '''
+    Send a request and relay the output it produces. Returns the exit code,
+    or None if the request was refused before producing any output.
+    '''
+    sock.sendall(pack_utf(token) + pack_utf(command) + body)
+    infile = sock.makefile('rb')
+    produced_output = False
+    try:
+        while True:
+            channel, length = struct.unpack('>ci', read_exactly(infile, 5))
+            data = read_exactly(infile, length)
+            if channel == b'O':
+                sys.stdout.write(data)
+                produced_output = True
+            elif channel == b'E':
+                sys.stderr.write(data)
+                produced_output = True
+            elif channel == b'X':
+                return struct.unpack('>i', data)[0]
+            elif channel == b'R':
+                sys.stderr.write('JVM worker refused the request: %s\n' % data.decode('utf-8'))
+                return None
+    except IOError:
+        if produced_output:
+            # Running it again would repeat the output
+            sys.stderr.write('JVM worker died while running the request\n')
+            return 1
+        return None
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        infile.close()
+        sock.close()
+
+def run_request(classpath, main, args):
+    try:
+        body = (pack_utf(os.getcwd()) +
+                pack_utf(classpath) +
+                pack_utf(main) +
+                struct.pack('>?', os.environ.get('MMJVM_SHARED') == '1') +
+                struct.pack('>i', len(args)) +
+                b''.join(pack_utf(a) for a in args))
+    except UnicodeDecodeError:
+        # Not in the file system encoding, so passed on to a JVM of its own as is
+        return None
+    sock, token = connect()
+    if sock is None:
+        return None
+    return send(sock, token, 'RUN', body)
+
+def run_oneshot(classpath, main, jar, args):
+    java = os.path.join(JAVA_HOME, 'bin', 'java')
+    if jar is not None:
+        os.execv(java, [java, '-jar', jar] + args)
+    os.execv(java, [java, '-classpath', classpath, main] + args)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a jar on the JVM worker of this node, or in a JVM of its own')
+    parser.add_argument('--jar', help='Jar with a Main-Class')
+    parser.add_argument('--classpath', help='Instead of --jar')
+    parser.add_argument('--main', default='', help='Main class, with --classpath')
+    parser.add_argument('--ping', action='store_true', help='Check that the worker is running')
+    parser.add_argument('--stop', action='store_true', help='Stop the worker')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    if args.ping or args.stop:
+        sock, token = connect()
+        if sock is None:
+            sys.stderr.write('No JVM worker running on this node\n')
+            sys.exit(1)
+        sys.exit(send(sock, token, 'PING' if args.ping else 'STOP') or 0)
+    jvm_args = args.args[1:] if args.args[:1] == ['--'] else args.args
+    if args.jar is not None:
+        classpath = os.path.abspath(args.jar)
+    else:
+        classpath = os.pathsep.join(os.path.abspath(p) for p in args.classpath.split(os.pathsep))
+    status = run_request(classpath, args.main if args.jar is None else '', jvm_args)
+    if status is None:
+        run_oneshot(args.classpath, args.main, args.jar, jvm_args)
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
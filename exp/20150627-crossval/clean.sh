@@ -5,6 +5,7 @@ case $response in
         rm *.{log,audit};
         rm log/*.log;
         rm data/*.sign*;
+        rm -rf data/.cas;
         rm -rf audit/.audit_*
         rm audit/*.audit
         ;;
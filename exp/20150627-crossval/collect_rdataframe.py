@@ -1,74 +1,135 @@
-from ConfigParser import ConfigParser
-import dataset
+import argparse
 import glob
+import json
+import logging
+import mmaudit
+import multiprocessing
+import os
 import sciluigi as sl
 import csv
 import re
+import time
+
+log = logging.getLogger(__name__)
+
+AUDIT_FILES = 'audit/workflow_mmlinear_started_20151026_17*'
+RMSD_FILES = ['data/*ungz.s12*.rmsd', 'data/*ungz.g*.svm.pred.rmsd']
+COLUMNS = ['dataset', 'learning_method', 'training_size', 'replicate', 'rmsd', 'model_creation_time', 'cost']
 
 def main():
-    audit_table = parse_audit_files()
+    parser = argparse.ArgumentParser(description='Collect the RMSDs of the MM workflow runs into a CSV file for R')
+    parser.add_argument('--output', default='rdataframe.csv')
+    parser.add_argument('--incremental', action='store_true', help='Only parse the RMSD files changed since the last collection, and append their rows, instead of starting over')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+    logging.basicConfig(format='%(levelname)s: %(message)s')
 
-    dataframe = []
-    glob_pattern = 'data/*ungz.s12*.rmsd'
-    rmsd_paths = glob.glob(glob_pattern)
-    for rp in rmsd_paths:
-        datarow = {}
-        ms = re.match('data/(solubility|acd_logd).smi.h1_3.sign.(r[0-9]).([0-9]+)_([0-9]+|rest)_rand_trn.csr.ungz.s12_c([0-9\.]+).(lin|svm)mdl.pred.rmsd', rp)
-        m = ms.groups()
-        datarow['dataset'] = m[0]
-        datarow['replicate'] = m[1]
-        datarow['test_size'] = m[2]
-        datarow['training_size'] = m[3]
-        datarow['cost'] = m[4]
-        if m[5] == 'lin':
-            datarow['learning_method'] = 'liblinear'
-        elif m[5] == 'svm':
-            datarow['learning_method'] = 'svmrbf'
-        with open(rp) as rf:
-            rd = sl.util.recordfile_to_dict(rf)
-            datarow['rmsd'] = rd['rmsd']
-            datarow['cost'] = rd['cost']
-            dataframe.append(datarow)
-    with open('rdataframe.csv', 'w') as fh:
+    # The line of each RMSD file's row in the output, as of the last collection
+    statepath = args.output + '.collected'
+    started = time.time()
+    state = {'collected_at': 0, 'lines': {}}
+    if args.incremental and os.path.exists(args.output) and os.path.exists(statepath):
+        with open(statepath) as statefile:
+            collected = json.load(statefile)
+        # A state from before the line index starts the collection over
+        if 'lines' in collected:
+            state = collected
+    all_paths = [rp for pattern in RMSD_FILES for rp in glob.glob(pattern)]
+    # Rows of files re-run since, or gone, are dropped, and the re-run ones parsed again
+    lines = dict((rp, state['lines'][rp]) for rp in all_paths
+                 if rp in state['lines'] and os.path.getmtime(rp) <= state['collected_at'])
+    rmsd_paths = sorted(rp for rp in all_paths if rp not in lines)
+    if len(lines) < len(state['lines']):
+        lines = drop_stale_rows(args.output, lines)
+
+    pool = multiprocessing.Pool(args.workers)
+    exectimes = read_exectimes()
+    with open(args.output, 'a' if lines else 'w') as fh:
         csvwrt = csv.writer(fh)
-        csvwrt.writerow(['dataset', 'learning_method', 'training_size', 'replicate', 'rmsd', 'model_creation_time', 'cost'])
-        for row in dataframe:
+        if not lines:
+            csvwrt.writerow(COLUMNS)
+        for rp, row in zip(rmsd_paths, pool.imap(parse_rmsd_file, rmsd_paths, chunksize=64)):
+            if row is None:
+                log.warn('Skipping %s, not named like the RMSD files of the MM workflows', rp)
+                continue
+            # The audit store only has the times of the liblinear trainings
+            model_creation_time = 'N/A'
+            if row['learning_method'] == 'liblinear':
+                model_creation_time = exectimes.get((row['training_size'], row['test_size'], norm_cost(row['cost'])), 'N/A')
+            csvwrt.writerow([row['dataset'], row['learning_method'], row['training_size'], row['replicate'], row['rmsd'], model_creation_time, row['cost']])
+            lines[rp] = len(lines) + 1
+    pool.close()
+    pool.join()
+
+    with open(statepath, 'w') as statefile:
+        json.dump({'collected_at': started, 'lines': lines}, statefile)
 
-            auditrow = audit_table.find_one(training_size=row['training_size'], test_size=row['test_size'])
-            if auditrow is not None:
-                model_creation_time = int(dict(auditrow)['slurm_exectime_sec'])
-            else:
-                model_creation_time = 'N/A'
+def drop_stale_rows(output, lines):
+    '''
+    Rewrite the output with only the rows of the given lines (numbered from
+    the first row after the header), returning the lines renumbered to match
+    '''
+    kept = dict((line, rp) for rp, line in lines.iteritems())
+    renumbered = {}
+    with open(output) as infile, open(output + '.tmp', 'w') as outfile:
+        outfile.write(infile.readline())
+        for line, text in enumerate(infile, 1):
+            if line in kept:
+                outfile.write(text)
+                renumbered[kept[line]] = len(renumbered) + 1
+    os.rename(output + '.tmp', output)
+    return renumbered
 
-            outrow = [row['dataset'], row['learning_method'], row['training_size'], row['replicate'], row['rmsd'], model_creation_time, row['cost']]
-            print outrow
-            csvwrt.writerow(outrow)
+def parse_rmsd_file(rp):
+    datarow = {}
+    ms = re.match('data/(solubility|acd_logd).smi.h1_3.sign.(r[0-9]).([0-9]+)_([0-9]+|rest)_n?rand_trn.csr.ungz.(?:s12_c([0-9\.]+).(lin)mdl|g[0-9p]+_c([0-9\.]+)_s[0-9]+_t[0-9]+(.cascade[0-9]+)?.(svm)).pred.rmsd', rp)
+    if ms is None:
+        return None
+    m = ms.groups()
+    datarow['dataset'] = m[0]
+    datarow['replicate'] = m[1]
+    datarow['test_size'] = m[2]
+    datarow['training_size'] = m[3]
+    if m[5] == 'lin':
+        datarow['cost'] = m[4]
+        datarow['learning_method'] = 'liblinear'
+    elif m[8] == 'svm':
+        datarow['cost'] = m[6]
+        # A cascade SVM, as svmrbf_cascade<layers>, apart from the SVMs trained on the whole train set
+        datarow['learning_method'] = 'svmrbf' + (m[7] or '').replace('.', '_')
+    with open(rp) as rf:
+        rd = sl.util.recordfile_to_dict(rf)
+        datarow['rmsd'] = rd['rmsd']
+        datarow['cost'] = rd['cost']
+    return datarow
 
+def norm_cost(cost):
+    return '%g' % float(cost)
 
-def parse_audit_files():
-    audit_paths = glob.glob('audit/workflow_mmlinear_started_20151026_17*')
-    audit_data = []
-    for path in audit_paths:
-        with open(path) as fh:
-            cp = ConfigParser()
-            cp.readfp(fh)
-            for sec in cp.sections():
-                dat = dict(cp.items(sec))
-                if 'train_lin' in dat['instance_name']:
-                    ms = re.match('train_lin_trn([0-9]+|rest)_tst([0-9]+)_c([0-9\.]+)', dat['instance_name'])
-                    if ms is None:
-                        raise Exception('No match in name: ' + dat['instance_name'])
-                    m = ms.groups()
-                    dat['training_size'] = m[0]
-                    dat['test_size'] = m[1]
-                    dat['cost'] = m[2]
-                    audit_data.append(dat)
-    db = dataset.connect('sqlite:///:memory:')
-    tbl = db['audit']
-    for d in audit_data:
-        tbl.insert(d)
-    return tbl
+def read_exectimes():
+    '''
+    The execution times of the liblinear trainings in the audit store, by
+    (training size, test size, cost), for a hash join with the RMSDs. Taken
+    from the records written live by the workflows, and for the trainings
+    not found there, from the audit files of runs from before the store.
+    '''
+    audit_db = mmaudit.connect()
+    exectimes = {}
+    for auditrow in mmaudit.find_runs(audit_db, method='liblinear'):
+        # Only the live records have a task family
+        if auditrow['task_family'] is None:
+            continue
+        add_exectime(exectimes, auditrow, auditrow['slurm_exectime_sec'] or auditrow['task_exectime_sec'])
+    mmaudit.import_audit_files(AUDIT_FILES, audit_db)
+    for auditrow in mmaudit.find_runs(audit_db, source=AUDIT_FILES, method='liblinear'):
+        add_exectime(exectimes, auditrow, auditrow['slurm_exectime_sec'])
+    return exectimes
 
+def add_exectime(exectimes, auditrow, seconds):
+    if auditrow['cost'] is None or seconds is None:
+        return
+    key = (auditrow['train_size'], auditrow['test_size'], norm_cost(auditrow['cost']))
+    exectimes.setdefault(key, int(seconds))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,253 @@
+'''
+An indexed SQLite store of audit records for the MM workflows, written to
+as tasks finish (see enable_audit_store), and queried by dataset, method,
+train size, test size, replicate and cost, instead of re-parsing every
+audit file for every report.
+
+The audit files written by sciluigi can be imported with
+import_audit_files, which skips files already imported and unchanged.
+'''
+from ConfigParser import ConfigParser
+import glob
+import json
+import luigi
+import os
+import re
+import sciluigi as sl
+import sqlite3
+import sys
+import time
+
+AUDIT_DB = 'audit/audit.sqlite'
+
+# Columns that can be queried on, all indexed together, in this order
+KEY_COLUMNS = ['dataset', 'method', 'train_size', 'test_size', 'replicate', 'cost']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS task_runs (
+    source TEXT NOT NULL,
+    instance_name TEXT NOT NULL,
+    task_family TEXT,
+    dataset TEXT,
+    method TEXT,
+    train_size TEXT,
+    test_size TEXT,
+    replicate TEXT,
+    cost TEXT,
+    start_time REAL,
+    end_time REAL,
+    task_exectime_sec REAL,
+    slurm_exectime_sec REAL,
+    input_bytes INTEGER,
+    maxrss_kb INTEGER,
+    params TEXT,
+    PRIMARY KEY (source, instance_name)
+);
+CREATE INDEX IF NOT EXISTS task_runs_keys ON task_runs (%s);
+CREATE INDEX IF NOT EXISTS task_runs_sizes ON task_runs (train_size, test_size, cost);
+CREATE INDEX IF NOT EXISTS task_runs_family ON task_runs (task_family);
+CREATE TABLE IF NOT EXISTS imported_files (
+    path TEXT PRIMARY KEY,
+    mtime REAL
+);
+''' % ', '.join(KEY_COLUMNS)
+
+COLUMNS = ['source', 'instance_name', 'task_family'] + KEY_COLUMNS + \
+          ['start_time', 'end_time', 'task_exectime_sec', 'slurm_exectime_sec', 'input_bytes', 'maxrss_kb', 'params']
+
+# Training tasks, by instance name prefix (for the audit files) and by task
+# family prefix (for the live records)
+METHODS_BY_INSTANCE = [('train_lin', 'liblinear'), ('trainlin', 'liblinear'), ('train_svm', 'svmrbf'), ('train_approx', 'approxrbf')]
+METHODS_BY_FAMILY = [('TrainLinearModel', 'liblinear'), ('TrainSVMModel', 'svmrbf'), ('TrainApproxRBFModel', 'approxrbf')]
+
+def connect(path=AUDIT_DB):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    conn = sqlite3.connect(path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    if conn.execute("SELECT name FROM sqlite_master WHERE name = 'task_runs'").fetchone() is not None:
+        # Stores created before the peak memory was recorded
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(task_runs)')]
+        if 'maxrss_kb' not in columns:
+            with conn:
+                conn.execute('ALTER TABLE task_runs ADD COLUMN maxrss_kb INTEGER')
+    conn.executescript(SCHEMA)
+    return conn
+
+def insert_runs(conn, records):
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO task_runs (%s) VALUES (%s)' % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                         [[r.get(c) for c in COLUMNS] for r in records])
+
+def find_runs(conn=None, source=None, **keys):
+    '''
+    The task runs matching all the given KEY_COLUMNS (or task_family) values,
+    and optionally a glob pattern for the source, as dicts, with the
+    parameters decoded
+    '''
+    if conn is None:
+        conn = connect()
+    for key in keys:
+        if key not in KEY_COLUMNS + ['task_family']:
+            raise Exception('Can not query on %s, only on: %s' % (key, ', '.join(KEY_COLUMNS + ['task_family'])))
+    conditions = ['%s = ?' % k for k in sorted(keys)]
+    values = [str(keys[k]) for k in sorted(keys)]
+    if source is not None:
+        conditions.append('source GLOB ?')
+        values.append(source)
+    query = 'SELECT * FROM task_runs'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    runs = []
+    for row in conn.execute(query, values):
+        run = dict(zip(row.keys(), row))
+        run['params'] = json.loads(run['params']) if run['params'] else {}
+        runs.append(run)
+    return runs
+
+def find_one(conn=None, source=None, **keys):
+    runs = find_runs(conn, source, **keys)
+    if runs:
+        return runs[0]
+    return None
+
+# ================================================================================
+#  Live records
+# ================================================================================
+
+def method_of(task_family=None, instance_name=None):
+    if task_family is not None:
+        for prefix, method in METHODS_BY_FAMILY:
+            if task_family.startswith(prefix):
+                return method
+    if instance_name is not None:
+        for prefix, method in METHODS_BY_INSTANCE:
+            if instance_name.startswith(prefix):
+                return method
+    return None
+
+def task_input_bytes(task):
+    paths = []
+    def collect(item):
+        if callable(item):
+            item = item()
+        if isinstance(item, list):
+            for i in item:
+                collect(i)
+        elif isinstance(item, dict):
+            for i in item.values():
+                collect(i)
+        else:
+            paths.append(item.path)
+    for name, value in task.__dict__.items():
+        if name.startswith('in_') and value is not None:
+            collect(value)
+    size = 0
+    for path in paths:
+        if os.path.isdir(path):
+            size += sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        elif os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+def task_record(task, processing_time):
+    '''
+    The audit record of a finished task, taking the key values from the task
+    parameters, or else from the parameters of its workflow
+    '''
+    params = dict((name, str(value)) for name, value in task.param_kwargs.items()
+                  if name not in ['workflow_task', 'slurminfo'])
+    workflow = task.workflow_task
+    def lookup(*names):
+        for name in names:
+            if params.get(name) not in [None, 'None']:
+                return params[name]
+        for name in names:
+            if getattr(workflow, name, None) is not None:
+                return str(getattr(workflow, name))
+        return None
+    now = time.time()
+    return {'source': workflow.task_id,
+            'instance_name': task.instance_name,
+            'task_family': task.task_family,
+            'dataset': lookup('dataset_name'),
+            'method': method_of(task.task_family, task.instance_name),
+            'train_size': lookup('train_size'),
+            'test_size': lookup('test_size'),
+            'replicate': lookup('replicate_id'),
+            'cost': lookup('lin_cost', 'svm_cost'),
+            'start_time': now - processing_time,
+            'end_time': now,
+            'task_exectime_sec': processing_time,
+            'slurm_exectime_sec': getattr(task, 'slurm_exectime_sec', None),
+            'input_bytes': task_input_bytes(task),
+            'maxrss_kb': getattr(task, 'maxrss_kb', None),
+            'params': json.dumps(params, sort_keys=True)}
+
+def record_task(task, processing_time):
+    if not isinstance(task, sl.Task) or isinstance(task, sl.WorkflowTask):
+        return
+    conn = connect()
+    insert_runs(conn, [task_record(task, processing_time)])
+    conn.close()
+
+def enable_audit_store():
+    '''
+    Write an audit record to the store every time a task has finished
+    '''
+    luigi.Task.event_handler(luigi.Event.PROCESSING_TIME)(record_task)
+
+# ================================================================================
+#  Audit files
+# ================================================================================
+
+def parse_audit_file(path):
+    '''
+    The records of an audit file written by sciluigi, with the key values
+    taken from the instance names of the training tasks, like
+    train_lin_trn<train size>_tst<test size>_c<cost>_<replicate>
+    '''
+    with open(path) as auditfile:
+        cp = ConfigParser()
+        cp.readfp(auditfile)
+    records = []
+    for section in cp.sections():
+        dat = dict(cp.items(section))
+        instance_name = dat.get('instance_name', section)
+        record = {'source': path,
+                  'instance_name': instance_name,
+                  'method': method_of(instance_name=instance_name),
+                  'params': json.dumps(dat, sort_keys=True)}
+        for col in ['start_time', 'end_time', 'task_exectime_sec', 'slurm_exectime_sec']:
+            try:
+                record[col] = float(dat[col])
+            except (KeyError, ValueError):
+                pass
+        ms = re.match('.*_trn([0-9]+|rest)_tst([0-9]+)(_g[0-9\.]+)?_c([0-9\.]+)(_(r[0-9]+))?', instance_name)
+        if ms is not None:
+            record['train_size'], record['test_size'], _, record['cost'], _, record['replicate'] = ms.groups()
+        records.append(record)
+    return records
+
+def import_audit_files(pattern='audit/workflow_*', conn=None):
+    '''
+    Import the audit files matching pattern, skipping those already imported
+    and unchanged since. Returns the number of files imported.
+    '''
+    if conn is None:
+        conn = connect()
+    imported = dict((row['path'], row['mtime']) for row in conn.execute('SELECT path, mtime FROM imported_files'))
+    count = 0
+    for path in sorted(glob.glob(pattern)):
+        mtime = os.path.getmtime(path)
+        if imported.get(path) == mtime:
+            continue
+        insert_runs(conn, parse_audit_file(path))
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO imported_files (path, mtime) VALUES (?, ?)', (path, mtime))
+        count += 1
+    return count
+
+if __name__ == '__main__':
+    for pattern in sys.argv[1:] or ['audit/workflow_*']:
+        print 'Imported %d audit files for %s' % (import_audit_files(pattern), pattern)
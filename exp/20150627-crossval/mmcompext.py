@@ -0,0 +1,1275 @@
+'''
+Components complementing the ones in mmcomp, for making the MM and
+cross-validation workflows faster. The heavy lifting is done by mmtools.py,
+which is executed through self.ex(), so that it is run with the SlurmInfo of
+the task.
+'''
+from mmcomp import AssessLinearRMSD, AssessSVMRMSD, CountLines, CreateFolds, CreateReplicateCopy, CreateRunCopy, CreateSparseTestDataset, CreateSparseTrainDataset, GenerateSignaturesFilterSubstances, PredictLinearModel, PredictSVMModel, ShuffleLines, TrainLinearModel, TrainSVMModel, UnGzipFile
+import hashlib
+import logging
+import luigi
+import math
+import mmaudit
+import numpy as np
+import os
+import pipes
+import sciluigi as sl
+import shutil
+import subprocess as sub
+import tempfile
+
+MMTOOLS = 'python ' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mmtools.py')
+CAS_DIR = 'data/.cas'
+
+log = logging.getLogger('sciluigi-interface')
+
+def dict_port(outport, key):
+    '''
+    Turn one item of an out-port returning a dict of targets, into something
+    that can be connected to an in-port
+    '''
+    return lambda: outport()[key]
+
+def file_sha1(path, bufsize=16*1024*1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for data in iter(lambda: infile.read(bufsize), ''):
+            digest.update(data)
+    return digest.hexdigest()
+
+def link_or_copy(src, dst):
+    '''
+    Hard-link src to dst, falling back to copying when on different file
+    systems
+    '''
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+# ================================================================================
+#  Concurrency limits
+#
+#  Every task with a SlurmInfo is given luigi resources by the class of job it
+#  runs as, so that the scheduler never runs more of each class at once than
+#  the [resources] section of client.cfg allows, however many workers there
+#  are.
+# ================================================================================
+
+def slurm_resource(slurminfo):
+    '''
+    The luigi resource used by a task run with slurminfo, and how much of
+    it: a whole node (for the node partition), or a number of cores, locally
+    or on the cluster
+    '''
+    if slurminfo.runmode == sl.RUNMODE_LOCAL:
+        return 'local_cores', int(slurminfo.cores)
+    elif slurminfo.partition == 'node':
+        return 'slurm_nodes', 1
+    else:
+        return 'slurm_cores', int(slurminfo.cores)
+
+def resource_limit(resource):
+    '''
+    The amount of a resource configured in client.cfg, or None if it is not
+    configured
+    '''
+    config = luigi.configuration.get_config()
+    if not config.has_option('resources', resource):
+        return None
+    return config.getint('resources', resource)
+
+def slurm_resources(slurminfo):
+    '''
+    The luigi resources used by a task run with slurminfo
+    '''
+    resource, amount = slurm_resource(slurminfo)
+    limit = resource_limit(resource)
+    if limit is None:
+        # The scheduler would allow only one unit of an unconfigured resource
+        return {}
+    # A task needing more than the limit would never be scheduled
+    return {resource: min(amount, limit)}
+
+class LimitedConcurrency(object):
+    '''
+    Mixin for WorkflowTasks, giving each new task that has a SlurmInfo the
+    resources of slurm_resources. Put it first among the base classes.
+    '''
+    def new_task(self, instance_name, cls, **kwargs):
+        task = super(LimitedConcurrency, self).new_task(instance_name, cls, **kwargs)
+        if kwargs.get('slurminfo') is not None:
+            task.resources = slurm_resources(kwargs['slurminfo'])
+        return task
+
+# ================================================================================
+#  Content-addressed results
+#
+#  Outputs of content-addressed tasks are stored in CAS_DIR, keyed by a hash
+#  of the task family, its parameters and the content of its inputs, and are
+#  hard-linked into place instead of computed again, whenever a task with the
+#  same key has already been run, in any workflow.
+# ================================================================================
+
+def content_digest(path):
+    '''
+    The SHA-1 of the content of a file, remembered in CAS_DIR for as long as
+    the size and modification time of the file stay the same
+    '''
+    stat = os.stat(path)
+    digestpath = os.path.join(CAS_DIR, 'digests', hashlib.sha1(os.path.abspath(path)).hexdigest())
+    stamp = '%d %f' % (stat.st_size, stat.st_mtime)
+    if os.path.exists(digestpath):
+        with open(digestpath) as digestfile:
+            cached_stamp, digest = digestfile.read().rsplit(' ', 1)
+        if cached_stamp == stamp:
+            return digest
+    digest = file_sha1(path)
+    if not os.path.isdir(os.path.dirname(digestpath)):
+        os.makedirs(os.path.dirname(digestpath))
+    with open(digestpath, 'w') as digestfile:
+        digestfile.write('%s %s' % (stamp, digest))
+    return digest
+
+def target_paths(item):
+    '''
+    Paths of the targets in a port value (callable, TargetInfo, list or dict)
+    '''
+    if callable(item):
+        item = item()
+    if isinstance(item, list):
+        return [p for i in item for p in target_paths(i)]
+    if isinstance(item, dict):
+        return [p for k in sorted(item) for p in target_paths(item[k])]
+    return [item.path]
+
+class ContentAddressed(object):
+    '''
+    Mixin for tasks whose outputs only depend on their parameters and the
+    content of their inputs, for reusing outputs from the content-addressed
+    store. Put it first among the base classes.
+    '''
+    cas_ignore_params = ['instance_name', 'workflow_task', 'slurminfo']
+
+    def cas_key(self):
+        digest = hashlib.sha1(self.task_family)
+        for name, _ in self.get_params():
+            if name not in self.cas_ignore_params:
+                digest.update('%s=%s\n' % (name, self.param_kwargs[name]))
+        for name in sorted(self.__dict__):
+            if name.startswith('in_') and self.__dict__[name] is not None:
+                for path in target_paths(self.__dict__[name]):
+                    digest.update('%s=%s\n' % (name, content_digest(path)))
+        return digest.hexdigest()
+
+    def run(self):
+        entry = os.path.join(CAS_DIR, self.cas_key())
+        outpaths = target_paths(self.output)
+        if os.path.isdir(entry):
+            for i, outpath in enumerate(outpaths):
+                link_or_copy(os.path.join(entry, str(i)), outpath)
+            return
+        super(ContentAddressed, self).run()
+        if all(os.path.isfile(p) for p in outpaths):
+            tmpentry = entry + '.tmp'
+            if os.path.exists(tmpentry):
+                shutil.rmtree(tmpentry)
+            os.makedirs(tmpentry)
+            for i, outpath in enumerate(outpaths):
+                link_or_copy(outpath, os.path.join(tmpentry, str(i)))
+            os.rename(tmpentry, entry)
+
+class LinkRunCopy(CreateRunCopy):
+    '''
+    CreateRunCopy, hard-linking the file instead of copying it
+    '''
+    def run(self):
+        link_or_copy(self.in_file().path, self.out_copy().path)
+
+class LinkReplicateCopy(CreateReplicateCopy):
+    '''
+    CreateReplicateCopy, hard-linking the file instead of copying it
+    '''
+    def run(self):
+        link_or_copy(self.in_file().path, self.out_copy().path)
+
+class GenerateSignaturesFilterSubstancesCached(ContentAddressed, GenerateSignaturesFilterSubstances):
+    '''
+    GenerateSignaturesFilterSubstances, reusing the signatures generated
+    earlier for the same SMILES and heights, in any workflow
+    '''
+    cas_ignore_params = ContentAddressed.cas_ignore_params + ['replicate_id', 'dataset_name']
+
+# ================================================================================
+#  Resource estimation
+#
+#  Tasks with the EstimatedResources mixin have the size of their inputs,
+#  their execution time and (when run locally) the peak memory of their
+#  commands recorded in the audit store (see mmaudit). Once there are enough
+#  earlier runs of the same component with the same hyperparameters, the
+#  walltime and cores of their SlurmInfo are set from a log-log fit to them,
+#  the hand-set values being only the fallback.
+# ================================================================================
+
+RESOURCE_MIN_HISTORY = 3
+MEM_PER_CORE_MB = 8000 # Memory is allotted per core on the core partition
+MIN_WALLTIME_SEC = 15 * 60
+MAX_WALLTIME_SEC = 10 * 24 * 3600
+
+def fit_loglog(sizes, values, size):
+    '''
+    Predict the value for size from a least-squares fit of log(value) on
+    log(size), adding a margin of two standard deviations of the residuals,
+    but at least 50%
+    '''
+    xs = [math.log(max(x, 1)) for x in sizes]
+    ys = [math.log(max(y, 1)) for y in values]
+    xmean = sum(xs) / len(xs)
+    ymean = sum(ys) / len(ys)
+    sxx = sum((x - xmean) ** 2 for x in xs)
+    slope = sum((x - xmean) * (y - ymean) for x, y in zip(xs, ys)) / sxx if sxx > 0 else 0.0
+    residuals = [y - ymean - slope * (x - xmean) for x, y in zip(xs, ys)]
+    margin = max(2 * math.sqrt(sum(r ** 2 for r in residuals) / len(residuals)), math.log(1.5))
+    return math.exp(ymean + slope * (math.log(max(size, 1)) - xmean) + margin)
+
+def format_walltime(seconds):
+    minutes = int(math.ceil(seconds / 60.0))
+    return '%d-%02d:%02d:00' % (minutes // (24 * 60), minutes // 60 % 24, minutes % 60)
+
+class EstimatedResources(object):
+    '''
+    Mixin for SlurmTasks, setting the walltime and cores of the task from the
+    size of its inputs, the parameters in resource_params, and the earlier
+    runs of the same component in the audit store. Put it first among the
+    base classes.
+    '''
+    resource_params = []
+    maxrss_kb = None # Peak memory of the commands run locally, for the audit store
+
+    def resource_families(self):
+        '''
+        The task families whose runs are taken into account: this one, and
+        the one of the component without the estimation
+        '''
+        for cls in type(self).__mro__:
+            if issubclass(cls, luigi.Task) and not issubclass(cls, EstimatedResources):
+                return [self.task_family, cls.__name__]
+        return [self.task_family]
+
+    def resource_history(self):
+        '''
+        The (input bytes, seconds, peak memory in kB or None) of the earlier
+        runs with the same resource_params
+        '''
+        conn = mmaudit.connect()
+        history = []
+        for family in self.resource_families():
+            for run in mmaudit.find_runs(conn, task_family=family):
+                if any(run['params'].get(name) != str(self.param_kwargs[name]) for name in self.resource_params):
+                    continue
+                seconds = run['slurm_exectime_sec'] or run['task_exectime_sec']
+                if run['input_bytes'] is None or seconds is None:
+                    continue
+                history.append((run['input_bytes'], seconds, run['maxrss_kb']))
+        conn.close()
+        return history
+
+    def estimate_resources(self, size):
+        history = self.resource_history()
+        if len(history) < RESOURCE_MIN_HISTORY:
+            return
+        seconds = fit_loglog([h[0] for h in history], [h[1] for h in history], size)
+        self.slurminfo.time = format_walltime(min(max(seconds, MIN_WALLTIME_SEC), MAX_WALLTIME_SEC))
+        memhistory = [h for h in history if h[2] is not None]
+        if self.slurminfo.partition == 'core' and len(memhistory) >= RESOURCE_MIN_HISTORY:
+            mem_mb = fit_loglog([h[0] for h in memhistory], [h[2] for h in memhistory], size) / 1024
+            cores = max(int(self.slurminfo.cores), int(math.ceil(mem_mb / MEM_PER_CORE_MB)))
+            # Never more cores than the concurrency limits allow (see slurm_resources)
+            limit = resource_limit(slurm_resource(self.slurminfo)[0])
+            if limit is not None:
+                cores = min(cores, limit)
+            self.slurminfo.cores = str(cores)
+        log.info('Estimated resources for %s (%d input bytes): time=%s, cores=%s' % (self.instance_name, size, self.slurminfo.time, self.slurminfo.cores))
+
+    def ex_local(self, command):
+        '''
+        Execute command as sciluigi does, but when running locally, measure
+        the peak memory of the command itself (and of the processes it waits
+        for), rather than of all children of the worker
+        '''
+        if self.slurminfo.runmode != sl.RUNMODE_LOCAL:
+            # Commands run through salloc, whose memory use says nothing
+            return super(EstimatedResources, self).ex_local(command)
+        if isinstance(command, list):
+            command = sub.list2cmdline(command)
+        log.info('Executing command: ' + str(command))
+        outfile = tempfile.TemporaryFile()
+        errfile = tempfile.TemporaryFile()
+        try:
+            proc = sub.Popen(command, shell=True, stdout=outfile, stderr=errfile)
+            _, status, rusage = os.wait4(proc.pid, 0)
+            if os.WIFSIGNALED(status):
+                proc.returncode = -os.WTERMSIG(status)
+            else:
+                proc.returncode = os.WEXITSTATUS(status)
+            outfile.seek(0)
+            stdout = outfile.read()
+            errfile.seek(0)
+            stderr = errfile.read()
+        finally:
+            outfile.close()
+            errfile.close()
+        self.maxrss_kb = max(self.maxrss_kb or 0, rusage.ru_maxrss)
+        if len(stderr) == 0:
+            stderr = '(empty)'
+        if proc.returncode != 0:
+            errmsg = ('Command failed (retcode {ret}): {cmd}\n'
+                      'Command output: {out}\n'
+                      'Command stderr: {err}').format(ret=proc.returncode, cmd=command, out=stdout, err=stderr)
+            log.error(errmsg)
+            raise Exception(errmsg)
+        return (proc.returncode, stdout, stderr)
+
+    def run(self):
+        self.estimate_resources(mmaudit.task_input_bytes(self))
+        super(EstimatedResources, self).run()
+
+class TrainLinearModelEstimated(EstimatedResources, TrainLinearModel):
+    resource_params = ['lin_type', 'lin_cost']
+
+class TrainSVMModelEstimated(EstimatedResources, TrainSVMModel):
+    resource_params = ['svm_type', 'svm_kernel_type', 'svm_gamma', 'svm_cost', 'parallel_train']
+
+class PredictSVMModelEstimated(EstimatedResources, PredictSVMModel):
+    pass
+
+class CreateSparseTrainDatasetEstimated(EstimatedResources, CreateSparseTrainDataset):
+    pass
+
+class CreateSparseTestDatasetEstimated(EstimatedResources, CreateSparseTestDataset):
+    pass
+
+# ================================================================================
+#  Sharded signature generation
+#
+#  The SMILES are split into contiguous chunks, the signatures of each chunk
+#  generated by a GenerateSignaturesFilterSubstances task of its own (and so
+#  in a Slurm job of its own), and the chunk signatures concatenated in chunk
+#  order, giving the same substances in the same order as one task over the
+#  whole file would.
+# ================================================================================
+
+class SplitSmiles(sl.SlurmTask):
+    # Parameters
+    shards_count = luigi.IntParameter()
+    # In-ports
+    in_smiles = None
+    # Out-ports
+    def out_chunks(self):
+        base, ext = os.path.splitext(self.in_smiles().path)
+        return [sl.TargetInfo(self, '%s.shard%02dof%02d%s' % (base, i + 1, self.shards_count, ext))
+                for i in xrange(self.shards_count)]
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' splitlines' +
+                ' --chunks=%s' % ','.join(c.path for c in self.out_chunks()) +
+                ' %s' % self.in_smiles().path)
+
+class MergeSignatures(GenerateSignaturesFilterSubstances):
+    '''
+    Stands in for a GenerateSignaturesFilterSubstances task over the whole
+    in_smiles (with the same parameters, and so the same output name), by
+    concatenating the signatures generated for the chunks of it, in order
+    '''
+    # In-ports
+    in_chunk_signatures = None # List, in chunk order
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' concat' +
+                ' --inputs=%s' % ','.join(s().path for s in self.in_chunk_signatures) +
+                ' --output=%s' % self.out_signatures().path)
+
+# ================================================================================
+#  Line-indexed data files
+#
+#  The line offsets of a data file are written to a sidecar file (see
+#  mmtools.write_index) when the file is produced, so that downstream tasks
+#  can count and pick out rows without going through the whole file.
+# ================================================================================
+
+class IndexedOutput(object):
+    '''
+    Mixin for SlurmTasks producing a data file with a command of their own,
+    for writing the line index of the file in the same command (see mmtools
+    indexed), and so in the same Slurm job. Put it first among the base
+    classes, and define indexed_file(), the path of the file.
+    '''
+    def out_index(self):
+        return sl.TargetInfo(self, self.indexed_file() + '.offsets.npy')
+    def ex(self, command):
+        if isinstance(command, list):
+            command = ' '.join(pipes.quote(c) for c in command)
+        return super(IndexedOutput, self).ex(MMTOOLS + ' indexed --file=%s %s' % (self.indexed_file(), pipes.quote(command)))
+
+class UnGzipFileIndexed(IndexedOutput, UnGzipFile):
+    '''
+    UnGzipFile, also writing a line index for the ungzipped file
+    '''
+    def indexed_file(self):
+        return self.out_ungzipped().path
+
+class ShuffleLinesIndexed(IndexedOutput, ShuffleLines):
+    '''
+    ShuffleLines, also writing a line index for the shuffled file
+    '''
+    def indexed_file(self):
+        return self.out_shuffled().path
+
+class ShuffleLinesSeeded(sl.SlurmTask):
+    '''
+    Shuffle the lines of a file reproducibly from a seed, in-process (see
+    mmtools shuffle), instead of with ShuffleLines and a file of random data
+    from CreateRandomData. Also writes a line index for the shuffled file.
+    '''
+    # Parameters
+    seed = luigi.Parameter()
+    memory_mb = luigi.IntParameter(default=4096) # Larger files are shuffled via temporary buckets
+    # In-ports
+    in_file = None
+    # Out-ports
+    def out_shuffled(self):
+        return sl.TargetInfo(self, self.in_file().path + '.shuf')
+    def out_index(self):
+        return sl.TargetInfo(self, self.out_shuffled().path + '.offsets.npy')
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' shuffle' +
+                ' --seed=%s' % self.seed +
+                ' --memory-mb=%d' % self.memory_mb +
+                ' --output=%s' % self.out_shuffled().path +
+                ' %s' % self.in_file().path)
+
+def indexed_line_count(path):
+    '''
+    The number of lines of a file, from the header of its line index alone,
+    or None if it has no up-to-date index
+    '''
+    idxpath = path + '.offsets.npy'
+    if not os.path.exists(idxpath) or os.path.getmtime(idxpath) < os.path.getmtime(path):
+        return None
+    return len(np.load(idxpath, mmap_mode='r')) - 1
+
+class CountLinesIndexed(CountLines):
+    '''
+    CountLines, looking up the count in the line index of the file, in the
+    workflow process, when there is one, instead of reading through the file
+    in a job of its own
+    '''
+    def run(self):
+        count = None
+        if not self.ungzip:
+            count = indexed_line_count(self.in_file().path)
+        if count is not None:
+            with self.out_linecount().open('w') as outfile:
+                outfile.write(str(count))
+        elif self.ungzip:
+            super(CountLinesIndexed, self).run()
+        else:
+            self.ex(MMTOOLS + ' countlines %s %s' % (self.in_file().path, self.out_linecount().path))
+
+class CreateFoldsIndexed(CreateFolds):
+    '''
+    CreateFolds, copying the train and test parts of the fold as byte ranges
+    looked up in the line index of the dataset
+    '''
+    def run(self):
+        self.ex(MMTOOLS + ' createfolds' +
+                ' --dataset=%s' % self.in_dataset().path +
+                ' --fold-index=%d' % self.fold_index +
+                ' --folds-count=%d' % self.folds_count +
+                ' --traindata=%s' % self.out_traindata().path +
+                ' --testdata=%s' % self.out_testdata().path)
+
+class SampleTrainAndTestNested(sl.SlurmTask):
+    '''
+    The test set and the train sets of all train sizes of a replicate, in
+    one task, as random SampleTrainAndTest tasks would sample them, but with
+    every train set a subset of the larger ones (see mmtools samplenested).
+    The permutation is seeded with the replicate id, so the same replicate
+    gets the same samples in any workflow.
+    '''
+    # Parameters
+    replicate_id = luigi.Parameter()
+    dataset_name = luigi.Parameter()
+    test_size = luigi.Parameter()
+    train_sizes = luigi.Parameter() # Comma-separated
+    # In-ports
+    in_signatures = None
+    # Out-ports
+    def out_testdata(self):
+        # The same test set, under one name per train size, as the sparse
+        # test sets created from it are named after it
+        return {size: sl.TargetInfo(self, self.in_signatures().path + '.%s_%s_nrand_tst' % (self.test_size, size))
+                for size in self.train_sizes.split(',')}
+    def out_traindata(self):
+        return {size: sl.TargetInfo(self, self.in_signatures().path + '.%s_%s_nrand_trn' % (self.test_size, size))
+                for size in self.train_sizes.split(',')}
+    # Task action
+    def run(self):
+        sizes = self.train_sizes.split(',')
+        testdata = self.out_testdata()
+        traindata = self.out_traindata()
+        self.ex(MMTOOLS + ' samplenested' +
+                ' --signatures=%s' % self.in_signatures().path +
+                ' --seed=%s' % self.replicate_id +
+                ' --test-size=%s' % self.test_size +
+                ' --train-sizes=%s' % self.train_sizes +
+                ' --testdata=%s' % ','.join(testdata[s].path for s in sizes) +
+                ' --traindata=%s' % ','.join(traindata[s].path for s in sizes))
+
+# ================================================================================
+#  Binary sparse datasets
+#
+#  A directory of memory-mappable NumPy arrays (see mmtools.write_binary),
+#  which the mmtools commands read without any parsing. The external
+#  liblinear/libsvm binaries still need the text format.
+# ================================================================================
+
+class ConvertSparseToBinary(sl.SlurmTask):
+    # In-ports
+    in_sparse = None
+    # Out-ports
+    def out_binary(self):
+        return sl.TargetInfo(self, self.in_sparse().path + '.npcsr')
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' tobinary %s %s' % (self.in_sparse().path, self.out_binary().path))
+
+class ConvertBinaryToSparse(sl.SlurmTask):
+    # In-ports
+    in_binary = None
+    # Out-ports
+    def out_sparse(self):
+        return sl.TargetInfo(self, self.in_binary().path + '.csr')
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' totext %s %s' % (self.in_binary().path, self.out_sparse().path))
+
+# ================================================================================
+
+class TrainLinearModelPath(sl.SlurmTask):
+    '''
+    Train, predict and assess liblinear models for a whole sequence of costs,
+    in one go. The costs are trained from the smallest to the largest, with
+    each training starting from the solution of the previous one, for the
+    solvers that support it (see mmtools.WARMSTART_SOLVERS). The others are
+    trained with lin_type as given, from scratch for every cost.
+
+    Produces one model, prediction and RMSD file per cost, named as by
+    TrainLinearModel, PredictLinearModel and AssessLinearRMSD, plus the total
+    training time. The train and test data can be gzipped, or in the binary
+    format written by ConvertSparseToBinary.
+
+    The fold can either be given as separate train and test files, or as a
+    (shuffled) dataset plus fold_index and folds_count, in which case the
+    fold is read directly from the rows of the dataset, split as by
+    CreateFolds.
+    '''
+    # Parameters
+    replicate_id = luigi.Parameter()
+    lin_type = luigi.Parameter()
+    lin_costs = luigi.Parameter() # Comma-separated
+    fold_index = luigi.IntParameter(default=None)
+    folds_count = luigi.IntParameter(default=None)
+    # In-ports
+    in_traindata = None
+    in_testdata = None
+    in_dataset = None # Instead of in_traindata and in_testdata
+    # Out-ports
+    def basepath(self):
+        if self.in_dataset is not None:
+            return self.in_dataset().path + '.fld%02d' % self.fold_index
+        return self.in_traindata().path
+    def out_models(self):
+        return {cost: sl.TargetInfo(self, self.basepath() + '.s%s_c%s.linmdl' % (self.lin_type, cost))
+                for cost in self.lin_costs.split(',')}
+    def out_predictions(self):
+        return {cost: sl.TargetInfo(self, model.path + '.pred')
+                for cost, model in self.out_models().items()}
+    def out_assessments(self):
+        return {cost: sl.TargetInfo(self, prediction.path + '.rmsd')
+                for cost, prediction in self.out_predictions().items()}
+    def out_traintime(self):
+        return sl.TargetInfo(self, self.basepath() + '.s%s_c%s.linmdl.extime' % (self.lin_type, self.lin_costs.replace(',', '_')))
+    # Task action
+    def run(self):
+        costs = self.lin_costs.split(',')
+        models = self.out_models()
+        predictions = self.out_predictions()
+        assessments = self.out_assessments()
+        if self.in_dataset is not None:
+            datastr = (' --dataset=%s' % self.in_dataset().path +
+                       ' --fold-index=%d' % self.fold_index +
+                       ' --folds-count=%d' % self.folds_count)
+        else:
+            datastr = (' --traindata=%s' % self.in_traindata().path +
+                       ' --testdata=%s' % self.in_testdata().path)
+        self.ex(MMTOOLS + ' trainpath' +
+                ' --lin-type=%s' % self.lin_type +
+                ' --costs=%s' % self.lin_costs +
+                datastr +
+                ' --models=%s' % ','.join(models[c].path for c in costs) +
+                ' --predictions=%s' % ','.join(predictions[c].path for c in costs) +
+                ' --assessments=%s' % ','.join(assessments[c].path for c in costs) +
+                ' --traintime=%s' % self.out_traintime().path)
+
+class TrainLinearModelPathEstimated(EstimatedResources, TrainLinearModelPath):
+    resource_params = ['lin_type', 'lin_costs']
+
+# ================================================================================
+
+class PredictLinearModels(sl.SlurmTask):
+    '''
+    Predict one test dataset with many liblinear models (e.g. one per cost),
+    reading and parsing the test data only once. Produces one prediction file
+    per model, named as by PredictLinearModel.
+    '''
+    # Parameters
+    replicate_id = luigi.Parameter()
+    # In-ports
+    in_models = None # Dict, by cost
+    in_sparse_testdata = None
+    # Out-ports
+    def out_predictions(self):
+        return {cost: sl.TargetInfo(self, model().path + '.pred')
+                for cost, model in self.in_models.items()}
+    # Task action
+    def run(self):
+        costs = sorted(self.in_models)
+        predictions = self.out_predictions()
+        self.ex(MMTOOLS + ' predict' +
+                ' --testdata=%s' % self.in_sparse_testdata().path +
+                ' --models=%s' % ','.join(self.in_models[c]().path for c in costs) +
+                ' --predictions=%s' % ','.join(predictions[c].path for c in costs))
+
+class PredictLinearModelsEstimated(EstimatedResources, PredictLinearModels):
+    pass
+
+class AssessCrossValidation(sl.Task):
+    '''
+    Assess the predictions for all costs on all cross-validation folds in
+    one go, in-process, instead of one AssessLinearRMSD job per fold and
+    cost plus CalcAverageRMSDForCost and SelectLowestRMSD. The labels of
+    each test set are read only once, from a label sidecar.
+
+    out_table has RMSD, MAE, R^2 and quantiles of the absolute error per
+    cost and fold, plus averages over the folds. The out_lowest file has the
+    same format as the one of SelectLowestRMSD.
+
+    The folds are given either as a list of test files, or as one (shuffled)
+    dataset plus folds_count, split as by CreateFolds.
+    '''
+    # Parameters
+    lin_type = luigi.Parameter()
+    folds_count = luigi.IntParameter(default=None)
+    # In-ports
+    in_predictions = None # Dict, by cost, of lists with one prediction per fold
+    in_testdata = None # List, one per fold
+    in_dataset = None # Instead of in_testdata
+    # Out-ports
+    def basepath(self):
+        if self.in_dataset is not None:
+            return self.in_dataset().path + '.%dfolds' % self.folds_count
+        return self.in_testdata[0]().path
+    def out_table(self):
+        return sl.TargetInfo(self, self.basepath() + '.s%s_assessment.tsv' % self.lin_type)
+    def out_lowest(self):
+        return sl.TargetInfo(self, self.basepath() + '.s%s_assessment.min' % self.lin_type)
+    # Task action
+    def run(self):
+        if self.in_dataset is not None:
+            datastr = (' --dataset=%s' % self.in_dataset().path +
+                       ' --folds-count=%d' % self.folds_count)
+        else:
+            datastr = ' --testdata=%s' % ','.join(t().path for t in self.in_testdata)
+        predstr = ''.join(' --predictions=%s:%s' % (cost, ','.join(p().path for p in self.in_predictions[cost]))
+                          for cost in sorted(self.in_predictions, key=float))
+        self.ex(MMTOOLS + ' assess' +
+                predstr +
+                datastr +
+                ' --table=%s' % self.out_table().path +
+                ' --lowest=%s' % self.out_lowest().path)
+
+# ================================================================================
+
+# Memory used by SearchLinearCost per byte of libsvm text: the data as read
+# by mmtools, and (at its peak, while being built) the liblinear problem of a
+# fold. Measured on 40000 rows of 120 features: 38 MB text, 58 MB of sparse
+# matrix, 571 MB peak for the problem.
+SEARCH_DATA_FACTOR = 2
+SEARCH_PROBLEM_FACTOR = 15
+GZIP_TEXT_RATIO = 5 # Roughly, for the libsvm text of signatures
+
+def data_bytes(path):
+    '''
+    The size of a file, or of all files of a (binary dataset) directory
+    '''
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+class SearchLinearCost(sl.SlurmTask):
+    '''
+    Search for the liblinear cost giving the lowest average RMSD over a set of
+    cross-validation folds. A coarse grid of costs is evaluated in ascending
+    order until the average RMSD has risen for `patience` consecutive costs,
+    after which the best region is refined with golden-section search. The
+    folds of every cost are trained in parallel, on as many processes as the
+    SlurmInfo has cores. On the core partition, the job is given more cores
+    if that is what it takes to get the memory of memory_mb, without
+    training more folds at once.
+
+    The folds are given either as lists of train and test files, or as one
+    (shuffled) dataset plus folds_count, split as by CreateFolds.
+
+    The out_lowest file has the same format as the one of SelectLowestRMSD.
+    '''
+    # Parameters
+    replicate_id = luigi.Parameter()
+    lin_type = luigi.Parameter()
+    lin_costs = luigi.Parameter() # Comma-separated coarse grid
+    patience = luigi.IntParameter(default=3)
+    refine_steps = luigi.IntParameter(default=6)
+    folds_count = luigi.IntParameter(default=None)
+    # In-ports
+    in_traindata = None # List, one per fold
+    in_testdata = None # List, one per fold
+    in_dataset = None # Instead of in_traindata and in_testdata
+    # Out-ports
+    def basepath(self):
+        if self.in_dataset is not None:
+            return self.in_dataset().path + '.%dfolds' % self.folds_count
+        return self.in_traindata[0]().path
+    def out_rmsdavgs(self):
+        return sl.TargetInfo(self, self.basepath() + '.s%s_costsearch.tsv' % self.lin_type)
+    def out_lowest(self):
+        return sl.TargetInfo(self, self.basepath() + '.s%s_costsearch.min' % self.lin_type)
+    # Task action
+    def memory_mb(self, workers):
+        '''
+        The memory needed for the data, read once, plus the liblinear problem
+        of the train part of one fold for each of the workers
+        '''
+        if self.in_dataset is not None:
+            paths = [self.in_dataset().path]
+            folds_count = self.folds_count
+        else:
+            paths = [t().path for t in self.in_traindata + self.in_testdata]
+            folds_count = len(self.in_traindata)
+        text_bytes = sum(data_bytes(path) * (GZIP_TEXT_RATIO if path.endswith('.gz') else 1) for path in paths)
+        if self.in_dataset is None:
+            # Every fold has its own train and test files, together as large as the dataset
+            dataset_bytes = text_bytes / folds_count
+        else:
+            dataset_bytes = text_bytes
+        train_bytes = dataset_bytes * (folds_count - 1) / folds_count
+        needed = SEARCH_DATA_FACTOR * text_bytes + min(workers, folds_count) * SEARCH_PROBLEM_FACTOR * train_bytes
+        return int(math.ceil(needed / 2.0**20))
+    def run(self):
+        workers = int(self.slurminfo.cores)
+        if self.slurminfo.partition == 'core':
+            cores = max(workers, int(math.ceil(self.memory_mb(workers) / float(MEM_PER_CORE_MB))))
+            limit = resource_limit(slurm_resource(self.slurminfo)[0])
+            if limit is not None:
+                cores = min(cores, limit)
+            self.slurminfo.cores = str(cores)
+        if self.in_dataset is not None:
+            datastr = (' --dataset=%s' % self.in_dataset().path +
+                       ' --folds-count=%d' % self.folds_count)
+        else:
+            datastr = (' --traindata=%s' % ','.join(t().path for t in self.in_traindata) +
+                       ' --testdata=%s' % ','.join(t().path for t in self.in_testdata))
+        self.ex(MMTOOLS + ' searchcost' +
+                ' --lin-type=%s' % self.lin_type +
+                ' --costs=%s' % self.lin_costs +
+                ' --patience=%d' % self.patience +
+                ' --refine-steps=%d' % self.refine_steps +
+                datastr +
+                ' --workers=%d' % workers +
+                ' --rmsdavgs=%s' % self.out_rmsdavgs().path +
+                ' --lowest=%s' % self.out_lowest().path)
+
+class SearchLinearCostEstimated(EstimatedResources, SearchLinearCost):
+    resource_params = ['lin_type', 'lin_costs', 'patience', 'refine_steps', 'folds_count']
+
+# ================================================================================
+#  Gzipped sparse datasets
+#
+#  The components below read the gzipped sparse datasets of
+#  CreateSparseTrainDataset and CreateSparseTestDataset directly, through the
+#  streaming readers of mmtools, so that no UnGzipFile copies are needed.
+#  Their outputs are named as when they read those copies, so that results
+#  from before stay valid.
+# ================================================================================
+
+def ungzipped_inport(inport):
+    '''
+    An in-port for the file UnGzipFile would ungzip the file of inport to
+    '''
+    def ungzipped():
+        target = inport()
+        return sl.TargetInfo(target.task, target.path + '.ungz')
+    return ungzipped
+
+class NamedAsUngzipped(object):
+    '''
+    Mixin for tasks reading the gzipped files of the in-ports listed in
+    gzipped_inports, naming the outputs returned by named_as_ungzipped as if
+    those in-ports were their ungzipped copies. Put it first among the base
+    classes.
+    '''
+    gzipped_inports = []
+    naming_as_ungzipped = False
+
+    def named_as_ungzipped(self, outport):
+        if self.naming_as_ungzipped:
+            # Out-ports naming themselves after other out-ports
+            return outport()
+        inports = dict((name, getattr(self, name)) for name in self.gzipped_inports)
+        self.naming_as_ungzipped = True
+        try:
+            for name, inport in inports.items():
+                setattr(self, name, ungzipped_inport(inport))
+            return outport()
+        finally:
+            for name, inport in inports.items():
+                setattr(self, name, inport)
+            self.naming_as_ungzipped = False
+
+class TrainLinearModelGzipped(NamedAsUngzipped, TrainLinearModel):
+    '''
+    TrainLinearModel, on the gzipped train set (see mmtools trainlinear)
+    '''
+    gzipped_inports = ['in_traindata']
+    # Out-ports
+    def out_model(self):
+        return self.named_as_ungzipped(super(TrainLinearModelGzipped, self).out_model)
+    def out_traintime(self):
+        return self.named_as_ungzipped(super(TrainLinearModelGzipped, self).out_traintime)
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' trainlinear' +
+                ' --lin-type=%s' % self.lin_type +
+                ' --cost=%s' % self.lin_cost +
+                ' --traindata=%s' % self.in_traindata().path +
+                ' --model=%s' % self.out_model().path +
+                ' --traintime=%s' % self.out_traintime().path)
+
+class TrainLinearModelGzippedEstimated(EstimatedResources, TrainLinearModelGzipped):
+    resource_params = ['lin_type', 'lin_cost']
+
+class PredictLinearModelGzipped(NamedAsUngzipped, PredictLinearModel):
+    '''
+    PredictLinearModel, on the gzipped test set (see mmtools predict)
+    '''
+    gzipped_inports = ['in_sparse_testdata']
+    # Out-ports
+    def out_prediction(self):
+        return self.named_as_ungzipped(super(PredictLinearModelGzipped, self).out_prediction)
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' predict' +
+                ' --testdata=%s' % self.in_sparse_testdata().path +
+                ' --models=%s' % self.in_model().path +
+                ' --predictions=%s' % self.out_prediction().path)
+
+class AssessLinearRMSDGzipped(NamedAsUngzipped, AssessLinearRMSD):
+    '''
+    AssessLinearRMSD, against the labels of the gzipped test set (see
+    mmtools rmsd)
+    '''
+    gzipped_inports = ['in_model', 'in_sparse_testdata']
+    # Out-ports
+    def out_assessment(self):
+        return self.named_as_ungzipped(super(AssessLinearRMSDGzipped, self).out_assessment)
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' rmsd' +
+                ' --testdata=%s' % self.in_sparse_testdata().path +
+                ' --prediction=%s' % self.in_prediction().path +
+                ' --cost=%s' % self.lin_cost +
+                ' --assessment=%s' % self.out_assessment().path)
+
+class TrainSVMModelGzipped(NamedAsUngzipped, TrainSVMModel):
+    '''
+    TrainSVMModel, on the gzipped train set, with the Python interface of
+    libsvm (see mmtools trainsvm). Not for parallel_train, as the MPI
+    svm-train reads the train set from a file it can seek in.
+    '''
+    gzipped_inports = ['in_traindata']
+    # Out-ports
+    def out_model(self):
+        return self.named_as_ungzipped(super(TrainSVMModelGzipped, self).out_model)
+    def out_traintime(self):
+        return self.named_as_ungzipped(super(TrainSVMModelGzipped, self).out_traintime)
+    # Task action
+    def run(self):
+        if self.parallel_train:
+            raise Exception('The parallel svm-train can not read a gzipped train set, use TrainSVMModel on an ungzipped one. Please fix and try again!')
+        self.ex(MMTOOLS + ' trainsvm' +
+                ' --svm-type=%s' % self.svm_type +
+                ' --kernel-type=%s' % self.svm_kernel_type +
+                ' --gamma=%s' % self.svm_gamma +
+                ' --cost=%s' % self.svm_cost +
+                ' --traindata=%s' % self.in_traindata().path +
+                ' --model=%s' % self.out_model().path +
+                ' --traintime=%s' % self.out_traintime().path)
+
+class TrainSVMModelGzippedEstimated(EstimatedResources, TrainSVMModelGzipped):
+    resource_params = ['svm_type', 'svm_kernel_type', 'svm_gamma', 'svm_cost']
+
+class AssessSVMRMSDGzipped(NamedAsUngzipped, AssessSVMRMSD):
+    '''
+    AssessSVMRMSD, against the labels of the gzipped test set (see mmtools
+    rmsd)
+    '''
+    gzipped_inports = ['in_model', 'in_sparse_testdata']
+    # Out-ports
+    def out_assessment(self):
+        return self.named_as_ungzipped(super(AssessSVMRMSDGzipped, self).out_assessment)
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' rmsd' +
+                ' --testdata=%s' % self.in_sparse_testdata().path +
+                ' --prediction=%s' % self.in_prediction().path +
+                ' --cost=%s' % self.svm_cost +
+                ' --assessment=%s' % self.out_assessment().path)
+
+class ShuffleLinesSeededGzipped(NamedAsUngzipped, ShuffleLinesSeeded):
+    '''
+    ShuffleLinesSeeded, on a gzipped file, writing the shuffled lines
+    ungzipped
+    '''
+    gzipped_inports = ['in_file']
+    # Out-ports
+    def out_shuffled(self):
+        return self.named_as_ungzipped(super(ShuffleLinesSeededGzipped, self).out_shuffled)
+    def out_index(self):
+        return self.named_as_ungzipped(super(ShuffleLinesSeededGzipped, self).out_index)
+
+# ================================================================================
+#  Cascade SVM
+#
+#  The train set is dealt out over shards, one SVM is trained per shard, and
+#  the support vectors of the models are merged pairwise and trained on
+#  again, layer by layer, until one model, trained on the support vectors of
+#  the layer before, is left. Every training is a TrainSVMModel task of its
+#  own, so a layer can run on as many nodes as it has shards.
+# ================================================================================
+
+class SplitTrainData(NamedAsUngzipped, sl.SlurmTask):
+    '''
+    Deal out the rows of a (gzipped) sparse dataset round-robin over
+    ungzipped shards
+    '''
+    gzipped_inports = ['in_traindata']
+    # Parameters
+    shards_count = luigi.IntParameter()
+    # In-ports
+    in_traindata = None
+    # Out-ports
+    def out_shards(self):
+        return self.named_as_ungzipped(lambda: [sl.TargetInfo(self, self.in_traindata().path + '.shard%02dof%02d' % (i + 1, self.shards_count))
+                                                for i in xrange(self.shards_count)])
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' splitlines --interleave' +
+                ' --chunks=%s' % ','.join(s.path for s in self.out_shards()) +
+                ' %s' % self.in_traindata().path)
+
+class MergeSupportVectors(NamedAsUngzipped, sl.SlurmTask):
+    '''
+    The rows of the train sets of a number of SVM models, that are support
+    vectors in them, as train set for the next layer of the cascade
+    '''
+    gzipped_inports = ['in_basedata']
+    # Parameters
+    layer = luigi.IntParameter()
+    index = luigi.IntParameter()
+    # In-ports
+    in_models = None # List
+    in_traindata = None # List, the train set of each model
+    in_basedata = None # The full (gzipped) train set, for naming
+    # Out-ports
+    def out_traindata(self):
+        return self.named_as_ungzipped(lambda: sl.TargetInfo(self, self.in_basedata().path + '.cascade_l%d_%02d' % (self.layer, self.index)))
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' svmerge' +
+                ' --models=%s' % ','.join(m().path for m in self.in_models) +
+                ' --traindata=%s' % ','.join(t().path for t in self.in_traindata) +
+                ' --output=%s' % self.out_traindata().path)
+
+class TrainSVMModelCascade(TrainSVMModel):
+    '''
+    The last training of a cascade SVM, with the train times of the layers
+    before added to its own train time: the longest training of each layer,
+    as the trainings of a layer run in parallel. The model is named after
+    the full (gzipped) train set, as the one of a TrainSVMModelGzipped on it
+    would be, but with the number of layers before the .svm extension, to
+    keep the two apart.
+    '''
+    # Parameters
+    layers = luigi.IntParameter() # Including this last training
+    # In-ports
+    in_layer_traintimes = None # List of lists, one list per layer
+    in_basedata = None # The full (gzipped) train set, for naming
+    # Out-ports
+    def named_after_basedata(self, outport):
+        traindata = self.in_traindata
+        self.in_traindata = ungzipped_inport(self.in_basedata)
+        try:
+            target = outport()
+        finally:
+            self.in_traindata = traindata
+        head, ext, tail = target.path.rpartition('.svm')
+        if head.endswith('.cascade%d' % self.layers): # Named after out_model, already renamed
+            return target
+        return sl.TargetInfo(self, head + '.cascade%d' % self.layers + ext + tail)
+    def out_model(self):
+        return self.named_after_basedata(super(TrainSVMModelCascade, self).out_model)
+    def out_traintime(self):
+        return self.named_after_basedata(super(TrainSVMModelCascade, self).out_traintime)
+    # Task action
+    def run(self):
+        super(TrainSVMModelCascade, self).run()
+        seconds = 0
+        for layer in self.in_layer_traintimes:
+            layer_seconds = []
+            for traintime in layer:
+                with traintime().open() as infile:
+                    layer_seconds.append(float(infile.read().strip()))
+            seconds += max(layer_seconds)
+        with self.out_traintime().open() as infile:
+            seconds += float(infile.read().strip())
+        with self.out_traintime().open('w') as outfile:
+            outfile.write('%d' % seconds)
+
+# ================================================================================
+#  Batched SVM prediction
+# ================================================================================
+
+class PredictSVMModelBatched(PredictSVMModel):
+    '''
+    PredictSVMModel, with the model loaded once and the kernel values of
+    batches of rows computed against all support vectors at once (see
+    mmtools predictsvm), on as many processes as the SlurmInfo has cores,
+    instead of with svm-predict. Only for regression models.
+    '''
+    def run(self):
+        self.ex(MMTOOLS + ' predictsvm' +
+                ' --model=%s' % self.in_svmmodel().path +
+                ' --testdata=%s' % self.in_sparse_testdata().path +
+                ' --prediction=%s' % self.out_prediction().path +
+                ' --workers=%s' % self.slurminfo.cores)
+
+class PredictSVMModelBatchedEstimated(EstimatedResources, PredictSVMModelBatched):
+    pass
+
+class PredictSVMModelGzipped(NamedAsUngzipped, PredictSVMModelBatched):
+    '''
+    PredictSVMModelBatched, on the gzipped test set
+    '''
+    gzipped_inports = ['in_sparse_testdata']
+    # Out-ports
+    def out_prediction(self):
+        return self.named_as_ungzipped(super(PredictSVMModelGzipped, self).out_prediction)
+
+class PredictSVMModelGzippedEstimated(EstimatedResources, PredictSVMModelGzipped):
+    pass
+
+class SelectPercentIndexValues(sl.Task):
+    '''
+    The values at many percent indexes of a prediction, as by one
+    SelectPercentIndexValue per percent, but from one O(n) selection over
+    the values instead of a sort each. The prediction can also be given as
+    a list of shards, e.g. of a chunked prediction, which are taken
+    together.
+    '''
+    # Parameters
+    percent_indexes = luigi.Parameter() # Comma-separated
+    # In-ports
+    in_prediction = None # Or a list of shards
+    # Out-ports
+    def prediction_paths(self):
+        return target_paths(self.in_prediction)
+    def out_indexvalues(self):
+        return {pct: sl.TargetInfo(self, self.prediction_paths()[0] + '.idx%s' % pct)
+                for pct in self.percent_indexes.split(',')}
+    # Task action
+    def run(self):
+        percents = self.percent_indexes.split(',')
+        indexvalues = self.out_indexvalues()
+        self.ex(MMTOOLS + ' percentiles' +
+                ' --predictions=%s' % ','.join(self.prediction_paths()) +
+                ' --percents=%s' % self.percent_indexes +
+                ' --outputs=%s' % ','.join(indexvalues[p].path for p in percents))
+
+# ================================================================================
+#  Approximate RBF models
+#
+#  An RBF model approximated with the Nystroem method (see mmtools), trained
+#  in O(rows x landmarks^2) instead of the up to cubic time of libsvm, with
+#  the number of landmarks trading accuracy for time. Reads the gzipped
+#  sparse datasets directly.
+#
+#  With kernel_cache set to a directory (on node-local disk), the normal
+#  equations of the ridge regression, which do not depend on the cost, are
+#  kept there, keyed by data content, gamma and landmarks, so that models
+#  differing only in cost compute the kernel values and features only once.
+# ================================================================================
+
+def kernel_cache_str(task):
+    if not task.kernel_cache:
+        return ''
+    return ' --kernel-cache=%s --kernel-cache-mb=%d' % (task.kernel_cache, task.kernel_cache_mb)
+
+class TrainApproxRBFModel(sl.SlurmTask):
+    '''
+    Train an approximate RBF model on a random sample of landmarks train rows
+    '''
+    # Parameters
+    replicate_id = luigi.Parameter()
+    svm_gamma = luigi.Parameter()
+    svm_cost = luigi.Parameter()
+    landmarks = luigi.IntParameter(default=1000)
+    seed = luigi.IntParameter(default=0)
+    kernel_cache = luigi.Parameter(default=None)
+    kernel_cache_mb = luigi.IntParameter(default=1024)
+    # In-ports
+    in_traindata = None
+    # Out-ports
+    def out_model(self):
+        return sl.TargetInfo(self, self.in_traindata().path + '.g%s_c%s_m%d.nysmdl' % (self.svm_gamma, self.svm_cost, self.landmarks))
+    def out_traintime(self):
+        return sl.TargetInfo(self, self.out_model().path + '.extime')
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' trainapprox' +
+                ' --traindata=%s' % self.in_traindata().path +
+                ' --gamma=%s' % self.svm_gamma +
+                ' --cost=%s' % self.svm_cost +
+                ' --landmarks=%d' % self.landmarks +
+                ' --seed=%d' % self.seed +
+                kernel_cache_str(self) +
+                ' --model=%s' % self.out_model().path +
+                ' --traintime=%s' % self.out_traintime().path)
+
+class TrainApproxRBFModelEstimated(EstimatedResources, TrainApproxRBFModel):
+    resource_params = ['svm_gamma', 'svm_cost', 'landmarks']
+
+class PredictApproxRBFModel(sl.SlurmTask):
+    '''
+    Predict a test dataset with an approximate RBF model, and assess the
+    predictions, writing the RMSD in the format of AssessSVMRMSD
+    '''
+    # Parameters
+    replicate_id = luigi.Parameter()
+    svm_cost = luigi.Parameter()
+    # In-ports
+    in_model = None
+    in_sparse_testdata = None
+    # Out-ports
+    def out_prediction(self):
+        return sl.TargetInfo(self, self.in_model().path + '.pred')
+    def out_assessment(self):
+        return sl.TargetInfo(self, self.out_prediction().path + '.rmsd')
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' predictapprox' +
+                ' --model=%s' % self.in_model().path +
+                ' --testdata=%s' % self.in_sparse_testdata().path +
+                ' --cost=%s' % self.svm_cost +
+                ' --prediction=%s' % self.out_prediction().path +
+                ' --assessment=%s' % self.out_assessment().path)
+
+# ================================================================================
+#  Sparse datasets from a shared signature dictionary
+#
+#  The signature dictionary is built once per signature file content, and
+#  used by all train/test splits, instead of every CreateSparseTrainDataset
+#  building its own from scratch.
+# ================================================================================
+
+class BuildSignatureDictionary(ContentAddressed, sl.SlurmTask):
+    '''
+    Write all distinct signatures in a signature file, one per line, the
+    line number being the global feature id. Content-addressed, so copies of
+    the same signature file (for other runs or replicates) share one
+    dictionary.
+    '''
+    # In-ports
+    in_signatures = None
+    # Out-ports
+    def out_dictionary(self):
+        return sl.TargetInfo(self, self.in_signatures().path + '.sigdict')
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' sigdict' +
+                ' --signatures=%s' % self.in_signatures().path +
+                ' --dictionary=%s' % self.out_dictionary().path)
+
+class CreateSparseTrainDatasetShared(sl.SlurmTask):
+    '''
+    Drop-in replacement for CreateSparseTrainDataset, looking up features in
+    a global signature dictionary, and remapping the ones occurring in the
+    train set to 1..n. The signatures of the remapped features are written
+    to out_signatures, for CreateSparseTestDatasetShared.
+    '''
+    # Parameters
+    dataset_name = luigi.Parameter(default=None)
+    replicate_id = luigi.Parameter()
+    # In-ports
+    in_traindata = None
+    in_dictionary = None
+    # Out-ports
+    def out_sparse_traindata(self):
+        return sl.TargetInfo(self, self.in_traindata().path + '.csr')
+    def out_signatures(self):
+        return sl.TargetInfo(self, self.in_traindata().path + '.csr.signatures')
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' sparsetrain' +
+                ' --dictionary=%s' % self.in_dictionary().path +
+                ' --traindata=%s' % self.in_traindata().path +
+                ' --sparse=%s' % self.out_sparse_traindata().path +
+                ' --split-signatures=%s' % self.out_signatures().path)
+
+class CreateSparseTrainDatasetSharedEstimated(EstimatedResources, CreateSparseTrainDatasetShared):
+    pass
+
+class CreateSparseTestDatasetShared(sl.SlurmTask):
+    '''
+    Drop-in replacement for CreateSparseTestDataset, using the features of a
+    train set created by CreateSparseTrainDatasetShared
+    '''
+    # Parameters
+    dataset_name = luigi.Parameter(default=None)
+    replicate_id = luigi.Parameter()
+    # In-ports
+    in_testdata = None
+    in_signatures = None
+    # Out-ports
+    def out_sparse_testdata(self):
+        return sl.TargetInfo(self, self.in_testdata().path + '.csr')
+    # Task action
+    def run(self):
+        self.ex(MMTOOLS + ' sparsetest' +
+                ' --split-signatures=%s' % self.in_signatures().path +
+                ' --testdata=%s' % self.in_testdata().path +
+                ' --sparse=%s' % self.out_sparse_testdata().path)
+
+class CreateSparseTestDatasetSharedEstimated(EstimatedResources, CreateSparseTestDatasetShared):
+    pass
@@ -0,0 +1,1542 @@
+'''
+Numerical helpers for the MM workflows.
+
+The functions in here are run as standalone commands by the components in
+mmcompext.py (through self.ex(), so that they end up on a Slurm node when
+running in HPC mode), e.g.:
+
+    python mmtools.py trainpath --lin-type=12 --costs=0.01,0.1 ...
+'''
+import argparse
+import gzip
+import hashlib
+import itertools
+import liblinear
+import liblinearutil
+import math
+import mmap
+import multiprocessing
+import numpy as np
+import os
+import scipy.sparse as sp
+import sciluigi as sl
+import shutil
+import subprocess as sub
+import time
+
+# ================================================================================
+#  Reading and writing data
+# ================================================================================
+
+def parse_libsvm(lines):
+    '''
+    Parse lines in libsvm/liblinear format ("label idx:val idx:val ...") into
+    a label vector and a CSR matrix with zero-based column indices
+    '''
+    labels = []
+    indptr = [0]
+    indices = []
+    data = []
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        labels.append(float(fields[0]))
+        for field in fields[1:]:
+            idx, val = field.split(':')
+            indices.append(int(idx) - 1)
+            data.append(float(val))
+        indptr.append(len(indices))
+    cols = max(indices) + 1 if indices else 0
+    matrix = sp.csr_matrix((np.array(data, dtype=np.float64),
+                            np.array(indices, dtype=np.int32),
+                            np.array(indptr, dtype=np.int64)),
+                           shape=(len(labels), cols))
+    return np.array(labels, dtype=np.float64), matrix
+
+def is_gzipped(path):
+    with open(path, 'rb') as infile:
+        return infile.read(2) == '\x1f\x8b'
+
+class open_text(object):
+    '''
+    Open a text file for reading, whether it is gzipped or not. Gzipped files
+    are decompressed by a separate gzip process streaming into a pipe, so that
+    decompression runs in parallel with the parsing, without any ungzipped
+    copy being written to disk.
+    '''
+    def __init__(self, path):
+        self.proc = None
+        if is_gzipped(path):
+            self.proc = sub.Popen(['gzip', '-dc', path], stdout=sub.PIPE, bufsize=-1)
+            self.file = self.proc.stdout
+        else:
+            self.file = open(path)
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if self.proc is not None and self.proc.wait() != 0 and exc_type is None:
+            raise Exception('gzip exited with code %d' % self.proc.returncode)
+
+def read_sparse(path):
+    '''
+    Read a sparse dataset, in libsvm text format (gzipped or not), or in the
+    binary format written by write_binary
+    '''
+    if os.path.isdir(path):
+        return read_binary(path)
+    with open_text(path) as infile:
+        return parse_libsvm(infile)
+
+def text_size(path):
+    '''
+    The size of a text file, uncompressed if it is gzipped (which takes a
+    pass of decompression, as the gzip trailer only has the size modulo 4 GB)
+    '''
+    if not is_gzipped(path):
+        return os.path.getsize(path)
+    size = 0
+    with open_text(path) as infile:
+        for block in iter(lambda: infile.read(16*1024*1024), b''):
+            size += len(block)
+    return size
+
+def format_value(val):
+    if val.is_integer():
+        return '%d' % val
+    return repr(float(val))
+
+def write_sparse(path, labels, matrix):
+    '''
+    Write a sparse dataset in libsvm text format (one-based feature indices)
+    '''
+    with open(path, 'w') as outfile:
+        for i in xrange(matrix.shape[0]):
+            start, end = matrix.indptr[i], matrix.indptr[i+1]
+            features = ' '.join('%d:%s' % (idx + 1, format_value(val))
+                                for idx, val in zip(matrix.indices[start:end], matrix.data[start:end]))
+            outfile.write('%s %s\n' % (format_value(labels[i]), features))
+
+# The binary format is a directory with one .npy file per array of the CSR
+# matrix, plus the labels and the shape, all of which can be memory-mapped.
+BINARY_ARRAYS = ['labels', 'indptr', 'indices', 'data', 'shape']
+
+def write_binary(path, labels, matrix):
+    tmppath = path + '.tmp'
+    if os.path.exists(tmppath):
+        shutil.rmtree(tmppath)
+    os.makedirs(tmppath)
+    arrays = {'labels': labels,
+              'indptr': matrix.indptr,
+              'indices': matrix.indices,
+              'data': matrix.data,
+              'shape': np.array(matrix.shape, dtype=np.int64)}
+    for name in BINARY_ARRAYS:
+        np.save(os.path.join(tmppath, name + '.npy'), arrays[name])
+    os.rename(tmppath, path)
+
+def read_binary(path):
+    '''
+    Memory-map a dataset written by write_binary, without copying or parsing
+    '''
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in BINARY_ARRAYS}
+    matrix = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                           shape=tuple(arrays['shape']), copy=False)
+    return arrays['labels'], matrix
+
+def line_offsets(buf, chunksize=64*1024*1024):
+    '''
+    Byte offsets of the start of every line in buf, plus one past the end of
+    the last line, so that line i is buf[offsets[i]:offsets[i+1]]
+    '''
+    size = len(buf)
+    parts = [np.zeros(1, dtype=np.int64)]
+    for start in xrange(0, size, chunksize):
+        chunk = np.frombuffer(buf[start:start+chunksize], dtype=np.uint8)
+        parts.append(np.flatnonzero(chunk == ord('\n')).astype(np.int64) + start + 1)
+    offsets = np.concatenate(parts)
+    if offsets[-1] != size:
+        offsets = np.append(offsets, size)
+    return offsets
+
+def index_path(path):
+    return path + '.offsets.npy'
+
+def write_index(path):
+    '''
+    Write a sidecar index with the line offsets of a (plain text) file, for
+    constant-time line counts and random access to its rows
+    '''
+    if os.path.getsize(path) == 0:
+        # An empty file can not be memory-mapped
+        offsets = line_offsets(b'')
+    else:
+        with open(path, 'rb') as infile:
+            buf = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            offsets = line_offsets(buf)
+            buf.close()
+    with open(index_path(path), 'wb') as idxfile:
+        np.save(idxfile, offsets)
+    return offsets
+
+def read_index(path):
+    '''
+    The (memory-mapped) line offsets of path, if there is an up-to-date
+    sidecar index for it, otherwise None
+    '''
+    idxpath = index_path(path)
+    if not os.path.exists(idxpath) or os.path.getmtime(idxpath) < os.path.getmtime(path):
+        return None
+    return np.load(idxpath, mmap_mode='r')
+
+def count_rows(path):
+    offsets = read_index(path)
+    if offsets is None:
+        offsets = write_index(path)
+    return len(offsets) - 1
+
+class MappedRows(object):
+    '''
+    The lines of a (plain text) data file, memory-mapped and indexed by
+    byte offset, for picking out rows without reading or copying the rest.
+    Uses the sidecar index of the file when there is one.
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        if os.path.getsize(path) == 0:
+            # An empty file can not be memory-mapped
+            self.map = b''
+        else:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = read_index(path)
+        if self.offsets is None:
+            self.offsets = line_offsets(self.map)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def row(self, i):
+        return self.map[self.offsets[i]:self.offsets[i+1]]
+
+    __getitem__ = row
+
+    def rows(self, indices=None):
+        if indices is None:
+            indices = xrange(len(self))
+        for i in indices:
+            yield self.row(i)
+
+def fold_rows(rowcount, fold_index, folds_count):
+    '''
+    Row numbers of the train and test part of a fold, split the same way as
+    by CreateFolds: the test part is the fold_index:th contiguous block of
+    rowcount/folds_count rows, and the train part is everything else
+    '''
+    perfold = rowcount // folds_count
+    test = np.arange(fold_index * perfold, (fold_index + 1) * perfold)
+    train = np.concatenate([np.arange(0, fold_index * perfold),
+                            np.arange((fold_index + 1) * perfold, rowcount)])
+    return train, test
+
+# As the predict and svm-predict binaries write them, exact for doubles
+PREDICTION_FORMAT = '%.17g\n'
+
+def write_predictions(path, values):
+    with open(path, 'w') as outfile:
+        for val in values:
+            outfile.write(PREDICTION_FORMAT % val)
+
+def write_record(path, records):
+    with open(path, 'w') as outfile:
+        sl.dict_to_recordfile(outfile, records)
+
+def calc_rmsd(labels, predictions):
+    return float(np.sqrt(np.mean((np.asarray(predictions) - labels) ** 2)))
+
+def labels_path(path):
+    return path + '.labels.npy'
+
+def read_labels(path):
+    '''
+    The labels of a dataset, without parsing its features: from the binary
+    format, or from an up-to-date label sidecar, which is written from the
+    first column of the text format when missing
+    '''
+    if os.path.isdir(path):
+        return np.asarray(read_binary(path)[0])
+    lblpath = labels_path(path)
+    if os.path.exists(lblpath) and os.path.getmtime(lblpath) >= os.path.getmtime(path):
+        return np.load(lblpath)
+    with open_text(path) as infile:
+        labels = np.array([float(line.split(None, 1)[0]) for line in infile if line.strip()])
+    with open(lblpath, 'wb') as lblfile:
+        np.save(lblfile, labels)
+    return labels
+
+def read_predictions(path):
+    return np.loadtxt(path, ndmin=1)
+
+def percent_index_values(values, percents):
+    '''
+    The values at the given percent indexes of the sorted values (index
+    len * percent / 100, as by SelectPercentIndexValue), all picked out with
+    one O(n) selection instead of a sort per percent
+    '''
+    values = np.asarray(values)
+    kths = [min(len(values) - 1, int(len(values) * float(p) / 100)) for p in percents]
+    selected = np.partition(values, sorted(set(kths)))
+    return [selected[k] for k in kths]
+
+ASSESSMENT_QUANTILES = [50, 90, 95, 99]
+ASSESSMENT_COLUMNS = ['rmsd', 'mae', 'r2'] + ['abserr_q%d' % q for q in ASSESSMENT_QUANTILES]
+
+def assess(labels, predictions):
+    '''
+    RMSD, mean absolute error, R^2 and quantiles of the absolute error, for
+    the predictions of many models of the same labels, given as a
+    [rows x models] array. Returns a [models x ASSESSMENT_COLUMNS] array.
+    '''
+    errors = predictions - labels[:, np.newaxis]
+    abserrors = np.abs(errors)
+    sse = (errors ** 2).sum(axis=0)
+    sst = ((labels - labels.mean()) ** 2).sum()
+    return np.column_stack([np.sqrt(sse / len(labels)),
+                            abserrors.mean(axis=0),
+                            1 - sse / sst] +
+                           [np.percentile(abserrors, q, axis=0) for q in ASSESSMENT_QUANTILES])
+
+# ================================================================================
+#  Signatures
+#
+#  Signature files (as written by GenerateSignaturesFilterSubstances) are
+#  assumed to have one substance per line, with tab-separated SMILES and
+#  response value, followed by the whitespace-separated signatures of the
+#  substance, with a signature repeated once for every occurrence.
+# ================================================================================
+
+def parse_signatures(line):
+    fields = line.rstrip('\n').split('\t', 2)
+    signatures = fields[2].split() if len(fields) > 2 else []
+    return fields[1], signatures
+
+def build_sigdict(signpath, outpath):
+    '''
+    Write all distinct signatures in a signature file, one per line in the
+    order they first occur, so that the line number is a global feature id
+    '''
+    seen = set()
+    with open_text(signpath) as infile, open(outpath, 'w') as outfile:
+        for line in infile:
+            for signature in parse_signatures(line)[1]:
+                if signature not in seen:
+                    seen.add(signature)
+                    outfile.write(signature + '\n')
+
+def read_sigdict(path):
+    '''
+    Map signatures in a dictionary file (one per line) to their one-based
+    line number
+    '''
+    with open(path) as infile:
+        return {line.rstrip('\n'): i for i, line in enumerate(infile, 1)}
+
+def encode_signatures(signpath, sigdict):
+    '''
+    Encode the substances of a signature file as (value, {feature: count})
+    tuples, dropping signatures not in sigdict
+    '''
+    with open_text(signpath) as infile:
+        for line in infile:
+            value, signatures = parse_signatures(line)
+            counts = {}
+            for signature in signatures:
+                feature = sigdict.get(signature)
+                if feature is not None:
+                    counts[feature] = counts.get(feature, 0) + 1
+            yield value, counts
+
+def write_sparse_rows(path, rows):
+    with gzip.open(path, 'wb') as outfile:
+        for value, counts in rows:
+            outfile.write(value + ''.join(' %d:%d' % (f, counts[f]) for f in sorted(counts)) + '\n')
+
+# ================================================================================
+#  Linear models
+# ================================================================================
+
+# Solvers for which liblinear uses an initial solution (init_sol), i.e. the
+# primal Newton solvers. The other solvers (e.g. the dual solver for L2-loss
+# SVR, 12) are trained from scratch for every cost, still in one process.
+WARMSTART_SOLVERS = ['0', '2', '11']
+
+def to_liblinear_rows(matrix, rownums=None):
+    if rownums is None:
+        rownums = xrange(matrix.shape[0])
+    rows = []
+    for i in rownums:
+        start, end = matrix.indptr[i], matrix.indptr[i+1]
+        rows.append(dict(zip((matrix.indices[start:end] + 1).tolist(), matrix.data[start:end].tolist())))
+    return rows
+
+def predict_linear(matrix, weights):
+    '''
+    Predict with a liblinear weight vector (or a [features x models] matrix),
+    ignoring features that the model has never seen
+    '''
+    features = weights.shape[0]
+    if matrix.shape[1] > features:
+        matrix = matrix[:, :features]
+    elif matrix.shape[1] < features:
+        weights = weights[:matrix.shape[1]]
+    return matrix.dot(weights)
+
+def train_linear(prob, solver, cost, init_weights=None):
+    param = liblinearutil.parameter('-s %s -c %s -q' % (solver, cost))
+    if init_weights is not None:
+        param.init_sol = (liblinear.c_double * len(init_weights))(*init_weights)
+    return liblinearutil.train(prob, param)
+
+def train_path(labels, matrix, lin_type, costs, rownums=None):
+    '''
+    Train one liblinear model per cost, from the smallest cost to the largest,
+    starting each solve from the solution of the previous one (for the
+    WARMSTART_SOLVERS). Yields (cost, model, seconds spent training) tuples
+    in the order the costs were given.
+    '''
+    if rownums is not None:
+        labels = labels[rownums]
+    prob = liblinearutil.problem(labels.tolist(), to_liblinear_rows(matrix, rownums))
+    models = {}
+    traintimes = {}
+    weights = None
+    for cost in sorted(costs, key=float):
+        start = time.time()
+        models[cost] = train_linear(prob, lin_type, cost, weights)
+        traintimes[cost] = time.time() - start
+        if lin_type in WARMSTART_SOLVERS:
+            weights, _ = models[cost].get_decfun()
+    for cost in costs:
+        yield cost, models[cost], traintimes[cost]
+
+def model_weights(model):
+    weights, _ = model.get_decfun()
+    return np.array(weights, dtype=np.float64)
+
+# Solvers for which the decision value is the prediction
+REGRESSION_SOLVERS = ['L2R_L2LOSS_SVR', 'L2R_L2LOSS_SVR_DUAL', 'L2R_L1LOSS_SVR_DUAL']
+
+def read_linear_model(path):
+    '''
+    Read a model file written by liblinear, returning the header, as a dict of
+    strings, and the weights, as a [features (+ bias) x classes] array
+    '''
+    header = {}
+    with open(path) as infile:
+        for line in infile:
+            if line.strip() == 'w':
+                break
+            key, _, value = line.strip().partition(' ')
+            header[key] = value
+        weights = np.loadtxt(infile, ndmin=2)
+    return header, weights
+
+def predict_linear_models(matrix, modelpaths):
+    '''
+    Predict with many liblinear model files at once, as one product of the
+    sparse matrix with a [features x models] weight matrix. Returns a
+    [rows x models] array. Only regression and two-class models are
+    supported.
+    '''
+    models = [read_linear_model(p) for p in modelpaths]
+    weights = np.zeros((max(int(h['nr_feature']) for h, _ in models), len(models)))
+    biases = np.zeros(len(models))
+    for j, (header, w) in enumerate(models):
+        if w.shape[1] != 1:
+            raise Exception('Can only predict with regression and two-class models: %s' % modelpaths[j])
+        if float(header['bias']) >= 0:
+            biases[j] = float(header['bias']) * w[-1, 0]
+            w = w[:-1]
+        weights[:w.shape[0], j] = w[:, 0]
+    predictions = np.asarray(predict_linear(matrix, weights)) + biases
+    for j, (header, _) in enumerate(models):
+        if header['solver_type'] not in REGRESSION_SOLVERS:
+            labels = [float(l) for l in header['label'].split()]
+            predictions[:, j] = np.where(predictions[:, j] > 0, labels[0], labels[1])
+    return predictions
+
+# ================================================================================
+#  Approximate RBF models
+#
+#  The RBF kernel is approximated with the Nystroem method: the train rows
+#  are mapped onto the kernel values of a random sample of them (the
+#  landmarks), whitened with the inverse square root of the kernel matrix of
+#  the landmarks, and a ridge regression is fitted to the mapped rows. The
+#  number of landmarks trades accuracy (all train rows gives the exact
+#  kernel) for time, which is O(rows x landmarks^2) for training.
+# ================================================================================
+
+# Rows mapped at a time, to keep the dense [rows x landmarks] blocks small
+APPROX_CHUNK_ROWS = 4096
+
+KERNEL_CACHE_MB = 1024
+
+def file_digest(path, blocksize=16*1024*1024):
+    digest = hashlib.sha1()
+    paths = [os.path.join(path, f) for f in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    for p in paths:
+        with open(p, 'rb') as infile:
+            for block in iter(lambda: infile.read(blocksize), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def array_digest(*arrays):
+    digest = hashlib.sha1()
+    for arr in arrays:
+        digest.update(np.ascontiguousarray(arr))
+    return digest.hexdigest()
+
+class KernelCache(object):
+    '''
+    A directory of arrays (.npy files) computed from kernel values, bounded
+    to max_mb megabytes by evicting the least recently used ones. Meant for node-local disk,
+    and safe to share between concurrent processes: blocks are written to a
+    temporary file and renamed into place, and a block evicted while being
+    read is simply computed again.
+    '''
+    def __init__(self, cachedir, max_mb=KERNEL_CACHE_MB):
+        self.cachedir = cachedir
+        self.max_bytes = max_mb * 1024 * 1024
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                if not os.path.isdir(cachedir):
+                    raise
+
+    def path(self, key):
+        return os.path.join(self.cachedir, key + '.npy')
+
+    def get(self, key):
+        try:
+            block = np.load(self.path(key))
+            os.utime(self.path(key), None)
+            return block
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, key, block):
+        tmppath = self.path(key) + '.tmp%d' % os.getpid()
+        with open(tmppath, 'wb') as outfile:
+            np.save(outfile, block)
+        os.rename(tmppath, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for f in os.listdir(self.cachedir):
+            if f.endswith('.npy'):
+                try:
+                    st = os.stat(os.path.join(self.cachedir, f))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, f))
+        total = sum(size for _, size, _ in entries)
+        for _, size, f in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cachedir, f))
+            except OSError:
+                pass
+            total -= size
+
+def kernel_cache(args, datapath):
+    '''
+    The KernelCache and data key given by the --kernel-cache options of a
+    command, or (None, None) when not caching
+    '''
+    if args.kernel_cache is None:
+        return None, None
+    return KernelCache(args.kernel_cache, args.kernel_cache_mb), file_digest(datapath)
+
+def squared_norms(matrix):
+    return np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+
+def align_features(matrix, features):
+    '''
+    Drop the columns of a CSR matrix beyond features, or pad it with empty
+    columns up to features, for products with another matrix
+    '''
+    if matrix.shape[1] > features:
+        return matrix[:, :features]
+    elif matrix.shape[1] < features:
+        return sp.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], features))
+    return matrix
+
+def sparse_dots(matrix, other):
+    return np.asarray(align_features(matrix, other.shape[1]).dot(other.T).todense())
+
+def rbf_from_dots(matrix, dots, other_norms, gamma):
+    dists = squared_norms(matrix)[:, np.newaxis] + other_norms[np.newaxis, :] - 2 * dots
+    return np.exp(-gamma * np.maximum(dists, 0))
+
+def rbf_kernel(matrix, landmarks, gamma):
+    '''
+    The [rows x landmarks] RBF kernel values of the rows of two sparse
+    matrices, with features beyond those of the landmarks only counting
+    towards the distance
+    '''
+    return rbf_from_dots(matrix, sparse_dots(matrix, landmarks), squared_norms(landmarks), gamma)
+
+def nystroem_projection(landmarks, gamma, rcond=1e-10):
+    '''
+    The [landmarks x components] matrix mapping kernel values on the
+    landmarks to Nystroem features, leaving out the directions with
+    (numerically) zero eigenvalues
+    '''
+    eigvals, eigvecs = np.linalg.eigh(rbf_kernel(landmarks, landmarks, gamma))
+    keep = eigvals > rcond * eigvals.max()
+    return eigvecs[:, keep] / np.sqrt(eigvals[keep])
+
+def nystroem_features(matrix, model):
+    '''
+    The Nystroem features of the rows of matrix, a chunk at a time, with a
+    constant column appended for the intercept
+    '''
+    for start in xrange(0, matrix.shape[0], APPROX_CHUNK_ROWS):
+        features = rbf_kernel(matrix[start:start+APPROX_CHUNK_ROWS], model['landmarks'], model['gamma']).dot(model['projection'])
+        yield np.hstack([features, np.ones((features.shape[0], 1))])
+
+def normal_equations(labels, matrix, model):
+    '''
+    The gram matrix and moments of the Nystroem features of the train rows,
+    accumulated a chunk of rows at a time
+    '''
+    dims = model['projection'].shape[1] + 1
+    gram = np.zeros((dims, dims))
+    moments = np.zeros(dims)
+    start = 0
+    for features in nystroem_features(matrix, model):
+        gram += features.T.dot(features)
+        moments += features.T.dot(labels[start:start+features.shape[0]])
+        start += features.shape[0]
+    return gram, moments
+
+def train_approx_rbf(labels, matrix, gamma, cost, landmarks_count, seed, cache=None, datakey=None):
+    '''
+    Fit a ridge regression to the Nystroem features of the train rows, with
+    a penalty of 1/(2 * cost) on the weights (not the intercept), to match
+    the cost of an SVR. The normal equations do not depend on the cost, so
+    with a KernelCache they are looked up by datakey (the digest of the data
+    file), gamma and landmarks, and only computed when missing, leaving only
+    the solve for models differing in cost.
+    '''
+    rng = np.random.RandomState(seed)
+    rownums = np.sort(rng.choice(matrix.shape[0], min(landmarks_count, matrix.shape[0]), replace=False))
+    model = {'gamma': float(gamma), 'landmarks': matrix[rownums]}
+    model['projection'] = nystroem_projection(model['landmarks'], model['gamma'])
+    dims = model['projection'].shape[1] + 1
+    block = None
+    if cache is not None:
+        landmarks = model['landmarks']
+        key = '%s_g%r_l%s' % (datakey, model['gamma'], array_digest(landmarks.data, landmarks.indices, landmarks.indptr))
+        block = cache.get(key)
+    if block is None or block.shape != (dims + 1, dims):
+        gram, moments = normal_equations(labels, matrix, model)
+        if cache is not None:
+            cache.put(key, np.vstack([gram, moments]))
+    else:
+        gram, moments = block[:-1], block[-1]
+    penalty = np.eye(dims) / (2 * float(cost))
+    penalty[-1, -1] = 0
+    model['weights'] = np.linalg.solve(gram + penalty, moments)
+    return model
+
+def predict_approx_rbf(matrix, model):
+    return np.concatenate([features.dot(model['weights']) for features in nystroem_features(matrix, model)])
+
+def write_approx_model(path, model):
+    landmarks = model['landmarks']
+    with open(path, 'wb') as outfile:
+        np.savez(outfile, gamma=model['gamma'], projection=model['projection'], weights=model['weights'],
+                 landmarks_data=landmarks.data, landmarks_indices=landmarks.indices,
+                 landmarks_indptr=landmarks.indptr, landmarks_shape=np.array(landmarks.shape))
+
+def read_approx_model(path):
+    arrays = np.load(path)
+    return {'gamma': float(arrays['gamma']),
+            'projection': arrays['projection'],
+            'weights': arrays['weights'],
+            'landmarks': sp.csr_matrix((arrays['landmarks_data'], arrays['landmarks_indices'], arrays['landmarks_indptr']),
+                                       shape=tuple(arrays['landmarks_shape']))}
+
+# ================================================================================
+#  SVM models
+#
+#  Prediction with libsvm model files, as by svm-predict, but with the
+#  support vectors as one sparse matrix, their squared norms computed once,
+#  and the kernel values of a whole batch of rows computed with one sparse
+#  product.
+# ================================================================================
+
+SVM_REGRESSION_TYPES = ['epsilon_svr', 'nu_svr']
+
+# Kernel values computed at a time, per worker: the rows of a batch times
+# the number of support vectors
+SVM_KERNEL_BLOCK = 4 * 1024 * 1024
+
+def read_svm_model(path):
+    '''
+    Read a regression model file written by libsvm, with the support vectors
+    as a CSR matrix (zero-based features, as by parse_libsvm)
+    '''
+    header = {}
+    with open(path) as infile:
+        for line in infile:
+            if line.strip() == 'SV':
+                break
+            key, _, value = line.strip().partition(' ')
+            header[key] = value
+        if header.get('svm_type') not in SVM_REGRESSION_TYPES:
+            raise Exception('Can only predict with regression models (%s): %s' % (', '.join(SVM_REGRESSION_TYPES), path))
+        # With one coefficient per support vector, the lines parse as libsvm data
+        coefs, svs = parse_libsvm(infile)
+    return {'kernel_type': header['kernel_type'],
+            'gamma': float(header.get('gamma', 0)),
+            'coef0': float(header.get('coef0', 0)),
+            'degree': int(header.get('degree', 3)),
+            'rho': float(header['rho']),
+            'coefs': coefs,
+            'svs': svs,
+            'sv_norms': squared_norms(svs)}
+
+def predict_svm(matrix, model):
+    dots = sparse_dots(matrix, model['svs'])
+    kernel_type = model['kernel_type']
+    if kernel_type == 'linear':
+        kernel = dots
+    elif kernel_type == 'polynomial':
+        kernel = (model['gamma'] * dots + model['coef0']) ** model['degree']
+    elif kernel_type == 'rbf':
+        kernel = rbf_from_dots(matrix, dots, model['sv_norms'], model['gamma'])
+    elif kernel_type == 'sigmoid':
+        kernel = np.tanh(model['gamma'] * dots + model['coef0'])
+    else:
+        raise Exception('Unsupported kernel type: %s' % kernel_type)
+    return kernel.dot(model['coefs']) - model['rho']
+
+# The model and data of cmd_predictsvm, inherited by the forked workers
+svm_predict_state = {}
+
+def predict_svm_batch(bounds):
+    start, end = bounds
+    return predict_svm(svm_predict_state['matrix'][start:end], svm_predict_state['model'])
+
+# ================================================================================
+#  Cost search
+# ================================================================================
+
+def format_cost(cost, digits=3):
+    '''
+    A cost rounded to digits significant digits, written out in plain
+    decimals like the costs of the grids (e.g. 0.000316 or 100000000000),
+    so that the files named after it match the _c([0-9\.]+) patterns of
+    mmaudit and collect_rdataframe
+    '''
+    cost = float('%.*g' % (digits, cost))
+    text = '%.*f' % (max(0, digits - 1 - int(math.floor(math.log10(cost)))), cost)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text
+
+class FoldPath(object):
+    '''
+    One cross-validation fold, remembering the solution for every cost
+    trained on it, so that new costs can be warm-started from the closest
+    smaller one (for the WARMSTART_SOLVERS).
+
+    The train and test parts are given as (labels, matrix, rownums) tuples,
+    where rownums selects the rows of the fold (None meaning all rows), so
+    that all folds can share one in-memory copy of the data. The liblinear
+    problem of the train part, several times the size of the data itself, is
+    built by build_problem, and kept by fit_fold only until the process
+    trains another fold.
+    '''
+    def __init__(self, train, test, lin_type):
+        self.train = train
+        test_labels, test_matrix, test_rownums = test
+        if test_rownums is not None:
+            test_labels, test_matrix = test_labels[test_rownums], test_matrix[test_rownums]
+        self.test_labels, self.test_matrix = test_labels, test_matrix
+        self.lin_type = lin_type
+        self.solutions = {}
+
+    def init_weights(self, cost):
+        if self.lin_type in WARMSTART_SOLVERS:
+            smaller = [c for c in self.solutions if float(c) < float(cost)]
+            if smaller:
+                return self.solutions[max(smaller, key=float)]
+        return None
+
+    def build_problem(self):
+        train_labels, train_matrix, train_rownums = self.train
+        if train_rownums is not None:
+            train_labels = train_labels[train_rownums]
+        return liblinearutil.problem(train_labels.tolist(), to_liblinear_rows(train_matrix, train_rownums))
+
+    def fit(self, problem, cost, init_weights=None):
+        '''
+        Train the fold with cost, on its problem as by build_problem,
+        returning the RMSD on its test part and the weights of the model
+        '''
+        weights = model_weights(train_linear(problem, self.lin_type, cost, init_weights))
+        return calc_rmsd(self.test_labels, predict_linear(self.test_matrix, weights)), weights
+
+# The folds of cmd_searchcost, inherited by the forked workers, and the
+# problem of the fold last trained in this process
+cost_search_state = {}
+
+def fit_fold(job):
+    fold_index, cost, init_weights = job
+    fold = cost_search_state['folds'][fold_index]
+    if cost_search_state.get('problem_fold') != fold_index:
+        # Free the problem of the previous fold before building the next one
+        cost_search_state['problem'] = None
+        cost_search_state['problem'] = fold.build_problem()
+        cost_search_state['problem_fold'] = fold_index
+    return fold.fit(cost_search_state['problem'], cost, init_weights)
+
+def serve_fold_jobs(conn):
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        try:
+            conn.send((True, fit_fold(job)))
+        except Exception as e:
+            conn.send((False, '%s: %s' % (type(e).__name__, e)))
+    conn.close()
+
+class FoldWorkers(object):
+    '''
+    A pool of worker processes, like multiprocessing.Pool, which always gives
+    the job of fold i to worker i modulo the number of workers. Every worker
+    thus keeps the problem of (one of) its own folds between costs, and only
+    has to rebuild it when it has more folds than one. Must be created after
+    cost_search_state['folds'] was set.
+    '''
+    def __init__(self, workers):
+        self.conns = []
+        self.processes = []
+        for _ in xrange(workers):
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_fold_jobs, args=(child_conn,))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def map(self, jobs):
+        '''
+        Run fit_fold on every job, returning the results in order
+        '''
+        # One job per worker at a time, so that neither side blocks on a
+        # full pipe while the other is sending too
+        results = []
+        for start in xrange(0, len(jobs), len(self.conns)):
+            batch = jobs[start:start+len(self.conns)]
+            for conn, job in zip(self.conns, batch):
+                conn.send(job)
+            for conn, _ in zip(self.conns, batch):
+                ok, result = conn.recv()
+                if not ok:
+                    raise Exception('Training a fold failed: %s' % result)
+                results.append(result)
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+
+    def join(self):
+        for process in self.processes:
+            process.join()
+
+def search_cost(folds, grid, patience, refine_steps, pool=None):
+    '''
+    Find the cost with the lowest fold-averaged RMSD.
+
+    The (ascending) grid is evaluated until the averaged RMSD has risen for
+    `patience` consecutive costs. The interval around the best grid point is
+    then narrowed down with `refine_steps` steps of golden-section search,
+    in log10(cost) space. The folds of every cost are trained in parallel
+    on pool, a FoldWorkers, when given, which must have been created after
+    cost_search_state['folds'] was set to folds. Returns a dict of {cost:
+    average RMSD} for all costs evaluated, with the costs as by format_cost.
+    '''
+    if not grid:
+        raise Exception('No costs to search, please give at least one')
+    cost_search_state['folds'] = folds
+    evaluated = {}
+    def evaluate(logcost):
+        cost = format_cost(10**logcost)
+        if cost not in evaluated:
+            jobs = [(i, cost, fold.init_weights(cost)) for i, fold in enumerate(folds)]
+            results = pool.map(jobs) if pool is not None else [fit_fold(job) for job in jobs]
+            for fold, (_, weights) in zip(folds, results):
+                fold.solutions[cost] = weights
+            evaluated[cost] = sum(rmsd for rmsd, _ in results) / len(folds)
+        return evaluated[cost]
+
+    logs = sorted(np.log10(float(c)) for c in grid)
+    rises = 0
+    previous = None
+    for i, logcost in enumerate(logs):
+        current = evaluate(logcost)
+        if previous is not None and current > previous:
+            rises += 1
+        else:
+            rises = 0
+        previous = current
+        if rises >= patience:
+            break
+    scanned = logs[:i+1]
+    best = min(xrange(len(scanned)), key=lambda j: evaluate(scanned[j]))
+
+    invphi = (np.sqrt(5) - 1) / 2
+    low = scanned[max(best - 1, 0)]
+    high = scanned[min(best + 1, len(scanned) - 1)]
+    for _ in xrange(refine_steps):
+        if high - low < 1e-3:
+            break
+        left = high - invphi * (high - low)
+        right = low + invphi * (high - low)
+        if evaluate(left) < evaluate(right):
+            high = right
+        else:
+            low = left
+    return evaluated
+
+# ================================================================================
+#  Commands
+# ================================================================================
+
+def read_fold(path, fold_index, folds_count):
+    '''
+    Read the train and test part of one fold straight from the rows of a
+    (shuffled) dataset, without writing them out to separate files first
+    '''
+    if os.path.isdir(path):
+        labels, matrix = read_binary(path)
+        train_rownums, test_rownums = fold_rows(len(labels), fold_index, folds_count)
+        return (labels[train_rownums], matrix[train_rownums]), (labels[test_rownums], matrix[test_rownums])
+    rows = MappedRows(path)
+    train_rownums, test_rownums = fold_rows(len(rows), fold_index, folds_count)
+    return parse_libsvm(rows.rows(train_rownums)), parse_libsvm(rows.rows(test_rownums))
+
+def cmd_index(args):
+    write_index(args.file)
+
+def cmd_indexed(args):
+    '''
+    Run a shell command producing a file, and then write the line index of
+    the file, so that both run in the same job
+    '''
+    sub.check_call(args.command, shell=True)
+    write_index(args.file)
+
+def cmd_countlines(args):
+    with open(args.linecount, 'w') as outfile:
+        outfile.write(str(count_rows(args.file)))
+
+def copy_byteranges(inpath, ranges, outpath, bufsize=16*1024*1024):
+    with open(inpath, 'rb') as infile, open(outpath, 'wb') as outfile:
+        for start, end in ranges:
+            infile.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = infile.read(min(bufsize, remaining))
+                outfile.write(data)
+                remaining -= len(data)
+
+def cmd_createfolds(args):
+    '''
+    Split a fold into train and test files, as CreateFolds does, but by
+    copying the byte ranges given by the line index, instead of going
+    through the data line by line
+    '''
+    offsets = read_index(args.dataset)
+    if offsets is None:
+        offsets = write_index(args.dataset)
+    rowcount = len(offsets) - 1
+    perfold = rowcount // args.folds_count
+    test_start = int(offsets[args.fold_index * perfold])
+    test_end = int(offsets[(args.fold_index + 1) * perfold])
+    copy_byteranges(args.dataset, [(test_start, test_end)], args.testdata)
+    copy_byteranges(args.dataset, [(0, test_start), (test_end, int(offsets[-1]))], args.traindata)
+
+def seeded_rng(seed):
+    '''
+    A random generator, always in the same state for the same seed string
+    '''
+    return np.random.RandomState(int(hashlib.sha1(seed).hexdigest()[:8], 16))
+
+def seeded_permutation(count, seed):
+    return seeded_rng(seed).permutation(count)
+
+def write_rows(outfile, rows, rownums):
+    for i in rownums:
+        row = rows[i]
+        outfile.write(row if row.endswith(b'\n') else row + b'\n')
+
+def write_gzipped_rows(path, rows, rownums):
+    with gzip.open(path, 'wb') as outfile:
+        write_rows(outfile, rows, rownums)
+
+def cmd_samplenested(args):
+    '''
+    Sample a test set, and train sets of many sizes, from the rows of a file.
+    All are taken from one seeded permutation of the rows: the test set from
+    its start, and every train set from the rows after the test set, so that
+    each train set is a subset of all larger ones. Rows are picked out by
+    their line offsets (see MappedRows), found in one pass over the file
+    when there is no index, and written gzipped, in file order. The test set
+    is written to all the test files given, e.g. one per train size.
+    '''
+    if is_gzipped(args.signatures):
+        with open_text(args.signatures) as infile:
+            rows = infile.readlines()
+    else:
+        rows = MappedRows(args.signatures)
+    test_size = int(args.test_size)
+    rest = len(rows) - test_size
+    train_counts = [rest if size == 'rest' else int(size) for size in args.train_sizes.split(',')]
+    if rest < 0 or max(train_counts) > rest:
+        raise Exception('Can not sample %d test rows and %d train rows from the %d rows of %s' % (test_size, max(train_counts), len(rows), args.signatures))
+    perm = seeded_permutation(len(rows), args.seed)
+    testpaths = args.testdata.split(',')
+    write_gzipped_rows(testpaths[0], rows, np.sort(perm[:test_size]))
+    for path in testpaths[1:]:
+        shutil.copyfile(testpaths[0], path)
+    for count, path in zip(train_counts, args.traindata.split(',')):
+        write_gzipped_rows(path, rows, np.sort(perm[test_size:test_size + count]))
+
+SHUFFLE_MEMORY_MB = 4096
+
+# Lines dealt out over the buckets of an external shuffle at a time
+SHUFFLE_BATCH_LINES = 65536
+
+def cmd_shuffle(args):
+    '''
+    Shuffle the lines of a file with a generator seeded by --seed, by
+    sorting the lines on random keys drawn in line order. In memory when the
+    file fits in --memory-mb, and otherwise by dealing the lines out over
+    temporary bucket files by key range, each small enough to be sorted in
+    memory, and concatenating the sorted buckets. Either way, the same seed
+    gives the same permutation. The file can be gzipped, and the shuffled
+    file is written ungzipped, with a line index.
+    '''
+    rng = seeded_rng(args.seed)
+    size = text_size(args.file)
+    memory = args.memory_mb * 1024 * 1024
+    with open(args.output, 'wb') as outfile:
+        if size <= memory:
+            if is_gzipped(args.file):
+                with open_text(args.file) as infile:
+                    rows = infile.readlines()
+            else:
+                rows = MappedRows(args.file)
+            # The same keys as drawn a batch at a time below
+            keys = rng.random_sample(len(rows))
+            write_rows(outfile, rows, np.argsort(keys, kind='mergesort'))
+        else:
+            bucketdir = args.output + '.buckets'
+            if os.path.exists(bucketdir):
+                shutil.rmtree(bucketdir)
+            os.makedirs(bucketdir)
+            # Buckets of half the memory on average, leaving room for the unevenness
+            bucketpaths = [os.path.join(bucketdir, '%04d' % i) for i in xrange(int(math.ceil(2.0 * size / memory)))]
+            bucketfiles = [open(p, 'wb') for p in bucketpaths]
+            keyfiles = [open(p + '.keys', 'wb') for p in bucketpaths]
+            with open_text(args.file) as infile:
+                while True:
+                    lines = list(itertools.islice(infile, SHUFFLE_BATCH_LINES))
+                    if not lines:
+                        break
+                    keys = rng.random_sample(len(lines))
+                    buckets = np.minimum((keys * len(bucketfiles)).astype(int), len(bucketfiles) - 1)
+                    for line, bucket in zip(lines, buckets):
+                        bucketfiles[bucket].write(line if line.endswith(b'\n') else line + b'\n')
+                    for bucket in np.unique(buckets):
+                        keys[buckets == bucket].tofile(keyfiles[bucket])
+            for bucketfile in bucketfiles + keyfiles:
+                bucketfile.close()
+            # The buckets hold consecutive key ranges, so sorting each one
+            # sorts the whole
+            for bucketpath in bucketpaths:
+                with open(bucketpath, 'rb') as bucketfile:
+                    lines = bucketfile.readlines()
+                keys = np.fromfile(bucketpath + '.keys', dtype=np.float64)
+                write_rows(outfile, lines, np.argsort(keys, kind='mergesort'))
+            shutil.rmtree(bucketdir)
+    write_index(args.output)
+
+def cmd_tobinary(args):
+    labels, matrix = read_sparse(args.sparse)
+    write_binary(args.binary, labels, matrix)
+
+def cmd_totext(args):
+    labels, matrix = read_binary(args.binary)
+    write_sparse(args.sparse, labels, matrix)
+
+def cmd_predict(args):
+    '''
+    Predict a test dataset with many liblinear models, parsing the dataset
+    only once
+    '''
+    _, matrix = read_sparse(args.testdata)
+    predictions = predict_linear_models(matrix, args.models.split(','))
+    for j, path in enumerate(args.predictions.split(',')):
+        write_predictions(path, predictions[:, j])
+
+def cmd_assess(args):
+    '''
+    Assess the predictions of all costs on all folds, reading the labels of
+    each fold only once. Writes a table with one row per cost and fold, plus
+    the fold averages of every cost, and the cost with the lowest average
+    RMSD, in the format of SelectLowestRMSD.
+    '''
+    costs = [p.split(':', 1)[0] for p in args.predictions]
+    predpaths = {p.split(':', 1)[0]: p.split(':', 1)[1].split(',') for p in args.predictions}
+    if args.dataset is not None:
+        labels = read_labels(args.dataset)
+        fold_labels = [labels[fold_rows(len(labels), i, args.folds_count)[1]] for i in xrange(args.folds_count)]
+    else:
+        fold_labels = [read_labels(p) for p in args.testdata.split(',')]
+    stats = np.zeros((len(costs), len(fold_labels), len(ASSESSMENT_COLUMNS)))
+    for f, labels in enumerate(fold_labels):
+        predictions = np.column_stack([read_predictions(predpaths[c][f]) for c in costs])
+        stats[:, f, :] = assess(labels, predictions)
+    averages = stats.mean(axis=1)
+    with open(args.table, 'w') as outfile:
+        outfile.write('\t'.join(['cost', 'fold'] + ASSESSMENT_COLUMNS) + '\n')
+        for i, cost in enumerate(costs):
+            for f in xrange(len(fold_labels)):
+                outfile.write('\t'.join([cost, str(f)] + ['%g' % v for v in stats[i, f]]) + '\n')
+            outfile.write('\t'.join([cost, 'avg'] + ['%g' % v for v in averages[i]]) + '\n')
+    lowest = int(np.argmin(averages[:, 0]))
+    write_record(args.lowest, {'lowest_rmsd': averages[lowest, 0], 'lowest_cost': costs[lowest]})
+
+def cmd_percentiles(args):
+    '''
+    Select the values at many percent indexes of the predictions, which may
+    be split over several files, in one pass
+    '''
+    values = np.concatenate([read_predictions(p) for p in args.predictions.split(',')])
+    percents = args.percents.split(',')
+    for pct, value, outpath in zip(percents, percent_index_values(values, percents), args.outputs.split(',')):
+        write_record(outpath, {'percent_index': pct, 'index_value': float(value)})
+
+def cmd_sigdict(args):
+    build_sigdict(args.signatures, args.dictionary)
+
+def cmd_sparsetrain(args):
+    '''
+    Create a sparse train dataset using the global signature dictionary,
+    remapping the features occurring in the train set to 1..n (in global id
+    order), and writing the signatures of the remapped features
+    '''
+    sigdict = read_sigdict(args.dictionary)
+    rows = list(encode_signatures(args.traindata, sigdict))
+    used = sorted(set(f for _, counts in rows for f in counts))
+    remap = {f: i for i, f in enumerate(used, 1)}
+    write_sparse_rows(args.sparse, ((value, {remap[f]: c for f, c in counts.items()}) for value, counts in rows))
+    signatures = [None] * len(used)
+    for signature, f in sigdict.items():
+        if f in remap:
+            signatures[remap[f] - 1] = signature
+    with open(args.split_signatures, 'w') as outfile:
+        for signature in signatures:
+            outfile.write(signature + '\n')
+
+def cmd_sparsetest(args):
+    '''
+    Create a sparse test dataset with the features of a train dataset
+    '''
+    write_sparse_rows(args.sparse, encode_signatures(args.testdata, read_sigdict(args.split_signatures)))
+
+def cmd_splitlines(args):
+    '''
+    Split a text file into contiguous chunks with (as near as possible) the
+    same number of lines, so that concatenating the chunks in order gives
+    back the original file. With --interleave, line i goes to chunk
+    i % chunks instead, so that every chunk is a sample of the whole file.
+    '''
+    with open_text(args.file) as infile:
+        lines = infile.readlines()
+    chunkpaths = args.chunks.split(',')
+    for i, chunkpath in enumerate(chunkpaths):
+        if args.interleave:
+            chunk = lines[i::len(chunkpaths)]
+        else:
+            chunk = lines[i * len(lines) // len(chunkpaths):(i + 1) * len(lines) // len(chunkpaths)]
+        with open(chunkpath, 'w') as outfile:
+            outfile.writelines(chunk)
+
+def cmd_concat(args):
+    '''
+    Concatenate files byte by byte, in the order given (which also works for
+    gzipped files, as a gzip file may consist of several members)
+    '''
+    with open(args.output, 'wb') as outfile:
+        for inpath in args.inputs.split(','):
+            with open(inpath, 'rb') as infile:
+                shutil.copyfileobj(infile, outfile, 16*1024*1024)
+
+def feature_key(tokens):
+    '''
+    The features of a libsvm data or model line, normalised to the precision
+    libsvm writes support vectors with, for matching them up
+    '''
+    return ' '.join('%s:%.8g' % (t.split(':')[0], float(t.split(':')[1])) for t in tokens if ':' in t)
+
+def support_vector_keys(modelpath):
+    keys = set()
+    with open(modelpath) as modelfile:
+        for line in modelfile:
+            if line.strip() == 'SV':
+                break
+        for line in modelfile:
+            keys.add(feature_key(line.split()))
+    return keys
+
+def cmd_svmerge(args):
+    '''
+    Write the rows of the train datasets that are support vectors of the
+    libsvm models trained on them, for the next layer of a cascade SVM
+    '''
+    with open(args.output, 'w') as outfile:
+        for modelpath, datapath in zip(args.models.split(','), args.traindata.split(',')):
+            keys = support_vector_keys(modelpath)
+            with open_text(datapath) as infile:
+                for line in infile:
+                    if feature_key(line.split()[1:]) in keys:
+                        outfile.write(line)
+
+def cmd_trainpath(args):
+    costs = args.costs.split(',')
+    if args.dataset is not None:
+        (train_labels, train_matrix), (test_labels, test_matrix) = read_fold(args.dataset, args.fold_index, args.folds_count)
+    else:
+        train_labels, train_matrix = read_sparse(args.traindata)
+        test_labels, test_matrix = read_sparse(args.testdata)
+    model_paths = dict(zip(costs, args.models.split(',')))
+    prediction_paths = dict(zip(costs, args.predictions.split(',')))
+    assessment_paths = dict(zip(costs, args.assessments.split(',')))
+    traintime = 0
+    for cost, model, seconds in train_path(train_labels, train_matrix, args.lin_type, costs):
+        traintime += seconds
+        liblinearutil.save_model(model_paths[cost], model)
+        predictions = predict_linear(test_matrix, model_weights(model))
+        write_predictions(prediction_paths[cost], predictions)
+        write_record(assessment_paths[cost], {'rmsd': calc_rmsd(test_labels, predictions), 'cost': cost})
+    if args.traintime is not None:
+        with open(args.traintime, 'w') as outfile:
+            outfile.write(str(int(round(traintime))))
+
+def cmd_trainlinear(args):
+    '''
+    Train one liblinear model, as by the train binary, but on a dataset
+    read in-process, so that it can be gzipped
+    '''
+    labels, matrix = read_sparse(args.traindata)
+    problem = liblinearutil.problem(labels.tolist(), to_liblinear_rows(matrix))
+    del labels, matrix
+    start = time.time()
+    model = train_linear(problem, args.lin_type, args.cost)
+    traintime = time.time() - start
+    liblinearutil.save_model(args.model, model)
+    with open(args.traintime, 'w') as outfile:
+        outfile.write(str(int(round(traintime))))
+
+def cmd_trainsvm(args):
+    '''
+    Train one libsvm model, as by svm-train, but on a dataset read
+    in-process, so that it can be gzipped
+    '''
+    import svmutil # The Python interface of libsvm, only needed here
+    labels, matrix = read_sparse(args.traindata)
+    problem = svmutil.svm_problem(labels.tolist(), to_liblinear_rows(matrix))
+    del labels, matrix
+    start = time.time()
+    model = svmutil.svm_train(problem, '-s %s -t %s -g %s -c %s -q' % (args.svm_type, args.kernel_type, args.gamma, args.cost))
+    traintime = time.time() - start
+    svmutil.svm_save_model(args.model, model)
+    with open(args.traintime, 'w') as outfile:
+        outfile.write(str(int(round(traintime))))
+
+def cmd_rmsd(args):
+    '''
+    Assess a prediction against the labels of a (possibly gzipped) test
+    dataset, writing the RMSD and the cost of the model
+    '''
+    labels = read_labels(args.testdata)
+    write_record(args.assessment, {'rmsd': calc_rmsd(labels, read_predictions(args.prediction)), 'cost': args.cost})
+
+def cmd_trainapprox(args):
+    labels, matrix = read_sparse(args.traindata)
+    start = time.time()
+    cache, datakey = kernel_cache(args, args.traindata)
+    model = train_approx_rbf(labels, matrix, args.gamma, args.cost, args.landmarks, args.seed, cache, datakey)
+    traintime = time.time() - start
+    write_approx_model(args.model, model)
+    with open(args.traintime, 'w') as outfile:
+        outfile.write(str(int(round(traintime))))
+
+def cmd_predictapprox(args):
+    labels, matrix = read_sparse(args.testdata)
+    predictions = predict_approx_rbf(matrix, read_approx_model(args.model))
+    write_predictions(args.prediction, predictions)
+    write_record(args.assessment, {'rmsd': calc_rmsd(labels, predictions), 'cost': args.cost})
+
+def cmd_predictsvm(args):
+    '''
+    Predict a dataset with a libsvm regression model, in batches of rows
+    spread over a pool of worker processes, writing the predictions in row
+    order as the batches finish
+    '''
+    _, matrix = read_sparse(args.testdata)
+    model = read_svm_model(args.model)
+    svm_predict_state.update(matrix=matrix, model=model)
+    rows = max(1, SVM_KERNEL_BLOCK // max(1, model['svs'].shape[0]))
+    batches = [(start, min(start + rows, matrix.shape[0])) for start in xrange(0, matrix.shape[0], rows)]
+    pool = multiprocessing.Pool(args.workers)
+    with open(args.prediction, 'w') as outfile:
+        for predictions in pool.imap(predict_svm_batch, batches):
+            for val in predictions:
+                outfile.write(PREDICTION_FORMAT % val)
+    pool.close()
+    pool.join()
+
+def cmd_searchcost(args):
+    if args.dataset is not None:
+        labels, matrix = read_sparse(args.dataset)
+        folds = []
+        for fold_index in xrange(args.folds_count):
+            train_rownums, test_rownums = fold_rows(len(labels), fold_index, args.folds_count)
+            folds.append(FoldPath((labels, matrix, train_rownums), (labels, matrix, test_rownums), args.lin_type))
+    else:
+        folds = [FoldPath(read_sparse(trn) + (None,), read_sparse(tst) + (None,), args.lin_type)
+                 for trn, tst in zip(args.traindata.split(','), args.testdata.split(','))]
+    pool = None
+    if args.workers > 1:
+        cost_search_state['folds'] = folds
+        pool = FoldWorkers(min(args.workers, len(folds)))
+    evaluated = search_cost(folds, args.costs.split(','), args.patience, args.refine_steps, pool)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    with open(args.rmsdavgs, 'w') as outfile:
+        outfile.write('cost\trmsd_avg\n')
+        for cost in sorted(evaluated, key=float):
+            outfile.write('%s\t%f\n' % (cost, evaluated[cost]))
+    lowest_cost = min(evaluated, key=evaluated.get)
+    write_record(args.lowest, {'lowest_rmsd': evaluated[lowest_cost], 'lowest_cost': lowest_cost})
+
+def main():
+    parser = argparse.ArgumentParser(description='Numerical helpers for the MM workflows')
+    subparsers = parser.add_subparsers()
+
+    index = subparsers.add_parser('index', help='Write a line offset index for a file')
+    index.add_argument('file')
+    index.set_defaults(func=cmd_index)
+
+    indexed = subparsers.add_parser('indexed', help='Run a command producing a file, and write a line index for the file')
+    indexed.add_argument('--file', required=True, help='File produced by the command')
+    indexed.add_argument('command', help='Shell command, as one argument')
+    indexed.set_defaults(func=cmd_indexed)
+
+    countlines = subparsers.add_parser('countlines', help='Count the lines of a file, using its line index')
+    countlines.add_argument('file')
+    countlines.add_argument('linecount')
+    countlines.set_defaults(func=cmd_countlines)
+
+    createfolds = subparsers.add_parser('createfolds', help='Split out the train and test part of a fold, using the line index')
+    createfolds.add_argument('--dataset', required=True)
+    createfolds.add_argument('--fold-index', type=int, required=True)
+    createfolds.add_argument('--folds-count', type=int, required=True)
+    createfolds.add_argument('--traindata', required=True)
+    createfolds.add_argument('--testdata', required=True)
+    createfolds.set_defaults(func=cmd_createfolds)
+
+    samplenested = subparsers.add_parser('samplenested', help='Sample a test set and nested train sets of many sizes from one permutation')
+    samplenested.add_argument('--signatures', required=True)
+    samplenested.add_argument('--seed', required=True, help='Any string, e.g. the replicate id')
+    samplenested.add_argument('--test-size', required=True)
+    samplenested.add_argument('--train-sizes', required=True, help='Comma-separated, numbers or rest')
+    samplenested.add_argument('--testdata', required=True, help='Comma-separated, all getting the same test set')
+    samplenested.add_argument('--traindata', required=True, help='Comma-separated, one per train size')
+    samplenested.set_defaults(func=cmd_samplenested)
+
+    shuffle = subparsers.add_parser('shuffle', help='Shuffle the lines of a file reproducibly, from a seed, in bounded memory')
+    shuffle.add_argument('--seed', required=True, help='Any string')
+    shuffle.add_argument('--memory-mb', type=int, default=SHUFFLE_MEMORY_MB, help='Files larger than this are shuffled via temporary buckets')
+    shuffle.add_argument('--output', required=True)
+    shuffle.add_argument('file')
+    shuffle.set_defaults(func=cmd_shuffle)
+
+    tobinary = subparsers.add_parser('tobinary', help='Convert a sparse dataset from libsvm text to the binary format')
+    tobinary.add_argument('sparse')
+    tobinary.add_argument('binary')
+    tobinary.set_defaults(func=cmd_tobinary)
+
+    totext = subparsers.add_parser('totext', help='Convert a sparse dataset from the binary format to libsvm text')
+    totext.add_argument('binary')
+    totext.add_argument('sparse')
+    totext.set_defaults(func=cmd_totext)
+
+    predict = subparsers.add_parser('predict', help='Predict a test dataset with many liblinear models in one pass')
+    predict.add_argument('--testdata', required=True)
+    predict.add_argument('--models', required=True, help='Comma-separated liblinear model files')
+    predict.add_argument('--predictions', required=True, help='Comma-separated, one per model')
+    predict.set_defaults(func=cmd_predict)
+
+    assessparser = subparsers.add_parser('assess', help='Assess the predictions of many costs over all cross-validation folds')
+    assessparser.add_argument('--predictions', action='append', required=True, help='cost:prediction files, one per fold (repeated for every cost)')
+    assessparser.add_argument('--testdata', help='Test files, one per fold')
+    assessparser.add_argument('--dataset', help='Shuffled data to take all folds from, instead of --testdata')
+    assessparser.add_argument('--folds-count', type=int)
+    assessparser.add_argument('--table', required=True)
+    assessparser.add_argument('--lowest', required=True)
+    assessparser.set_defaults(func=cmd_assess)
+
+    percentiles = subparsers.add_parser('percentiles', help='Select the values at many percent indexes of predictions in one pass')
+    percentiles.add_argument('--predictions', required=True, help='Comma-separated prediction files, taken together')
+    percentiles.add_argument('--percents', required=True, help='Comma-separated')
+    percentiles.add_argument('--outputs', required=True, help='Comma-separated, one per percent')
+    percentiles.set_defaults(func=cmd_percentiles)
+
+    sigdict = subparsers.add_parser('sigdict', help='Build the global signature dictionary of a signature file')
+    sigdict.add_argument('--signatures', required=True)
+    sigdict.add_argument('--dictionary', required=True)
+    sigdict.set_defaults(func=cmd_sigdict)
+
+    sparsetrain = subparsers.add_parser('sparsetrain', help='Create a sparse train dataset from signatures, using a global dictionary')
+    sparsetrain.add_argument('--dictionary', required=True)
+    sparsetrain.add_argument('--traindata', required=True)
+    sparsetrain.add_argument('--sparse', required=True)
+    sparsetrain.add_argument('--split-signatures', required=True, help='File to write the signatures of the train features to')
+    sparsetrain.set_defaults(func=cmd_sparsetrain)
+
+    sparsetest = subparsers.add_parser('sparsetest', help='Create a sparse test dataset from signatures, with the features of a train dataset')
+    sparsetest.add_argument('--split-signatures', required=True)
+    sparsetest.add_argument('--testdata', required=True)
+    sparsetest.add_argument('--sparse', required=True)
+    sparsetest.set_defaults(func=cmd_sparsetest)
+
+    splitlines = subparsers.add_parser('splitlines', help='Split a text file into contiguous chunks of lines')
+    splitlines.add_argument('--chunks', required=True, help='Comma-separated chunk files to write')
+    splitlines.add_argument('--interleave', action='store_true', help='Deal out the lines round-robin, instead of in contiguous chunks')
+    splitlines.add_argument('file')
+    splitlines.set_defaults(func=cmd_splitlines)
+
+    concat = subparsers.add_parser('concat', help='Concatenate files in the order given')
+    concat.add_argument('--inputs', required=True, help='Comma-separated')
+    concat.add_argument('--output', required=True)
+    concat.set_defaults(func=cmd_concat)
+
+    svmerge = subparsers.add_parser('svmerge', help='Collect the support vector rows of libsvm models, from the data they were trained on')
+    svmerge.add_argument('--models', required=True, help='Comma-separated libsvm model files')
+    svmerge.add_argument('--traindata', required=True, help='Comma-separated, one per model')
+    svmerge.add_argument('--output', required=True)
+    svmerge.set_defaults(func=cmd_svmerge)
+
+    trainpath = subparsers.add_parser('trainpath', help='Train a liblinear regularization path, warm-started where the solver allows')
+    trainpath.add_argument('--lin-type', default='12')
+    trainpath.add_argument('--costs', required=True)
+    trainpath.add_argument('--traindata')
+    trainpath.add_argument('--testdata')
+    trainpath.add_argument('--dataset', help='Shuffled data to take the fold from, instead of --traindata/--testdata')
+    trainpath.add_argument('--fold-index', type=int)
+    trainpath.add_argument('--folds-count', type=int)
+    trainpath.add_argument('--models', required=True)
+    trainpath.add_argument('--predictions', required=True)
+    trainpath.add_argument('--assessments', required=True)
+    trainpath.add_argument('--traintime', help='File to write the total training time to, in seconds')
+    trainpath.set_defaults(func=cmd_trainpath)
+
+    trainlinear = subparsers.add_parser('trainlinear', help='Train a liblinear model on a (possibly gzipped) dataset')
+    trainlinear.add_argument('--lin-type', default='12')
+    trainlinear.add_argument('--cost', required=True)
+    trainlinear.add_argument('--traindata', required=True)
+    trainlinear.add_argument('--model', required=True)
+    trainlinear.add_argument('--traintime', required=True, help='File to write the training time to, in seconds')
+    trainlinear.set_defaults(func=cmd_trainlinear)
+
+    trainsvm = subparsers.add_parser('trainsvm', help='Train a libsvm model on a (possibly gzipped) dataset')
+    trainsvm.add_argument('--svm-type', default='3')
+    trainsvm.add_argument('--kernel-type', default='2')
+    trainsvm.add_argument('--gamma', required=True)
+    trainsvm.add_argument('--cost', required=True)
+    trainsvm.add_argument('--traindata', required=True)
+    trainsvm.add_argument('--model', required=True)
+    trainsvm.add_argument('--traintime', required=True, help='File to write the training time to, in seconds')
+    trainsvm.set_defaults(func=cmd_trainsvm)
+
+    rmsd = subparsers.add_parser('rmsd', help='Assess a prediction against the labels of a (possibly gzipped) test dataset')
+    rmsd.add_argument('--testdata', required=True)
+    rmsd.add_argument('--prediction', required=True)
+    rmsd.add_argument('--cost', required=True, help='Cost to write to the assessment')
+    rmsd.add_argument('--assessment', required=True)
+    rmsd.set_defaults(func=cmd_rmsd)
+
+    trainapprox = subparsers.add_parser('trainapprox', help='Train an approximate RBF model (Nystroem features and ridge regression)')
+    trainapprox.add_argument('--traindata', required=True)
+    trainapprox.add_argument('--gamma', type=float, required=True)
+    trainapprox.add_argument('--cost', type=float, required=True)
+    trainapprox.add_argument('--landmarks', type=int, default=1000, help='Number of train rows to approximate the kernel with')
+    trainapprox.add_argument('--seed', type=int, default=0)
+    trainapprox.add_argument('--model', required=True)
+    trainapprox.add_argument('--traintime', required=True, help='File to write the training time to, in seconds')
+    trainapprox.add_argument('--kernel-cache', help='Directory to keep the normal equations in, for reuse by models differing only in cost')
+    trainapprox.add_argument('--kernel-cache-mb', type=int, default=KERNEL_CACHE_MB)
+    trainapprox.set_defaults(func=cmd_trainapprox)
+
+    predictapprox = subparsers.add_parser('predictapprox', help='Predict and assess a test dataset with an approximate RBF model')
+    predictapprox.add_argument('--model', required=True)
+    predictapprox.add_argument('--testdata', required=True)
+    predictapprox.add_argument('--cost', required=True, help='Cost to write to the assessment')
+    predictapprox.add_argument('--prediction', required=True)
+    predictapprox.add_argument('--assessment', required=True)
+    predictapprox.set_defaults(func=cmd_predictapprox)
+
+    predictsvm = subparsers.add_parser('predictsvm', help='Predict a dataset with a libsvm regression model, in batches over many processes')
+    predictsvm.add_argument('--model', required=True)
+    predictsvm.add_argument('--testdata', required=True)
+    predictsvm.add_argument('--prediction', required=True)
+    predictsvm.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    predictsvm.set_defaults(func=cmd_predictsvm)
+
+    searchcost = subparsers.add_parser('searchcost', help='Search for the liblinear cost with the lowest cross-validated RMSD')
+    searchcost.add_argument('--lin-type', default='12')
+    searchcost.add_argument('--costs', required=True, help='Coarse grid of costs')
+    searchcost.add_argument('--patience', type=int, default=3)
+    searchcost.add_argument('--refine-steps', type=int, default=6)
+    searchcost.add_argument('--traindata', help='Train files, one per fold')
+    searchcost.add_argument('--testdata', help='Test files, one per fold')
+    searchcost.add_argument('--dataset', help='Shuffled data to take all folds from, instead of --traindata/--testdata')
+    searchcost.add_argument('--folds-count', type=int)
+    searchcost.add_argument('--workers', type=int, default=1, help='Processes to train the folds of a cost on in parallel')
+    searchcost.add_argument('--rmsdavgs', required=True)
+    searchcost.add_argument('--lowest', required=True)
+    searchcost.set_defaults(func=cmd_searchcost)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,10 @@ DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
 projbin=$DIR/../../bin
 export PATH=$projbin:$PATH
 
+# Run the jars of the tasks in this job on one JVM worker (see bin/jvmserver)
+jvmserver start
+trap 'jvmserver stop' EXIT
+
 # 'findcost_acd_logd_'$(date +%Y%m%d_%H%M%S) \
 python wffindcost.py \
     CrossValidate \
@@ -23,5 +27,6 @@ python wffindcost.py \
     --train-sizes="100,1000,5000,10000,20000,80000,160000,320000,rest" \
     --test-size=50000 \
     --randomdatasize-mb=100 \
+    --randomdata-shuffle \
     --workers=18 \
     --runmode=local
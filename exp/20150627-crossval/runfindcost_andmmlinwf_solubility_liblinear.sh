@@ -13,6 +13,10 @@ DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
 projbin=$DIR/../../bin
 export PATH=$projbin:$PATH
 
+# Run the jars of the tasks in this job on one JVM worker (see bin/jvmserver)
+jvmserver start
+trap 'jvmserver stop' EXIT
+
 # "findcost_solubility_$(date +%Y%m%d_%H%M%S)" \
 python wffindcost.py \
     CrossValidate \
@@ -25,6 +29,7 @@ python wffindcost.py \
     --train-sizes='100,1000,5000,10000,20000,rest' \
     --test-size=5000 \
     --randomdatasize-mb=100 \
+    --randomdata-shuffle \
     --workers=64 \
     --slurm-project=b2013262 \
     --runmode=hpc
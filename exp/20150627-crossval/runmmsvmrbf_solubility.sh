@@ -11,6 +11,10 @@ DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
 projbin=$DIR/../../bin
 export PATH=$projbin:$PATH
 
+# Run the jars of the tasks in this job on one JVM worker (see bin/jvmserver)
+jvmserver start
+trap 'jvmserver stop' EXIT
+
 module load openmpi/default
 
 python wfmm.py MMWorkflow \
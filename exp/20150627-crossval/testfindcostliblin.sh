@@ -11,6 +11,10 @@ DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
 projbin=$DIR/../../bin
 export PATH=$projbin:$PATH
 
+# Run the jars of the tasks in this job on one JVM worker (see bin/jvmserver)
+jvmserver start
+trap 'jvmserver stop' EXIT
+
 #--run-id=$(date +%Y%m%d_%H%M%S)\
 python wffindcost.py\
     CrossValidate\
@@ -23,5 +27,6 @@ python wffindcost.py\
     --train-sizes=100,1000,rest \
     --test-size=10 \
     --randomdatasize-mb=10 \
+    --randomdata-shuffle \
     --workers=16 \
     --runmode=local
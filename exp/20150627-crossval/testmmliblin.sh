@@ -4,6 +4,17 @@
 #SBATCH -n 2
 #SBATCH -t 4-00:00:00
 #SBATCH -J MMLinWorkflow
+
+# Get directory path of current directory
+DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
+
+projbin=$DIR/../../bin
+export PATH=$projbin:$PATH
+
+# Run the jars of the tasks in this job on one JVM worker (see bin/jvmserver)
+jvmserver start
+trap 'jvmserver stop' EXIT
+
 python wfmm.py MMWorkflow \
     --dataset-name=mm_test \
     --run-id=test_mmliblin_$(date +%Y%m%d_%H%M%S) \
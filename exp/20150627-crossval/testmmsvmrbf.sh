@@ -5,6 +5,16 @@
 #SBATCH -t 4-00:00:00
 #SBATCH -J MM_SVMRBF_WF
 
+# Get directory path of current directory
+DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
+
+projbin=$DIR/../../bin
+export PATH=$projbin:$PATH
+
+# Run the jars of the tasks in this job on one JVM worker (see bin/jvmserver)
+jvmserver start
+trap 'jvmserver stop' EXIT
+
 module load openmpi/default
 
 python wfmm.py MMWorkflow \
@@ -1,6 +1,9 @@
 from mmcomp import *
+from mmcompext import *
+from wfmm import MMWorkflow
 import logging
 import luigi
+import mmaudit
 import sciluigi as sl
 import time
 
@@ -10,7 +13,7 @@ import time
 
 log = logging.getLogger('sciluigi-interface')
 
-class CrossValidate(sl.WorkflowTask):
+class CrossValidate(LimitedConcurrency, sl.WorkflowTask):
     '''
     For now, a sketch on how to implement Cross-Validation as a sub-workflow components
     '''
@@ -26,7 +29,20 @@ class CrossValidate(sl.WorkflowTask):
     test_size = luigi.Parameter()
     train_sizes = luigi.Parameter()
     lin_type = luigi.Parameter(default='12') # 12, See: https://www.csie.ntu.edu.tw/~cjlin/liblinear/FAQ.html
-    randomdatasize_mb = luigi.IntParameter()
+    randomdatasize_mb = luigi.IntParameter(default=100)
+    lin_path = luigi.BooleanParameter() # Train all costs of a fold in one task, as a regularization path (warm-started for the primal solvers)
+    cost_search = luigi.Parameter(default='grid') # grid or adaptive
+    cost_patience = luigi.IntParameter(default=3) # Stop the adaptive search after this many rises in RMSD
+    cost_refine_steps = luigi.IntParameter(default=6)
+    inmemory_folds = luigi.BooleanParameter() # Read folds straight from the shuffled data, instead of via CreateFolds
+    binary_folds = luigi.BooleanParameter() # Convert the shuffled data to the binary sparse format, for the in-memory folds
+    shared_sigdict = luigi.BooleanParameter() # Create the sparse datasets from one signature dictionary per dataset
+    gensign_shards = luigi.IntParameter(default=1) # Generate the signatures in this many Slurm jobs, one per chunk of the SMILES
+    coalesce_micro_tasks = luigi.BooleanParameter() # Run the tasks taking seconds in the allocation of the workflow itself, instead of as Slurm jobs of their own
+    estimate_resources = luigi.BooleanParameter() # Set walltime and cores of the training, prediction, cost search and sparse dataset tasks from their input size and earlier runs, with the values below as fallback
+    nested_sampling = luigi.BooleanParameter() # Sample all train sizes of a replicate in one task, as nested subsets of one permutation
+    randomdata_shuffle = luigi.BooleanParameter() # Shuffle the folds data with CreateRandomData and ShuffleLines on an ungzipped copy, instead of in-process from a seed, reading the gzipped data
+    shuffle_seed = luigi.Parameter(default='0') # Combined with the train size and replicate id, for the seeded shuffle
     slurm_project = luigi.Parameter(default='b2013262')
     runmode = luigi.Parameter()
 
@@ -39,6 +55,26 @@ class CrossValidate(sl.WorkflowTask):
             runmode = sl.RUNMODE_MPI
         else:
             raise Exception('Runmode is none of local, hpc, nor mpi. Please fix and try again!')
+        if self.coalesce_micro_tasks:
+            micro_runmode = sl.RUNMODE_LOCAL
+        else:
+            micro_runmode = runmode
+        if self.estimate_resources:
+            train_lin_cls = TrainLinearModelEstimated
+            train_lin_path_cls = TrainLinearModelPathEstimated
+            predict_lin_cls = PredictLinearModelsEstimated
+            search_cost_cls = SearchLinearCostEstimated
+        else:
+            train_lin_cls = TrainLinearModel
+            train_lin_path_cls = TrainLinearModelPath
+            predict_lin_cls = PredictLinearModels
+            search_cost_cls = SearchLinearCost
+        if self.cost_search not in ['grid', 'adaptive']:
+            raise Exception('Cost search is none of grid, nor adaptive. Please fix and try again!')
+        if self.inmemory_folds and not (self.lin_path or self.cost_search == 'adaptive'):
+            raise Exception('In-memory folds need either lin-path or the adaptive cost search. Please fix and try again!')
+        if self.binary_folds and not self.inmemory_folds:
+            raise Exception('Binary folds need in-memory folds. Please fix and try again!')
 
         # ----------------------------------------------------------------
         mmtestdata = self.new_task('mmtestdata', ExistingSmiles,
@@ -53,196 +89,360 @@ class CrossValidate(sl.WorkflowTask):
             replicate_ids = [i for i in self.replicate_ids.split(',')]
         for replicate_id in replicate_ids:
             tasks[replicate_id] = {}
-            gensign = self.new_task('gensign_%s' % replicate_id, GenerateSignaturesFilterSubstances,
-                    replicate_id=replicate_id,
-                    min_height = self.min_height,
-                    max_height = self.max_height,
-                    slurminfo = sl.SlurmInfo(
-                        runmode=runmode,
-                        project=self.slurm_project,
-                        partition='core',
-                        cores='8',
-                        time='1:00:00',
-                        jobname='mmgensign',
-                        threads='8'
-                    ))
-            gensign.in_smiles = mmtestdata.out_smiles
-            # ----------------------------------------------------------------
-            create_unique_run_copy = self.new_task('create_unique_run_copy_%s' % self.run_id,
-                    CreateRunCopy,
-                    run_id = self.run_id)
-            create_unique_run_copy.in_file = gensign.out_signatures
-            # ----------------------------------------------------------------
-            replcopy = self.new_task('replcopy_%s' % replicate_id, CreateReplicateCopy,
-                    replicate_id=replicate_id)
-            replcopy.in_file = create_unique_run_copy.out_copy
-            # ----------------------------------------------------------------
-            for train_size in [i for i in self.train_sizes.split(',')]:
-                samplett = self.new_task('sampletraintest_%s_%s' % (train_size, replicate_id), SampleTrainAndTest,
+            if self.gensign_shards > 1:
+                splitsmiles = self.new_task('splitsmiles', SplitSmiles,
+                        shards_count=self.gensign_shards,
+                        slurminfo = sl.SlurmInfo(
+                            runmode=micro_runmode,
+                            project=self.slurm_project,
+                            partition='core',
+                            cores='1',
+                            time='1:00:00',
+                            jobname='mmsplitsmiles',
+                            threads='1'
+                        ))
+                splitsmiles.in_smiles = mmtestdata.out_smiles
+                chunk_signatures = []
+                for i in xrange(self.gensign_shards):
+                    gensign_chunk = self.new_task('gensign_%s_shard%02d' % (replicate_id, i + 1), GenerateSignaturesFilterSubstancesCached,
+                            replicate_id=replicate_id,
+                            min_height = self.min_height,
+                            max_height = self.max_height,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='8',
+                                time='1:00:00',
+                                jobname='mmgensign',
+                                threads='8'
+                            ))
+                    gensign_chunk.in_smiles = dict_port(splitsmiles.out_chunks, i)
+                    chunk_signatures.append(gensign_chunk.out_signatures)
+                gensign = self.new_task('gensign_%s' % replicate_id, MergeSignatures,
                         replicate_id=replicate_id,
-                        sampling_method='random',
-                        test_size=self.test_size,
-                        train_size=train_size,
+                        min_height = self.min_height,
+                        max_height = self.max_height,
                         slurminfo = sl.SlurmInfo(
-                            runmode=runmode,
-                            project='b2013262',
+                            runmode=micro_runmode,
+                            project=self.slurm_project,
                             partition='core',
-                            cores='2',
+                            cores='1',
                             time='1:00:00',
-                            jobname='mmsampletraintest_%s_%s' % (train_size, replicate_id),
+                            jobname='mmmergesign',
                             threads='1'
                         ))
-                samplett.in_signatures = replcopy.out_copy
-                # ----------------------------------------------------------------
-                sprstrain = self.new_task('sparsetrain_%s_%s' % (train_size, replicate_id), CreateSparseTrainDataset,
+                gensign.in_chunk_signatures = chunk_signatures
+            else:
+                gensign = self.new_task('gensign_%s' % replicate_id, GenerateSignaturesFilterSubstancesCached,
                         replicate_id=replicate_id,
+                        min_height = self.min_height,
+                        max_height = self.max_height,
                         slurminfo = sl.SlurmInfo(
                             runmode=runmode,
                             project=self.slurm_project,
                             partition='core',
                             cores='8',
-                            time='1-00:00:00', # Took ~16hrs for acd_logd, size: rest(train) - 50000(test)
-                            jobname='mmsparsetrain_%s_%s' % (train_size, replicate_id),
+                            time='1:00:00',
+                            jobname='mmgensign',
                             threads='8'
                         ))
-                sprstrain.in_traindata = samplett.out_traindata
-                # ----------------------------------------------------------------
-                gunzip = self.new_task('gunzip_sparsetrain_%s_%s' % (train_size, replicate_id), UnGzipFile,
+            gensign.in_smiles = mmtestdata.out_smiles
+            # ----------------------------------------------------------------
+            if self.shared_sigdict:
+                sigdict = self.new_task('sigdict_%s' % replicate_id, BuildSignatureDictionary,
                         slurminfo = sl.SlurmInfo(
                             runmode=runmode,
                             project=self.slurm_project,
                             partition='core',
                             cores='1',
                             time='1:00:00',
-                            jobname='gunzip_sparsetrain_%s_%s' % (train_size, replicate_id),
+                            jobname='mmsigdict',
                             threads='1'
                         ))
-                gunzip.in_gzipped = sprstrain.out_sparse_traindata
-                # ----------------------------------------------------------------
-                cntlines = self.new_task('countlines_%s_%s' % (train_size, replicate_id), CountLines,
+                sigdict.in_signatures = gensign.out_signatures
+                if self.estimate_resources:
+                    create_sparse_train_cls = CreateSparseTrainDatasetSharedEstimated
+                else:
+                    create_sparse_train_cls = CreateSparseTrainDatasetShared
+            elif self.estimate_resources:
+                create_sparse_train_cls = CreateSparseTrainDatasetEstimated
+            else:
+                create_sparse_train_cls = CreateSparseTrainDataset
+            # ----------------------------------------------------------------
+            create_unique_run_copy = self.new_task('create_unique_run_copy_%s' % self.run_id,
+                    LinkRunCopy,
+                    run_id = self.run_id)
+            create_unique_run_copy.in_file = gensign.out_signatures
+            # ----------------------------------------------------------------
+            replcopy = self.new_task('replcopy_%s' % replicate_id, LinkReplicateCopy,
+                    replicate_id=replicate_id)
+            replcopy.in_file = create_unique_run_copy.out_copy
+            # ----------------------------------------------------------------
+            if self.nested_sampling:
+                samplenested = self.new_task('samplenested_%s' % replicate_id, SampleTrainAndTestNested,
+                        replicate_id=replicate_id,
+                        dataset_name=self.dataset_name,
+                        test_size=self.test_size,
+                        train_sizes=self.train_sizes,
                         slurminfo = sl.SlurmInfo(
                             runmode=runmode,
                             project=self.slurm_project,
                             partition='core',
-                            cores='1',
-                            time='15:00',
-                            jobname='gunzip_sparsetrain_%s_%s' % (train_size, replicate_id),
+                            cores='2',
+                            time='1:00:00',
+                            jobname='mmsamplenested_%s' % replicate_id,
                             threads='1'
                         ))
-                cntlines.in_file = gunzip.out_ungzipped
+                samplenested.in_signatures = replcopy.out_copy
+            # ----------------------------------------------------------------
+            for train_size in [i for i in self.train_sizes.split(',')]:
+                if self.nested_sampling:
+                    traindata = dict_port(samplenested.out_traindata, train_size)
+                else:
+                    samplett = self.new_task('sampletraintest_%s_%s' % (train_size, replicate_id), SampleTrainAndTest,
+                            replicate_id=replicate_id,
+                            sampling_method='random',
+                            test_size=self.test_size,
+                            train_size=train_size,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=runmode,
+                                project='b2013262',
+                                partition='core',
+                                cores='2',
+                                time='1:00:00',
+                                jobname='mmsampletraintest_%s_%s' % (train_size, replicate_id),
+                                threads='1'
+                            ))
+                    samplett.in_signatures = replcopy.out_copy
+                    traindata = samplett.out_traindata
                 # ----------------------------------------------------------------
-                genrandomdata= self.new_task('genrandomdata_%s_%s' % (train_size, replicate_id), CreateRandomData,
-                        size_mb=self.randomdatasize_mb,
+                sprstrain = self.new_task('sparsetrain_%s_%s' % (train_size, replicate_id), create_sparse_train_cls,
                         replicate_id=replicate_id,
                         slurminfo = sl.SlurmInfo(
                             runmode=runmode,
                             project=self.slurm_project,
                             partition='core',
-                            cores='1',
-                            time='1:00:00',
-                            jobname='genrandomdata_%s_%s' % (train_size, replicate_id),
-                            threads='1'
+                            cores='8',
+                            time='1-00:00:00', # Took ~16hrs for acd_logd, size: rest(train) - 50000(test)
+                            jobname='mmsparsetrain_%s_%s' % (train_size, replicate_id),
+                            threads='8'
                         ))
-                genrandomdata.in_basepath = gunzip.out_ungzipped
+                sprstrain.in_traindata = traindata
+                if self.shared_sigdict:
+                    sprstrain.in_dictionary = sigdict.out_dictionary
                 # ----------------------------------------------------------------
-                shufflelines = self.new_task('shufflelines_%s_%s' % (train_size, replicate_id), ShuffleLines,
+                if self.randomdata_shuffle:
+                    gunzip = self.new_task('gunzip_sparsetrain_%s_%s' % (train_size, replicate_id), UnGzipFileIndexed,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=micro_runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='1',
+                                time='1:00:00',
+                                jobname='gunzip_sparsetrain_%s_%s' % (train_size, replicate_id),
+                                threads='1'
+                            ))
+                    gunzip.in_gzipped = sprstrain.out_sparse_traindata
+                    # ----------------------------------------------------------------
+                    genrandomdata= self.new_task('genrandomdata_%s_%s' % (train_size, replicate_id), CreateRandomData,
+                            size_mb=self.randomdatasize_mb,
+                            replicate_id=replicate_id,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=micro_runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='1',
+                                time='1:00:00',
+                                jobname='genrandomdata_%s_%s' % (train_size, replicate_id),
+                                threads='1'
+                            ))
+                    genrandomdata.in_basepath = gunzip.out_ungzipped
+                    # ----------------------------------------------------------------
+                    shufflelines = self.new_task('shufflelines_%s_%s' % (train_size, replicate_id), ShuffleLinesIndexed,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=micro_runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='1',
+                                time='15:00',
+                                jobname='shufflelines_%s_%s' % (train_size, replicate_id),
+                                threads='1'
+                            ))
+                    shufflelines.in_randomdata = genrandomdata.out_random
+                    shufflelines.in_file = gunzip.out_ungzipped
+                else:
+                    shufflelines = self.new_task('shufflelines_%s_%s' % (train_size, replicate_id), ShuffleLinesSeededGzipped,
+                            seed='%s_%s_%s' % (self.shuffle_seed, train_size, replicate_id),
+                            slurminfo = sl.SlurmInfo(
+                                runmode=micro_runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='1',
+                                time='1:00:00',
+                                jobname='shufflelines_%s_%s' % (train_size, replicate_id),
+                                threads='1'
+                            ))
+                    shufflelines.in_file = sprstrain.out_sparse_traindata
+                # ----------------------------------------------------------------
+                # The shuffled data has the same lines, and a line index to count them in
+                cntlines = self.new_task('countlines_%s_%s' % (train_size, replicate_id), CountLinesIndexed,
                         slurminfo = sl.SlurmInfo(
-                            runmode=runmode,
+                            runmode=micro_runmode,
                             project=self.slurm_project,
                             partition='core',
                             cores='1',
                             time='15:00',
-                            jobname='shufflelines_%s_%s' % (train_size, replicate_id),
+                            jobname='countlines_%s_%s' % (train_size, replicate_id),
                             threads='1'
                         ))
-                shufflelines.in_randomdata = genrandomdata.out_random
-                shufflelines.in_file = gunzip.out_ungzipped
+                cntlines.in_file = shufflelines.out_shuffled
+                foldsdata = shufflelines.out_shuffled
                 # ----------------------------------------------------------------
-
-                costseq = ['0.0001', '0.0005', '0.001', '0.005', '0.01', '0.05', '0.1', '0.25', '0.5', '0.75', '1', '2', '3', '4', '5' ] + [str(int(10**p)) for p in xrange(1,12)]
-                # Branch the workflow into one branch per fold
-                for fold_idx in xrange(self.folds_count):
-                    tasks[replicate_id][fold_idx] = {}
-                    # Init tasks
-                    create_folds = self.new_task('create_fold%02d_%s_%s' % (fold_idx, train_size, replicate_id), CreateFolds,
-                            fold_index = fold_idx,
-                            folds_count = self.folds_count,
-                            seed = 0.637,
+                if self.binary_folds:
+                    tobinary = self.new_task('tobinary_%s_%s' % (train_size, replicate_id), ConvertSparseToBinary,
                             slurminfo = sl.SlurmInfo(
-                                runmode=runmode,
+                                runmode=micro_runmode,
                                 project=self.slurm_project,
                                 partition='core',
                                 cores='1',
                                 time='1:00:00',
-                                jobname='create_fold%02d_%s_%s' % (fold_idx, train_size, replicate_id),
+                                jobname='tobinary_%s_%s' % (train_size, replicate_id),
                                 threads='1'
                             ))
-                    for cost in costseq:
-                        tasks[replicate_id][fold_idx][cost] = {}
-                        create_folds.in_dataset = shufflelines.out_shuffled
-                        create_folds.in_linecount = cntlines.out_linecount
-                        # -------------------------------------------------
-                        train_lin = self.new_task('trainlin_fold_%d_cost_%s_%s_%s' % (fold_idx, cost, train_size, replicate_id), TrainLinearModel,
-                                replicate_id = replicate_id,
-                                lin_type = self.lin_type,
-                                lin_cost = cost,
+                    tobinary.in_sparse = shufflelines.out_shuffled
+                    foldsdata = tobinary.out_binary
+                # ----------------------------------------------------------------
+
+                costseq = ['0.0001', '0.0005', '0.001', '0.005', '0.01', '0.05', '0.1', '0.25', '0.5', '0.75', '1', '2', '3', '4', '5' ] + [str(int(10**p)) for p in xrange(1,12)]
+                coarse_costseq = ['0.0001', '0.001', '0.01', '0.1', '1'] + [str(int(10**p)) for p in xrange(1,12)]
+                # Branch the workflow into one branch per fold
+                create_folds_tasks = []
+                for fold_idx in xrange(self.folds_count):
+                    tasks[replicate_id][fold_idx] = {}
+                    create_folds = None
+                    if not self.inmemory_folds:
+                        # Init tasks
+                        create_folds = self.new_task('create_fold%02d_%s_%s' % (fold_idx, train_size, replicate_id), CreateFoldsIndexed,
+                                fold_index = fold_idx,
+                                folds_count = self.folds_count,
+                                seed = 0.637,
                                 slurminfo = sl.SlurmInfo(
-                                    runmode=runmode,
+                                    runmode=micro_runmode,
                                     project=self.slurm_project,
                                     partition='core',
                                     cores='1',
-                                    time='4-00:00:00',
-                                    jobname='trnlin_f%02d_c%s_%s_%s' % (fold_idx, cost, train_size, replicate_id),
+                                    time='1:00:00',
+                                    jobname='create_fold%02d_%s_%s' % (fold_idx, train_size, replicate_id),
                                     threads='1'
                                 ))
-                        train_lin.in_traindata = create_folds.out_traindata
-                        # -------------------------------------------------
-                        pred_lin = self.new_task('predlin_fold_%d_cost_%s_%s_%s' % (fold_idx, cost, train_size, replicate_id), PredictLinearModel,
+                        create_folds.in_dataset = shufflelines.out_shuffled
+                        create_folds.in_linecount = cntlines.out_linecount
+                        create_folds_tasks.append(create_folds)
+                    if self.cost_search == 'adaptive':
+                        # The adaptive search trains on all folds itself, below
+                        continue
+                    if self.lin_path:
+                        train_path = self.new_task('trainlinpath_fold_%d_%s_%s' % (fold_idx, train_size, replicate_id), train_lin_path_cls,
                                 replicate_id = replicate_id,
+                                lin_type = self.lin_type,
+                                lin_costs = ','.join(costseq),
+                                fold_index = fold_idx,
+                                folds_count = self.folds_count,
                                 slurminfo = sl.SlurmInfo(
                                     runmode=runmode,
                                     project=self.slurm_project,
                                     partition='core',
                                     cores='1',
-                                    time='8:00:00',
-                                    jobname='predlin_f%02d_c%s_%s_%s' % (fold_idx, cost, train_size, replicate_id),
+                                    time='4-00:00:00',
+                                    jobname='trnlinpath_f%02d_%s_%s' % (fold_idx, train_size, replicate_id),
                                     threads='1'
                                 ))
-                        pred_lin.in_model = train_lin.out_model
-                        pred_lin.in_sparse_testdata = create_folds.out_testdata
+                        if self.inmemory_folds:
+                            train_path.in_dataset = foldsdata
+                        else:
+                            train_path.in_traindata = create_folds.out_traindata
+                            train_path.in_testdata = create_folds.out_testdata
+                        for cost in costseq:
+                            tasks[replicate_id][fold_idx][cost] = {}
+                            tasks[replicate_id][fold_idx][cost]['create_folds'] = create_folds
+                            tasks[replicate_id][fold_idx][cost]['train_linear_path'] = train_path
+                            tasks[replicate_id][fold_idx][cost]['prediction'] = dict_port(train_path.out_predictions, cost)
+                        continue
+                    train_lins = {}
+                    for cost in costseq:
                         # -------------------------------------------------
-                        assess_lin = self.new_task('assesslin_fold_%d_cost_%s_%s_%s' % (fold_idx, cost, train_size, replicate_id), AssessLinearRMSD,
+                        train_lin = self.new_task('trainlin_fold_%d_cost_%s_%s_%s' % (fold_idx, cost, train_size, replicate_id), train_lin_cls,
+                                replicate_id = replicate_id,
+                                lin_type = self.lin_type,
                                 lin_cost = cost,
                                 slurminfo = sl.SlurmInfo(
                                     runmode=runmode,
                                     project=self.slurm_project,
                                     partition='core',
                                     cores='1',
-                                    time='15:00',
-                                    jobname='assesslin_f%02d_c%s_%s_%s' % (fold_idx, cost, train_size, replicate_id),
+                                    time='4-00:00:00',
+                                    jobname='trnlin_f%02d_c%s_%s_%s' % (fold_idx, cost, train_size, replicate_id),
                                     threads='1'
                                 ))
-                        assess_lin.in_model = train_lin.out_model
-                        assess_lin.in_sparse_testdata = create_folds.out_testdata
-                        assess_lin.in_prediction = pred_lin.out_prediction
-                        # -------------------------------------------------
+                        train_lin.in_traindata = create_folds.out_traindata
+                        train_lins[cost] = train_lin
+                    # -------------------------------------------------
+                    # Predict with the models of all costs in one pass over the test data
+                    pred_lin = self.new_task('predlin_fold_%d_%s_%s' % (fold_idx, train_size, replicate_id), predict_lin_cls,
+                            replicate_id = replicate_id,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='1',
+                                time='8:00:00',
+                                jobname='predlin_f%02d_%s_%s' % (fold_idx, train_size, replicate_id),
+                                threads='1'
+                            ))
+                    pred_lin.in_models = {cost: train_lins[cost].out_model for cost in costseq}
+                    pred_lin.in_sparse_testdata = create_folds.out_testdata
+                    for cost in costseq:
                         tasks[replicate_id][fold_idx][cost] = {}
                         tasks[replicate_id][fold_idx][cost]['create_folds'] = create_folds
-                        tasks[replicate_id][fold_idx][cost]['train_linear'] = train_lin
+                        tasks[replicate_id][fold_idx][cost]['train_linear'] = train_lins[cost]
                         tasks[replicate_id][fold_idx][cost]['predict_linear'] = pred_lin
-                        tasks[replicate_id][fold_idx][cost]['assess_linear'] = assess_lin
+                        tasks[replicate_id][fold_idx][cost]['prediction'] = dict_port(pred_lin.out_predictions, cost)
 
-                # Tasks for calculating average RMSD and finding the cost with lowest RMSD
-                avgrmsd_tasks = {}
-                for cost in costseq:
-                    # Calculate the average RMSD for each cost value
-                    average_rmsd = self.new_task('average_rmsd_cost_%s_%s_%s' % (cost, train_size, replicate_id), CalcAverageRMSDForCost,
-                            lin_cost=cost)
-                    average_rmsd.in_assessments = [tasks[replicate_id][fold_idx][cost]['assess_linear'].out_assessment for fold_idx in xrange(self.folds_count)]
-                    avgrmsd_tasks[cost] = average_rmsd
-
-                sel_lowest_rmsd = self.new_task('select_lowest_rmsd_%s_%s' % (train_size, replicate_id), SelectLowestRMSD)
-                sel_lowest_rmsd.in_values = [average_rmsd.out_rmsdavg for average_rmsd in avgrmsd_tasks.values()]
+                if self.cost_search == 'adaptive':
+                    # Search for the cost with lowest average RMSD, stopping early
+                    sel_lowest_rmsd = self.new_task('search_cost_%s_%s' % (train_size, replicate_id), search_cost_cls,
+                            replicate_id = replicate_id,
+                            lin_type = self.lin_type,
+                            lin_costs = ','.join(coarse_costseq),
+                            patience = self.cost_patience,
+                            refine_steps = self.cost_refine_steps,
+                            folds_count = self.folds_count,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores=str(self.folds_count), # One per fold
+                                time='4-00:00:00',
+                                jobname='searchcost_%s_%s' % (train_size, replicate_id),
+                                threads=str(self.folds_count)
+                            ))
+                    if self.inmemory_folds:
+                        sel_lowest_rmsd.in_dataset = foldsdata
+                    else:
+                        sel_lowest_rmsd.in_traindata = [cf.out_traindata for cf in create_folds_tasks]
+                        sel_lowest_rmsd.in_testdata = [cf.out_testdata for cf in create_folds_tasks]
+                else:
+                    # Assess all costs on all folds, and find the cost with lowest average RMSD, in one in-process task
+                    sel_lowest_rmsd = self.new_task('assess_cv_%s_%s' % (train_size, replicate_id), AssessCrossValidation,
+                            lin_type = self.lin_type,
+                            folds_count = self.folds_count)
+                    sel_lowest_rmsd.in_predictions = {cost: [tasks[replicate_id][fold_idx][cost]['prediction'] for fold_idx in xrange(self.folds_count)]
+                                                      for cost in costseq}
+                    if self.inmemory_folds:
+                        sel_lowest_rmsd.in_dataset = foldsdata
+                    else:
+                        sel_lowest_rmsd.in_testdata = [cf.out_testdata for cf in create_folds_tasks]
 
                 run_id = 'mainwfrun_liblinear_%s_tst%s_trn%s_%s' % (self.dataset_name, self.test_size, train_size, replicate_id)
                 mainwfrun = self.new_task('mainwfrun_%s_%s' % (train_size, replicate_id), MainWorkflowRunner,
@@ -256,6 +456,11 @@ class CrossValidate(sl.WorkflowTask):
                         lin_type=self.lin_type,
                         slurm_project=self.slurm_project,
                         parallel_lin_train=False,
+                        shared_sigdict=self.shared_sigdict,
+                        gensign_shards=self.gensign_shards,
+                        coalesce_micro_tasks=self.coalesce_micro_tasks,
+                        estimate_resources=self.estimate_resources,
+                        nested_sampling=self.nested_sampling,
                         runmode=self.runmode)
                 mainwfrun.in_lowestrmsd = sel_lowest_rmsd.out_lowest
 
@@ -269,7 +474,16 @@ class CrossValidate(sl.WorkflowTask):
 # ================================================================================
 
 class MainWorkflowRunner(sl.Task):
-    # Parameters
+    '''
+    Run the main workflow (MMWorkflow) with the lowest cost found by the
+    cross-validation. The main workflow is yielded as a dynamic dependency
+    once the cost is known, so that its tasks are scheduled in the same
+    dependency graph, and on the same workers, as the cross-validation,
+    instead of in a wfmm.py process of its own.
+    '''
+    # Parameters, those of MMWorkflow except lin_cost (and the lists of
+    # replicates and train sizes). None of them defaults to None, which would
+    # reach MMWorkflow as the string 'None'.
     dataset_name = luigi.Parameter()
     run_id = luigi.Parameter()
     replicate_id =luigi.Parameter()
@@ -278,8 +492,23 @@ class MainWorkflowRunner(sl.Task):
     train_size = luigi.Parameter()
     test_size = luigi.Parameter()
     lin_type = luigi.Parameter()
+    svm_gamma = luigi.Parameter(default='0.001')
+    svm_cost = luigi.Parameter(default='100')
+    svm_type = luigi.Parameter(default='3')
+    svm_kernel_type = luigi.Parameter(default='2')
+    approx_landmarks = luigi.IntParameter(default=1000)
+    kernel_cache = luigi.Parameter(default='')
+    kernel_cache_mb = luigi.IntParameter(default=1024)
     slurm_project = luigi.Parameter()
     parallel_lin_train = luigi.BooleanParameter()
+    parallel_svm_train = luigi.BooleanParameter()
+    svm_cascade_shards = luigi.IntParameter(default=1)
+    shared_sigdict = luigi.BooleanParameter()
+    gensign_shards = luigi.IntParameter(default=1)
+    coalesce_micro_tasks = luigi.BooleanParameter()
+    estimate_resources = luigi.BooleanParameter()
+    nested_sampling = luigi.BooleanParameter()
+    batched_svm_predict = luigi.BooleanParameter()
     runmode = luigi.Parameter()
     # In-ports
     in_lowestrmsd = None
@@ -291,22 +520,43 @@ class MainWorkflowRunner(sl.Task):
         with self.in_lowestrmsd().open() as infile:
             records = sl.recordfile_to_dict(infile)
             lowest_cost = records['lowest_cost']
-        self.ex('python wfmm.py MMWorkflow' +
-                ' --dataset-name=%s' % self.dataset_name +
-                ' --run-id=%s' % self.run_id +
-                ' --replicate-id=%s' % self.replicate_id +
-                ' --sampling-method=%s' % self.sampling_method +
-                ' --train-method=%s' % self.train_method +
-                ' --train-size=%s' % self.train_size +
-                ' --test-size=%s' % self.test_size +
-                ' --lin-type=%s' % self.lin_type +
-                ' --lin-cost=%s' % lowest_cost +
-                ' --slurm-project=%s' % self.slurm_project +
-                ' --runmode=%s' % self.runmode)
+        # Luigi suspends this task, without keeping a worker busy, until the
+        # main workflow is done, and then runs it again from the start
+        yield MMWorkflow(
+                dataset_name=self.dataset_name,
+                run_id=self.run_id,
+                replicate_id=self.replicate_id,
+                replicate_ids='',
+                sampling_method=self.sampling_method,
+                train_method=self.train_method,
+                train_size=self.train_size,
+                train_sizes='',
+                test_size=self.test_size,
+                lin_type=self.lin_type,
+                lin_cost=lowest_cost,
+                svm_gamma=self.svm_gamma,
+                svm_cost=self.svm_cost,
+                svm_type=self.svm_type,
+                svm_kernel_type=self.svm_kernel_type,
+                approx_landmarks=self.approx_landmarks,
+                kernel_cache=self.kernel_cache,
+                kernel_cache_mb=self.kernel_cache_mb,
+                slurm_project=self.slurm_project,
+                parallel_lin_train=self.parallel_lin_train,
+                parallel_svm_train=self.parallel_svm_train,
+                svm_cascade_shards=self.svm_cascade_shards,
+                shared_sigdict=self.shared_sigdict,
+                gensign_shards=self.gensign_shards,
+                coalesce_micro_tasks=self.coalesce_micro_tasks,
+                estimate_resources=self.estimate_resources,
+                nested_sampling=self.nested_sampling,
+                batched_svm_predict=self.batched_svm_predict,
+                runmode=self.runmode)
         with self.out_done().open('w') as donefile:
             donefile.write('Done!\n')
 
 # ================================================================================
 
 if __name__ == '__main__':
+    mmaudit.enable_audit_store()
     sl.run_local()
@@ -1,5 +1,7 @@
 from mmcomp import *
+from mmcompext import *
 import luigi
+import mmaudit
 import sciluigi as sl
 import time
 
@@ -7,8 +9,9 @@ import time
 
 TRAINMETHOD_LIBLINEAR = 'liblinear'
 TRAINMETHOD_SVMRBF = 'svmrbf'
+TRAINMETHOD_APPROXRBF = 'approxrbf'
 
-class MMWorkflow(sl.WorkflowTask):
+class MMWorkflow(LimitedConcurrency, sl.WorkflowTask):
     '''
     This class runs the MM Workflow using LibLinear
     as the method for doing machine learning
@@ -20,7 +23,7 @@ class MMWorkflow(sl.WorkflowTask):
     replicate_id = luigi.Parameter(default=None)
     replicate_ids = luigi.Parameter(default=None)
     sampling_method = luigi.Parameter()
-    train_method = luigi.Parameter() # TRAINMETHOD_LIBLINEAR or TRAINMETHOD_SVMRBF
+    train_method = luigi.Parameter() # TRAINMETHOD_LIBLINEAR, TRAINMETHOD_SVMRBF or TRAINMETHOD_APPROXRBF
     train_size = luigi.Parameter(default=None)
     train_sizes = luigi.Parameter(default=None)
     test_size = luigi.Parameter()
@@ -32,10 +35,20 @@ class MMWorkflow(sl.WorkflowTask):
     svm_cost = luigi.Parameter(default='100')
     svm_type = luigi.Parameter(default='3')
     svm_kernel_type = luigi.Parameter('2')
+    approx_landmarks = luigi.IntParameter(default=1000) # Train rows to approximate the RBF kernel with (approxrbf only), more is slower but closer to svmrbf
+    kernel_cache = luigi.Parameter(default=None) # Directory on node-local disk to keep the normal equations of approxrbf models in, shared by runs differing only in svm_cost
+    kernel_cache_mb = luigi.IntParameter(default=1024)
 
     slurm_project = luigi.Parameter()
     parallel_lin_train = luigi.BooleanParameter()
     parallel_svm_train = luigi.BooleanParameter()
+    svm_cascade_shards = luigi.IntParameter(default=1) # Train the SVM as a cascade over this many shards of the train set
+    shared_sigdict = luigi.BooleanParameter() # Create the sparse datasets from one signature dictionary per dataset
+    gensign_shards = luigi.IntParameter(default=1) # Generate the signatures in this many Slurm jobs, one per chunk of the SMILES
+    coalesce_micro_tasks = luigi.BooleanParameter() # Run the tasks taking seconds in the allocation of the workflow itself, instead of as Slurm jobs of their own
+    estimate_resources = luigi.BooleanParameter() # Set walltime and cores of the training, prediction and sparse dataset tasks from their input size and earlier runs, with the values below as fallback
+    nested_sampling = luigi.BooleanParameter() # Sample all train sizes of a replicate in one task, as nested subsets of one permutation (random sampling only)
+    batched_svm_predict = luigi.BooleanParameter() # Predict with the SVM models on 8 cores instead of 1 (see PredictSVMModelBatched)
     runmode = luigi.Parameter()
     #folds_count = luigi.Parameter()
 
@@ -48,27 +61,63 @@ class MMWorkflow(sl.WorkflowTask):
             runmode = sl.RUNMODE_MPI
         else:
             raise Exception('Runmode is none of local, hpc, nor mpi. Please fix and try again!')
+        if self.nested_sampling and self.sampling_method != 'random':
+            raise Exception('Nested sampling is only implemented for the random sampling method. Please fix and try again!')
+        if self.coalesce_micro_tasks:
+            micro_runmode = sl.RUNMODE_LOCAL
+        else:
+            micro_runmode = runmode
+        # The sparse datasets are read gzipped, except by the parallel
+        # svm-train, and the trainings of the cascade, on ungzipped shards
+        if self.estimate_resources:
+            train_lin_cls = TrainLinearModelGzippedEstimated
+            train_svm_cls = TrainSVMModelEstimated
+            train_svm_gzipped_cls = TrainSVMModelGzippedEstimated
+            train_approx_cls = TrainApproxRBFModelEstimated
+            predict_svm_cls = PredictSVMModelGzippedEstimated
+        else:
+            train_lin_cls = TrainLinearModelGzipped
+            train_svm_cls = TrainSVMModel
+            train_svm_gzipped_cls = TrainSVMModelGzipped
+            train_approx_cls = TrainApproxRBFModel
+            predict_svm_cls = PredictSVMModelGzipped
+        if self.batched_svm_predict:
+            predict_svm_cores = '8'
+        else:
+            predict_svm_cores = '1'
 
         datareport_rows = []
 
-        coloring_train_data_task = None
-        coloring_train_task = None
-
-        if self.replicate_id is not None:
+        if self.replicate_id:
             replicate_ids = [self.replicate_id]
-        elif self.replicate_ids is not None:
+        elif self.replicate_ids:
             replicate_ids = [i for i in self.replicate_ids.split(',')]
-        for replicate_id in replicate_ids:
-            if self.train_size is not None:
-                train_sizes = [self.train_size]
-            elif self.train_sizes is not None:
-                train_sizes = [i for i in self.train_sizes.split(',')]
-            for train_size in train_sizes:
-                # --------------------------------------------------------------------------------
-                existing_smiles = self.new_task('existing_smiles', ExistingSmiles,
-                        dataset_name = self.dataset_name)
-                # --------------------------------------------------------------------------------
-                gen_sign_filter_subst = self.new_task('gen_sign_filter_subst', GenerateSignaturesFilterSubstances,
+        if self.train_size:
+            train_sizes = [self.train_size]
+        elif self.train_sizes:
+            train_sizes = [i for i in self.train_sizes.split(',')]
+        # --------------------------------------------------------------------------------
+        # Shared by all replicates and train sizes
+        # --------------------------------------------------------------------------------
+        existing_smiles = self.new_task('existing_smiles', ExistingSmiles,
+                dataset_name = self.dataset_name)
+        # --------------------------------------------------------------------------------
+        if self.gensign_shards > 1:
+            split_smiles = self.new_task('split_smiles', SplitSmiles,
+                    shards_count = self.gensign_shards,
+                    slurminfo = sl.SlurmInfo(
+                        runmode=micro_runmode,
+                        project=self.slurm_project,
+                        partition='core',
+                        cores='1',
+                        time='1:00:00',
+                        jobname='MMSplitSmiles',
+                        threads='1'
+                    ))
+            split_smiles.in_smiles = existing_smiles.out_smiles
+            chunk_signatures = []
+            for i in xrange(self.gensign_shards):
+                gen_sign_chunk = self.new_task('gen_sign_filter_subst_shard%02d' % (i + 1), GenerateSignaturesFilterSubstancesCached,
                         min_height = 1,
                         max_height = 3,
                         dataset_name = self.dataset_name,
@@ -81,35 +130,117 @@ class MMWorkflow(sl.WorkflowTask):
                             jobname='MMGenSign',
                             threads='8'
                         ))
-                gen_sign_filter_subst.in_smiles = existing_smiles.out_smiles
-                # --------------------------------------------------------------------------------
-                create_unique_run_copy = self.new_task('create_unique_run_copy_%s' % self.run_id,
-                        CreateRunCopy,
-                        run_id = self.run_id)
-                create_unique_run_copy.in_file = gen_sign_filter_subst.out_signatures
-                # --------------------------------------------------------------------------------
-                create_unique_sign_copy = self.new_task('create_unique_sign_copy_%s' % replicate_id, CreateReplicateCopy,
-                        replicate_id = replicate_id)
-                create_unique_sign_copy.in_file = create_unique_run_copy.out_copy
-                # --------------------------------------------------------------------------------
-                sample_train_and_test = self.new_task('sample_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), SampleTrainAndTest,
-                        test_size = self.test_size,
-                        train_size = train_size,
-                        sampling_method = self.sampling_method,
-                        dataset_name = self.dataset_name,
+                gen_sign_chunk.in_smiles = dict_port(split_smiles.out_chunks, i)
+                chunk_signatures.append(gen_sign_chunk.out_signatures)
+            gen_sign_filter_subst = self.new_task('gen_sign_filter_subst', MergeSignatures,
+                    min_height = 1,
+                    max_height = 3,
+                    dataset_name = self.dataset_name,
+                    slurminfo = sl.SlurmInfo(
+                        runmode=micro_runmode,
+                        project=self.slurm_project,
+                        partition='core',
+                        cores='1',
+                        time='1:00:00',
+                        jobname='MMMergeSign',
+                        threads='1'
+                    ))
+            gen_sign_filter_subst.in_chunk_signatures = chunk_signatures
+        else:
+            gen_sign_filter_subst = self.new_task('gen_sign_filter_subst', GenerateSignaturesFilterSubstancesCached,
+                    min_height = 1,
+                    max_height = 3,
+                    dataset_name = self.dataset_name,
+                    slurminfo = sl.SlurmInfo(
+                        runmode=runmode,
+                        project=self.slurm_project,
+                        partition='core',
+                        cores='8',
+                        time='1:00:00',
+                        jobname='MMGenSign',
+                        threads='8'
+                    ))
+        gen_sign_filter_subst.in_smiles = existing_smiles.out_smiles
+        # --------------------------------------------------------------------------------
+        if self.shared_sigdict:
+            build_sigdict = self.new_task('build_sigdict', BuildSignatureDictionary,
+                    slurminfo = sl.SlurmInfo(
+                        runmode=runmode,
+                        project=self.slurm_project,
+                        partition='core',
+                        cores='1',
+                        time='1:00:00',
+                        jobname='MMBuildSigDict',
+                        threads='1'
+                    ))
+            build_sigdict.in_signatures = gen_sign_filter_subst.out_signatures
+            if self.estimate_resources:
+                create_sparse_train_cls = CreateSparseTrainDatasetSharedEstimated
+                create_sparse_test_cls = CreateSparseTestDatasetSharedEstimated
+            else:
+                create_sparse_train_cls = CreateSparseTrainDatasetShared
+                create_sparse_test_cls = CreateSparseTestDatasetShared
+        elif self.estimate_resources:
+            create_sparse_train_cls = CreateSparseTrainDatasetEstimated
+            create_sparse_test_cls = CreateSparseTestDatasetEstimated
+        else:
+            create_sparse_train_cls = CreateSparseTrainDataset
+            create_sparse_test_cls = CreateSparseTestDataset
+        # --------------------------------------------------------------------------------
+        create_unique_run_copy = self.new_task('create_unique_run_copy_%s' % self.run_id,
+                LinkRunCopy,
+                run_id = self.run_id)
+        create_unique_run_copy.in_file = gen_sign_filter_subst.out_signatures
+        # --------------------------------------------------------------------------------
+        # Fanned out per replicate and train size
+        # --------------------------------------------------------------------------------
+        for replicate_id in replicate_ids:
+            create_unique_sign_copy = self.new_task('create_unique_sign_copy_%s' % replicate_id, LinkReplicateCopy,
+                    replicate_id = replicate_id)
+            create_unique_sign_copy.in_file = create_unique_run_copy.out_copy
+            # --------------------------------------------------------------------------------
+            if self.nested_sampling:
+                sample_nested = self.new_task('sample_nested_tst%s_%s' % (self.test_size, replicate_id), SampleTrainAndTestNested,
                         replicate_id = replicate_id,
+                        dataset_name = self.dataset_name,
+                        test_size = self.test_size,
+                        train_sizes = ','.join(train_sizes),
                         slurminfo = sl.SlurmInfo(
                             runmode=runmode,
                             project=self.slurm_project,
                             partition='core',
                             cores='2',
                             time='1:00:00',
-                            jobname='sample_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id),
+                            jobname='sample_nested_tst%s_%s' % (self.test_size, replicate_id),
                             threads='1'
                         ))
-                sample_train_and_test.in_signatures = create_unique_sign_copy.out_copy
+                sample_nested.in_signatures = create_unique_sign_copy.out_copy
+            for train_size in train_sizes:
                 # --------------------------------------------------------------------------------
-                create_sparse_train_dataset = self.new_task('create_sparse_traindata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), CreateSparseTrainDataset,
+                if self.nested_sampling:
+                    traindata = dict_port(sample_nested.out_traindata, train_size)
+                    testdata = dict_port(sample_nested.out_testdata, train_size)
+                else:
+                    sample_train_and_test = self.new_task('sample_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), SampleTrainAndTest,
+                            test_size = self.test_size,
+                            train_size = train_size,
+                            sampling_method = self.sampling_method,
+                            dataset_name = self.dataset_name,
+                            replicate_id = replicate_id,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='2',
+                                time='1:00:00',
+                                jobname='sample_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id),
+                                threads='1'
+                            ))
+                    sample_train_and_test.in_signatures = create_unique_sign_copy.out_copy
+                    traindata = sample_train_and_test.out_traindata
+                    testdata = sample_train_and_test.out_testdata
+                # --------------------------------------------------------------------------------
+                create_sparse_train_dataset = self.new_task('create_sparse_traindata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), create_sparse_train_cls,
                         dataset_name = self.dataset_name,
                         replicate_id = replicate_id,
                         slurminfo = sl.SlurmInfo(
@@ -121,9 +252,11 @@ class MMWorkflow(sl.WorkflowTask):
                             jobname='MMCreateSparseTrain',
                             threads='8'
                         ))
-                create_sparse_train_dataset.in_traindata = sample_train_and_test.out_traindata
+                create_sparse_train_dataset.in_traindata = traindata
+                if self.shared_sigdict:
+                    create_sparse_train_dataset.in_dictionary = build_sigdict.out_dictionary
                 # ------------------------------------------------------------------------
-                create_sparse_test_dataset = self.new_task('create_sparse_testdata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), CreateSparseTestDataset,
+                create_sparse_test_dataset = self.new_task('create_sparse_testdata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), create_sparse_test_cls,
                         dataset_name = self.dataset_name,
                         replicate_id = replicate_id,
                         slurminfo = sl.SlurmInfo(
@@ -135,37 +268,15 @@ class MMWorkflow(sl.WorkflowTask):
                             jobname='sparse_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
                             threads='8'
                         ))
-                create_sparse_test_dataset.in_testdata = sample_train_and_test.out_testdata
+                create_sparse_test_dataset.in_testdata = testdata
                 create_sparse_test_dataset.in_signatures = create_sparse_train_dataset.out_signatures
                 # ------------------------------------------------------------------------
-                ungzip_testdata = self.new_task('ungzip_testdata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), UnGzipFile,
-                        slurminfo = sl.SlurmInfo(
-                            runmode=runmode,
-                            project=self.slurm_project,
-                            partition='core',
-                            cores='1',
-                            time='1:00:00',
-                            jobname='ungziptest_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
-                            threads='1'
-                        ))
-                ungzip_testdata.in_gzipped = create_sparse_test_dataset.out_sparse_testdata
-                # ------------------------------------------------------------------------
-                ungzip_traindata = self.new_task('ungzip_traindata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), UnGzipFile,
-                        slurminfo = sl.SlurmInfo(
-                            runmode=runmode,
-                            project=self.slurm_project,
-                            partition='core',
-                            cores='1',
-                            time='1:00:00',
-                            jobname='ungziptrain_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
-                            threads='1'
-                        ))
-                ungzip_traindata.in_gzipped = create_sparse_train_dataset.out_sparse_traindata
                 # ========================================================================
                 # START: ALTERNATIVE TRAINING METHODS
                 # ========================================================================
                 if self.train_method == TRAINMETHOD_LIBLINEAR:
-                    train_model = self.new_task('train_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), TrainLinearModel,
+                # ========================================================================
+                    train_model = self.new_task('train_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), train_lin_cls,
                             replicate_id = replicate_id,
                             dataset_name = self.dataset_name,
                             train_size = train_size,
@@ -181,9 +292,9 @@ class MMWorkflow(sl.WorkflowTask):
                                 jobname='trainlin_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
                                 threads='1'
                             ))
-                    train_model.in_traindata = ungzip_traindata.out_ungzipped
+                    train_model.in_traindata = create_sparse_train_dataset.out_sparse_traindata
                     # ------------------------------------------------------------------------
-                    predict = self.new_task('predict_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), PredictLinearModel,
+                    predict = self.new_task('predict_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), PredictLinearModelGzipped,
                             dataset_name = self.dataset_name,
                             replicate_id = replicate_id,
                             slurminfo = sl.SlurmInfo(
@@ -196,14 +307,14 @@ class MMWorkflow(sl.WorkflowTask):
                                 threads='1'
                             ))
                     predict.in_model = train_model.out_model
-                    predict.in_sparse_testdata = ungzip_testdata.out_ungzipped
+                    predict.in_sparse_testdata = create_sparse_test_dataset.out_sparse_testdata
                     # ------------------------------------------------------------------------
-                    assess_model = self.new_task('assess_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), AssessLinearRMSD,
+                    assess_model = self.new_task('assess_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), AssessLinearRMSDGzipped,
                             dataset_name = self.dataset_name,
                             replicate_id = replicate_id,
                             lin_cost = self.lin_cost,
                             slurminfo = sl.SlurmInfo(
-                                runmode=runmode,
+                                runmode=micro_runmode,
                                 project=self.slurm_project,
                                 partition='core',
                                 cores='1',
@@ -227,51 +338,174 @@ class MMWorkflow(sl.WorkflowTask):
                         runmode_train = sl.RUNMODE_MPI
                     else:
                         runmode_train = sl.RUNMODE_LOCAL
-                    train_model = self.new_task('train_svm_trn%s_tst%s_g%s_c%s_%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost, replicate_id), 
-                            TrainSVMModel,
-                            replicate_id = replicate_id,
-                            dataset_name = self.dataset_name,
-                            train_size = train_size,
-                            svm_gamma = '0.001',
-                            svm_cost = '100',
-                            svm_type = '3',
-                            svm_kernel_type = '2',
-                            parallel_train = self.parallel_svm_train,
-                            slurminfo = sl.SlurmInfo(
-                                runmode=runmode_train,
-                                project=self.slurm_project,
-                                partition='node',
-                                cores='64',
-                                time=runtime,
-                                jobname='trainsvm_tr%s_ts%s_g%s_c%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost),
-                                threads='64' # Not used!
-                            ))
-                    train_model.in_traindata = ungzip_traindata.out_ungzipped
-                    # ------------------------------------------------------------------------
-                    # Save task creating train set for coloring
-                    # ------------------------------------------------------------------------
-                    if train_size == '80000' or train_size == '2048': # The 2048 is used in the test script only!
-                        coloring_train_data_task = ungzip_traindata
-                        coloring_train_task = train_model
+                    if self.svm_cascade_shards > 1:
+                        # Cascade: one SVM per shard, then pairwise merges of the support vectors
+                        split_traindata = self.new_task('split_traindata_trn%s_tst%s_%s' % (train_size, self.test_size, replicate_id), SplitTrainData,
+                                shards_count = self.svm_cascade_shards,
+                                slurminfo = sl.SlurmInfo(
+                                    runmode=micro_runmode,
+                                    project=self.slurm_project,
+                                    partition='core',
+                                    cores='1',
+                                    time='1:00:00',
+                                    jobname='splittrain_trn%s_tst%s' % (train_size, self.test_size),
+                                    threads='1'
+                                ))
+                        split_traindata.in_traindata = create_sparse_train_dataset.out_sparse_traindata
+                        layer = []
+                        for i in xrange(self.svm_cascade_shards):
+                            train_shard = self.new_task('train_svm_cascade_l1_%02d_trn%s_tst%s_g%s_c%s_%s' % (i + 1, train_size, self.test_size, self.svm_gamma, self.svm_cost, replicate_id),
+                                    train_svm_cls,
+                                    replicate_id = replicate_id,
+                                    dataset_name = self.dataset_name,
+                                    train_size = train_size,
+                                    svm_gamma = self.svm_gamma,
+                                    svm_cost = self.svm_cost,
+                                    svm_type = self.svm_type,
+                                    svm_kernel_type = self.svm_kernel_type,
+                                    parallel_train = False,
+                                    slurminfo = sl.SlurmInfo(
+                                        runmode=runmode,
+                                        project=self.slurm_project,
+                                        partition='core',
+                                        cores='1',
+                                        time=runtime,
+                                        jobname='trainsvm_l1_%02d_tr%s_ts%s' % (i + 1, train_size, self.test_size),
+                                        threads='1'
+                                    ))
+                            train_shard.in_traindata = dict_port(split_traindata.out_shards, i)
+                            layer.append((train_shard, train_shard.in_traindata))
+                        layer_traintimes = []
+                        layer_idx = 1
+                        while len(layer) > 1:
+                            layer_traintimes.append([t.out_traintime for t, _ in layer])
+                            layer_idx += 1
+                            last_layer = len(layer) <= 2
+                            next_layer = []
+                            for j in xrange(0, len(layer), 2):
+                                pair = layer[j:j+2]
+                                merge_sv = self.new_task('merge_sv_l%d_%02d_trn%s_tst%s_%s' % (layer_idx, j/2 + 1, train_size, self.test_size, replicate_id), MergeSupportVectors,
+                                        layer = layer_idx,
+                                        index = j/2 + 1,
+                                        slurminfo = sl.SlurmInfo(
+                                            runmode=micro_runmode,
+                                            project=self.slurm_project,
+                                            partition='core',
+                                            cores='1',
+                                            time='1:00:00',
+                                            jobname='mergesv_l%d_%02d_tr%s_ts%s' % (layer_idx, j/2 + 1, train_size, self.test_size),
+                                            threads='1'
+                                        ))
+                                merge_sv.in_models = [t.out_model for t, _ in pair]
+                                merge_sv.in_traindata = [d for _, d in pair]
+                                merge_sv.in_basedata = create_sparse_train_dataset.out_sparse_traindata
+                                if last_layer:
+                                    train_merged = self.new_task('train_svm_trn%s_tst%s_g%s_c%s_%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost, replicate_id),
+                                            TrainSVMModelCascade,
+                                            layers = layer_idx,
+                                            replicate_id = replicate_id,
+                                            dataset_name = self.dataset_name,
+                                            train_size = train_size,
+                                            svm_gamma = self.svm_gamma,
+                                            svm_cost = self.svm_cost,
+                                            svm_type = self.svm_type,
+                                            svm_kernel_type = self.svm_kernel_type,
+                                            parallel_train = self.parallel_svm_train,
+                                            slurminfo = sl.SlurmInfo(
+                                                runmode=runmode_train,
+                                                project=self.slurm_project,
+                                                partition='node',
+                                                cores='64',
+                                                time=runtime,
+                                                jobname='trainsvm_tr%s_ts%s_g%s_c%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost),
+                                                threads='64' # Not used!
+                                            ))
+                                    train_merged.in_layer_traintimes = layer_traintimes
+                                    train_merged.in_basedata = create_sparse_train_dataset.out_sparse_traindata
+                                else:
+                                    train_merged = self.new_task('train_svm_cascade_l%d_%02d_trn%s_tst%s_g%s_c%s_%s' % (layer_idx, j/2 + 1, train_size, self.test_size, self.svm_gamma, self.svm_cost, replicate_id),
+                                            train_svm_cls,
+                                            replicate_id = replicate_id,
+                                            dataset_name = self.dataset_name,
+                                            train_size = train_size,
+                                            svm_gamma = self.svm_gamma,
+                                            svm_cost = self.svm_cost,
+                                            svm_type = self.svm_type,
+                                            svm_kernel_type = self.svm_kernel_type,
+                                            parallel_train = False,
+                                            slurminfo = sl.SlurmInfo(
+                                                runmode=runmode,
+                                                project=self.slurm_project,
+                                                partition='core',
+                                                cores='1',
+                                                time=runtime,
+                                                jobname='trainsvm_l%d_%02d_tr%s_ts%s' % (layer_idx, j/2 + 1, train_size, self.test_size),
+                                                threads='1'
+                                            ))
+                                train_merged.in_traindata = merge_sv.out_traindata
+                                next_layer.append((train_merged, merge_sv.out_traindata))
+                            layer = next_layer
+                        train_model = layer[0][0]
+                    else:
+                        if self.parallel_svm_train:
+                            # The parallel svm-train seeks in its train set, so it needs an ungzipped copy
+                            ungzip_traindata = self.new_task('ungzip_traindata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), UnGzipFile,
+                                    slurminfo = sl.SlurmInfo(
+                                        runmode=micro_runmode,
+                                        project=self.slurm_project,
+                                        partition='core',
+                                        cores='1',
+                                        time='1:00:00',
+                                        jobname='ungziptrain_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
+                                        threads='1'
+                                    ))
+                            ungzip_traindata.in_gzipped = create_sparse_train_dataset.out_sparse_traindata
+                            train_single_cls = train_svm_cls
+                            runmode_single = runmode_train
+                            svm_traindata = ungzip_traindata.out_ungzipped
+                        else:
+                            train_single_cls = train_svm_gzipped_cls
+                            runmode_single = runmode
+                            svm_traindata = create_sparse_train_dataset.out_sparse_traindata
+                        train_model = self.new_task('train_svm_trn%s_tst%s_g%s_c%s_%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost, replicate_id), 
+                                train_single_cls,
+                                replicate_id = replicate_id,
+                                dataset_name = self.dataset_name,
+                                train_size = train_size,
+                                svm_gamma = self.svm_gamma,
+                                svm_cost = self.svm_cost,
+                                svm_type = self.svm_type,
+                                svm_kernel_type = self.svm_kernel_type,
+                                parallel_train = self.parallel_svm_train,
+                                slurminfo = sl.SlurmInfo(
+                                    runmode=runmode_single,
+                                    project=self.slurm_project,
+                                    partition='node',
+                                    cores='64',
+                                    time=runtime,
+                                    jobname='trainsvm_tr%s_ts%s_g%s_c%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost),
+                                    threads='64' # Not used!
+                                ))
+                        train_model.in_traindata = svm_traindata
                     # ------------------------------------------------------------------------
                     predict = self.new_task('predict_svm_trn%s_tst%s_g%s_c%s_%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost, replicate_id),
-                            PredictSVMModel,
+                            predict_svm_cls,
                             dataset_name = self.dataset_name,
                             replicate_id = replicate_id,
                             slurminfo = sl.SlurmInfo(
                                 runmode=runmode,
                                 project=self.slurm_project,
                                 partition='core',
-                                cores='1',
+                                cores=predict_svm_cores,
                                 time='4:00:00',
                                 jobname='predlin_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
-                                threads='1'
+                                threads=predict_svm_cores
                             ))
                     predict.in_svmmodel = train_model.out_model
-                    predict.in_sparse_testdata = ungzip_testdata.out_ungzipped
+                    predict.in_sparse_testdata = create_sparse_test_dataset.out_sparse_testdata
                     # ------------------------------------------------------------------------
                     assess_model = self.new_task('assess_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id),
-                            AssessSVMRMSD,
+                            AssessSVMRMSDGzipped,
                             dataset_name = self.dataset_name,
                             replicate_id = replicate_id,
                             svm_cost = self.svm_cost,
@@ -279,7 +513,7 @@ class MMWorkflow(sl.WorkflowTask):
                             svm_type = self.svm_type,
                             svm_kernel_type = self.svm_kernel_type,
                             slurminfo = sl.SlurmInfo(
-                                runmode=runmode,
+                                runmode=micro_runmode,
                                 project=self.slurm_project,
                                 partition='core',
                                 cores='1',
@@ -288,19 +522,58 @@ class MMWorkflow(sl.WorkflowTask):
                                 threads='1'
                             ))
                 # ========================================================================
+                elif self.train_method == TRAINMETHOD_APPROXRBF:
+                # ========================================================================
+                    train_model = self.new_task('train_approx_trn%s_tst%s_g%s_c%s_m%d_%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost, self.approx_landmarks, replicate_id),
+                            train_approx_cls,
+                            replicate_id = replicate_id,
+                            svm_gamma = self.svm_gamma,
+                            svm_cost = self.svm_cost,
+                            landmarks = self.approx_landmarks,
+                            kernel_cache = self.kernel_cache,
+                            kernel_cache_mb = self.kernel_cache_mb,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='4',
+                                time='1-00:00:00',
+                                jobname='trainapprox_tr%s_ts%s_g%s_c%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost),
+                                threads='4'
+                            ))
+                    train_model.in_traindata = create_sparse_train_dataset.out_sparse_traindata
+                    # ------------------------------------------------------------------------
+                    predict = self.new_task('predict_approx_trn%s_tst%s_g%s_c%s_m%d_%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost, self.approx_landmarks, replicate_id),
+                            PredictApproxRBFModel,
+                            replicate_id = replicate_id,
+                            svm_cost = self.svm_cost,
+                            slurminfo = sl.SlurmInfo(
+                                runmode=runmode,
+                                project=self.slurm_project,
+                                partition='core',
+                                cores='1',
+                                time='4:00:00',
+                                jobname='predapprox_trn%s_tst%s_c%s' % (train_size, self.test_size, self.svm_cost),
+                                threads='1'
+                            ))
+                    predict.in_model = train_model.out_model
+                    predict.in_sparse_testdata = create_sparse_test_dataset.out_sparse_testdata
+                    assessment = predict.out_assessment
+                # ========================================================================
                 # END: ALTERNATIVE TRAINING METHODS
                 # ========================================================================
 
-
-                assess_model.in_prediction = predict.out_prediction
-                assess_model.in_model = ungzip_traindata.out_ungzipped
-                assess_model.in_sparse_testdata = ungzip_testdata.out_ungzipped
+                if self.train_method in [TRAINMETHOD_LIBLINEAR, TRAINMETHOD_SVMRBF]:
+                    assess_model.in_prediction = predict.out_prediction
+                    assess_model.in_model = create_sparse_train_dataset.out_sparse_traindata
+                    assess_model.in_sparse_testdata = create_sparse_test_dataset.out_sparse_testdata
+                    assessment = assess_model.out_assessment
                 # ------------------------------------------------------------------------
                 count_trainsize_filtered = self.new_task('count_trainsize_filtered_svmrbf_%s_trn%s_tst%s_%s' % (self.dataset_name, train_size, self.test_size, replicate_id),
                         CountLines,
                         ungzip=True,
                         slurminfo = sl.SlurmInfo(
-                            runmode=runmode,
+                            runmode=micro_runmode,
                             project=self.slurm_project,
                             partition='core',
                             cores='1',
@@ -308,7 +581,7 @@ class MMWorkflow(sl.WorkflowTask):
                             jobname='count_trainsize_filtered_svmrbf_%s_trn%s_tst%s_%s' % (self.dataset_name, train_size, self.test_size, replicate_id),
                             threads='1'
                         ))
-                count_trainsize_filtered.in_file = sample_train_and_test.out_traindata
+                count_trainsize_filtered.in_file = traindata
                 # ------------------------------------------------------------------------
                 collect_datarow = self.new_task('collect_datarow_svmrbf_%s_trn%s_tst%s_%s' % (self.dataset_name, train_size, self.test_size, replicate_id),
                         CollectDataReportRow,
@@ -318,7 +591,7 @@ class MMWorkflow(sl.WorkflowTask):
                         replicate_id = replicate_id,
                         lin_cost = self.lin_cost,
                         slurminfo = sl.SlurmInfo(
-                            runmode=runmode,
+                            runmode=micro_runmode,
                             project=self.slurm_project,
                             partition='core',
                             cores='1',
@@ -326,7 +599,7 @@ class MMWorkflow(sl.WorkflowTask):
                             jobname='datarow_svmrbf_%s_trn%s_tst%s_%s' % (self.dataset_name, train_size, self.test_size, replicate_id),
                             threads='1'
                         ))
-                collect_datarow.in_rmsd = assess_model.out_assessment
+                collect_datarow.in_rmsd = assessment
                 collect_datarow.in_traintime = train_model.out_traintime
                 collect_datarow.in_trainsize_filtered = count_trainsize_filtered.out_linecount
                 # ------------------------------------------------------------------------
@@ -337,44 +610,10 @@ class MMWorkflow(sl.WorkflowTask):
                 train_method = self.train_method)
         datareport.in_datareport_rows = [dr.out_datareport_row for dr in datareport_rows]
 
-        # ========================================================================
-        # START: CALCULATECOLORING INDEX VALUES
-        # ========================================================================
-        if coloring_train_data_task is not None and coloring_train_task is not None:
-            predict_train = self.new_task('predict_train',
-                    PredictSVMModel,
-                    dataset_name = self.dataset_name,
-                    replicate_id = replicate_id,
-                    slurminfo = sl.SlurmInfo(
-                        runmode=runmode,
-                        project=self.slurm_project,
-                        partition='core',
-                        cores='1',
-                        time='4:00:00',
-                        jobname='predict_train',
-                        threads='1'
-                    ))
-            predict_train.in_svmmodel = coloring_train_task.out_model
-            predict_train.in_sparse_testdata = coloring_train_data_task.out_ungzipped
-            # ------------------------------------------------------------------------
-            select_idx10 = self.new_task('select_idx10',
-                    SelectPercentIndexValue,
-                    percent_index=10)
-            select_idx10.in_prediction = predict_train.out_prediction
-            # ------------------------------------------------------------------------
-            select_idx90 = self.new_task('select_idx90',
-                    SelectPercentIndexValue,
-                    percent_index=90)
-            select_idx90.in_prediction = predict_train.out_prediction
-        # ------------------------------------------------------------------------
-        # return [select_idx10, select_idx90]
-        # ========================================================================
-        # END: CALCULATECOLORING INDEX VALUES
-        # ========================================================================
-
         return datareport
 
 # ====================================================================================================
 
 if __name__ == '__main__':
+    mmaudit.enable_audit_store()
     sl.run_local()
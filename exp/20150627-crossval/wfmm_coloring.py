@@ -1,5 +1,7 @@
 from mmcomp import *
+from mmcompext import AssessLinearRMSDGzipped, AssessSVMRMSDGzipped, PredictLinearModelGzipped, PredictSVMModelGzipped, TrainLinearModelGzipped, TrainSVMModelGzipped
 import luigi
+import mmaudit
 import sciluigi as sl
 import time
 
@@ -36,6 +38,7 @@ class MMWorkflow(sl.WorkflowTask):
     slurm_project = luigi.Parameter()
     parallel_lin_train = luigi.BooleanParameter()
     parallel_svm_train = luigi.BooleanParameter()
+    batched_svm_predict = luigi.BooleanParameter() # Predict with the SVM models on 8 cores instead of 1 (see PredictSVMModelBatched)
     runmode = luigi.Parameter()
     #folds_count = luigi.Parameter()
 
@@ -48,12 +51,13 @@ class MMWorkflow(sl.WorkflowTask):
             runmode = sl.RUNMODE_MPI
         else:
             raise Exception('Runmode is none of local, hpc, nor mpi. Please fix and try again!')
+        if self.batched_svm_predict:
+            predict_svm_cores = '8'
+        else:
+            predict_svm_cores = '1'
 
         datareport_rows = []
 
-        coloring_train_data_task = None
-        coloring_train_task = None
-
         if self.replicate_id is not None:
             replicate_ids = [self.replicate_id]
         elif self.replicate_ids is not None:
@@ -138,34 +142,11 @@ class MMWorkflow(sl.WorkflowTask):
                 create_sparse_test_dataset.in_testdata = sample_train_and_test.out_testdata
                 create_sparse_test_dataset.in_signatures = create_sparse_train_dataset.out_signatures
                 # ------------------------------------------------------------------------
-                ungzip_testdata = self.new_task('ungzip_testdata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), UnGzipFile,
-                        slurminfo = sl.SlurmInfo(
-                            runmode=runmode,
-                            project=self.slurm_project,
-                            partition='core',
-                            cores='1',
-                            time='1:00:00',
-                            jobname='ungziptest_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
-                            threads='1'
-                        ))
-                ungzip_testdata.in_gzipped = create_sparse_test_dataset.out_sparse_testdata
-                # ------------------------------------------------------------------------
-                ungzip_traindata = self.new_task('ungzip_traindata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), UnGzipFile,
-                        slurminfo = sl.SlurmInfo(
-                            runmode=runmode,
-                            project=self.slurm_project,
-                            partition='core',
-                            cores='1',
-                            time='1:00:00',
-                            jobname='ungziptrain_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
-                            threads='1'
-                        ))
-                ungzip_traindata.in_gzipped = create_sparse_train_dataset.out_sparse_traindata
                 # ========================================================================
                 # START: ALTERNATIVE TRAINING METHODS
                 # ========================================================================
                 if self.train_method == TRAINMETHOD_LIBLINEAR:
-                    train_model = self.new_task('train_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), TrainLinearModel,
+                    train_model = self.new_task('train_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), TrainLinearModelGzipped,
                             replicate_id = replicate_id,
                             dataset_name = self.dataset_name,
                             train_size = train_size,
@@ -181,9 +162,9 @@ class MMWorkflow(sl.WorkflowTask):
                                 jobname='trainlin_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
                                 threads='1'
                             ))
-                    train_model.in_traindata = ungzip_traindata.out_ungzipped
+                    train_model.in_traindata = create_sparse_train_dataset.out_sparse_traindata
                     # ------------------------------------------------------------------------
-                    predict = self.new_task('predict_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), PredictLinearModel,
+                    predict = self.new_task('predict_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), PredictLinearModelGzipped,
                             dataset_name = self.dataset_name,
                             replicate_id = replicate_id,
                             slurminfo = sl.SlurmInfo(
@@ -196,9 +177,9 @@ class MMWorkflow(sl.WorkflowTask):
                                 threads='1'
                             ))
                     predict.in_model = train_model.out_model
-                    predict.in_sparse_testdata = ungzip_testdata.out_ungzipped
+                    predict.in_sparse_testdata = create_sparse_test_dataset.out_sparse_testdata
                     # ------------------------------------------------------------------------
-                    assess_model = self.new_task('assess_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), AssessLinearRMSD,
+                    assess_model = self.new_task('assess_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), AssessLinearRMSDGzipped,
                             dataset_name = self.dataset_name,
                             replicate_id = replicate_id,
                             lin_cost = self.lin_cost,
@@ -227,8 +208,28 @@ class MMWorkflow(sl.WorkflowTask):
                         runmode_train = sl.RUNMODE_MPI
                     else:
                         runmode_train = sl.RUNMODE_LOCAL
+                    if self.parallel_svm_train:
+                        # The parallel svm-train seeks in its train set, so it needs an ungzipped copy
+                        ungzip_traindata = self.new_task('ungzip_traindata_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id), UnGzipFile,
+                                slurminfo = sl.SlurmInfo(
+                                    runmode=runmode,
+                                    project=self.slurm_project,
+                                    partition='core',
+                                    cores='1',
+                                    time='1:00:00',
+                                    jobname='ungziptrain_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
+                                    threads='1'
+                                ))
+                        ungzip_traindata.in_gzipped = create_sparse_train_dataset.out_sparse_traindata
+                        train_svm_cls = TrainSVMModel
+                        runmode_single = runmode_train
+                        svm_traindata = ungzip_traindata.out_ungzipped
+                    else:
+                        train_svm_cls = TrainSVMModelGzipped
+                        runmode_single = runmode
+                        svm_traindata = create_sparse_train_dataset.out_sparse_traindata
                     train_model = self.new_task('train_svm_trn%s_tst%s_g%s_c%s_%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost, replicate_id), 
-                            TrainSVMModel,
+                            train_svm_cls,
                             replicate_id = replicate_id,
                             dataset_name = self.dataset_name,
                             train_size = train_size,
@@ -238,7 +239,7 @@ class MMWorkflow(sl.WorkflowTask):
                             svm_kernel_type = self.svm_kernel_type,
                             parallel_train = self.parallel_svm_train,
                             slurminfo = sl.SlurmInfo(
-                                runmode=runmode_train,
+                                runmode=runmode_single,
                                 project=self.slurm_project,
                                 partition='node',
                                 cores='64',
@@ -246,32 +247,26 @@ class MMWorkflow(sl.WorkflowTask):
                                 jobname='trainsvm_tr%s_ts%s_g%s_c%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost),
                                 threads='64' # Not used!
                             ))
-                    train_model.in_traindata = ungzip_traindata.out_ungzipped
-                    # ------------------------------------------------------------------------
-                    # Save task creating train set for coloring
-                    # ------------------------------------------------------------------------
-                    if train_size == '80000' or train_size == '2048': # The 2048 is used in the test script only!
-                        coloring_train_data_task = ungzip_traindata
-                        coloring_train_task = train_model
+                    train_model.in_traindata = svm_traindata
                     # ------------------------------------------------------------------------
                     predict = self.new_task('predict_svm_trn%s_tst%s_g%s_c%s_%s' % (train_size, self.test_size, self.svm_gamma, self.svm_cost, replicate_id),
-                            PredictSVMModel,
+                            PredictSVMModelGzipped,
                             dataset_name = self.dataset_name,
                             replicate_id = replicate_id,
                             slurminfo = sl.SlurmInfo(
                                 runmode=runmode,
                                 project=self.slurm_project,
                                 partition='core',
-                                cores='1',
+                                cores=predict_svm_cores,
                                 time='4:00:00',
                                 jobname='predlin_trn%s_tst%s_c%s' % (train_size, self.test_size, self.lin_cost),
-                                threads='1'
+                                threads=predict_svm_cores
                             ))
                     predict.in_svmmodel = train_model.out_model
-                    predict.in_sparse_testdata = ungzip_testdata.out_ungzipped
+                    predict.in_sparse_testdata = create_sparse_test_dataset.out_sparse_testdata
                     # ------------------------------------------------------------------------
                     assess_model = self.new_task('assess_lin_trn%s_tst%s_c%s_%s' % (train_size, self.test_size, self.lin_cost, replicate_id),
-                            AssessSVMRMSD,
+                            AssessSVMRMSDGzipped,
                             dataset_name = self.dataset_name,
                             replicate_id = replicate_id,
                             svm_cost = self.svm_cost,
@@ -293,8 +288,8 @@ class MMWorkflow(sl.WorkflowTask):
 
 
                 assess_model.in_prediction = predict.out_prediction
-                assess_model.in_model = ungzip_traindata.out_ungzipped
-                assess_model.in_sparse_testdata = ungzip_testdata.out_ungzipped
+                assess_model.in_model = create_sparse_train_dataset.out_sparse_traindata
+                assess_model.in_sparse_testdata = create_sparse_test_dataset.out_sparse_testdata
                 # ------------------------------------------------------------------------
                 count_trainsize_filtered = self.new_task('count_trainsize_filtered_svmrbf_%s_trn%s_tst%s_%s' % (self.dataset_name, train_size, self.test_size, replicate_id),
                         CountLines,
@@ -337,42 +332,6 @@ class MMWorkflow(sl.WorkflowTask):
                 train_method = self.train_method)
         datareport.in_datareport_rows = [dr.out_datareport_row for dr in datareport_rows]
 
-
-        # ========================================================================
-        # START: CALCULATECOLORING INDEX VALUES
-        # ========================================================================
-        if coloring_train_data_task is not None and coloring_train_task is not None:
-            predict_train = self.new_task('predict_train',
-                    PredictSVMModel,
-                    dataset_name = self.dataset_name,
-                    replicate_id = replicate_id,
-                    slurminfo = sl.SlurmInfo(
-                        runmode=runmode,
-                        project=self.slurm_project,
-                        partition='core',
-                        cores='1',
-                        time='4:00:00',
-                        jobname='predict_train',
-                        threads='1'
-                    ))
-            predict_train.in_svmmodel = coloring_train_task.out_model
-            predict_train.in_sparse_testdata = coloring_train_data_task.out_ungzipped
-            # ------------------------------------------------------------------------
-            select_idx10 = self.new_task('select_idx10',
-                    SelectPercentIndexValue,
-                    percent_index=10)
-            select_idx10.in_prediction = predict_train.out_prediction
-            # ------------------------------------------------------------------------
-            select_idx90 = self.new_task('select_idx90',
-                    SelectPercentIndexValue,
-                    percent_index=90)
-            select_idx90.in_prediction = predict_train.out_prediction
-        # ------------------------------------------------------------------------
-        # return [select_idx10, select_idx90]
-        # ========================================================================
-        # END: CALCULATECOLORING INDEX VALUES
-        # ========================================================================
-
         # ========================================================================
         # START: Tasks for creating Bioclipse Plugin
         # ========================================================================
@@ -405,4 +364,5 @@ class MMWorkflow(sl.WorkflowTask):
 # ====================================================================================================
 
 if __name__ == '__main__':
+    mmaudit.enable_audit_store()
     sl.run_local()
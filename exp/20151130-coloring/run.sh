@@ -1,4 +1,15 @@
 #!/bin/bash
+
+# Get directory path of current directory
+DIR=$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )
+
+projbin=$DIR/../../bin
+export PATH=$projbin:$PATH
+
+# Run the jars of the tasks in this job on one JVM worker (see bin/jvmserver)
+jvmserver start
+trap 'jvmserver stop' EXIT
+
 python wfcoloring.py \
     --runmode=local \
     --slurm-project=2015001 \
@@ -1,6 +1,10 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '20150627-crossval'))
 import sciluigi as sl
 import luigi
 import mmcomp as mm
+import mmcompext as mmext
 
 class ColoringWorkflow(sl.WorkflowTask):
     runmode = luigi.Parameter()
@@ -20,32 +24,27 @@ class ColoringWorkflow(sl.WorkflowTask):
             file_path='data/acd_logd.smi.h1_3.sign.r1.50000_80000_rand_trn.csr.ungz')
         # ------------------------------------------------------------------------
         predict_train = self.new_task('predict_train',
-                mm.PredictSVMModel,
+                mmext.PredictSVMModelBatched,
                 dataset_name = dataset_name,
                 replicate_id = replicate_id,
                 slurminfo = sl.SlurmInfo(
                     runmode=self.runmode,
                     project=self.slurm_project,
                     partition='core',
-                    cores='1',
+                    cores='8',
                     time='4:00:00',
                     jobname='predict_train',
-                    threads='1'
+                    threads='8'
                 ))
         predict_train.in_svmmodel = existing_svm_model.out_file
         predict_train.in_sparse_testdata = existing_traindata_ungzipped.out_file
         # ------------------------------------------------------------------------
-        select_idx10 = self.new_task('select_idx10',
-                mm.SelectPercentIndexValue,
-                percent_index=10)
-        select_idx10.in_prediction = predict_train.out_prediction
+        select_idx = self.new_task('select_idx10_90',
+                mmext.SelectPercentIndexValues,
+                percent_indexes='10,90')
+        select_idx.in_prediction = predict_train.out_prediction
         # ------------------------------------------------------------------------
-        select_idx90 = self.new_task('select_idx90',
-                mm.SelectPercentIndexValue,
-                percent_index=90)
-        select_idx90.in_prediction = predict_train.out_prediction
-        # ------------------------------------------------------------------------
-        return [select_idx10, select_idx90]
+        return select_idx
 
 if __name__ == '__main__':
     sl.run_local(main_task_cls=ColoringWorkflow)